@@ -5,12 +5,15 @@ import pandas as pd
 from binance.client import Client
 from docs.botconf import *
 import app
+from app.common.timeutils import strtofreq
+from .store import CandleStore
 
 ##### Globals ##################################################################
 
-# Holds all historic candle data. Loaded once at app init, new data is merged
-# in as needed.
-dfc = pd.DataFrame()
+# Holds all historic candle data, one preallocated buffer per (pair, freq).
+# Loaded once at app init, new data is merged in as needed. Rows per
+# buffer bounded by CANDLE_RETENTION.
+dfc = CandleStore(retention={strtofreq(k):v for k,v in CANDLE_RETENTION.items()})
 # Binance client for all modules in app.bot. Initialized in init as
 # singleton structure.
 client = None
@@ -22,10 +25,12 @@ lock = threading.Lock()
 def init(evnt_pairs):
     from app.common.timer import Timer
     from app.common.timeutils import strtofreq
-    from . import candles, scanner
+    from . import cache, candles, ledger, registry, scanner, symbols
     global client, dfc, e_pairs
 
     e_pairs = evnt_pairs
+    # Alert websock thread to update sockets on any pair change.
+    registry.subscribe(lambda version: e_pairs.set())
     t1 = Timer()
     db = app.get_db()
 
@@ -35,11 +40,15 @@ def init(evnt_pairs):
 
     # Get available exchange trade pairs
     info = client.get_exchange_info()
+    symbols.load([n['symbol'] for n in info['symbols']])
     ops = [ UpdateOne({'symbol':n['symbol']}, {'$set':n},
         upsert=True) for n in info['symbols'] ]
     db.assets.bulk_write(ops)
     #print("{} active pairs retrieved from api.".format(len(ops)))
 
+    # Candle history from last shutdown plus DB tail.
+    cache.load()
+
     set_pairs([], 'DISABLED', query_temp=True)
 
     #print("{:,} historic candles loaded.".format(len(dfc)))
@@ -48,41 +57,39 @@ def init(evnt_pairs):
 
 #------------------------------------------------------------------------------
 def get_pairs(with_temp=False):
-    query = {'botTradeStatus':{'$in':['ENABLED']}}
-
-    if with_temp is True:
-        query['botTradeStatus']['$in'].append('TEMP')
-
-    return set(n['symbol'] for n in list(app.db.assets.find(query)))
+    """Frozenset of ENABLED (and TEMP if @with_temp) pairs from the
+    in-memory registry.
+    """
+    from . import registry
+    return registry.get(with_temp=with_temp)
 
 #------------------------------------------------------------------------------
 def set_pairs(pairs, mode, exclusively=False, query_temp=False):
     """Set DB permissions for enabling/disabling trading of given pairs.
     """
     db = app.db
-    enabled, disabled, inverse, trading, ops = [],[],[],[],[]
+    enabled, disabled, inverse, trading = [],[],[],[]
+    # symbol -> new botTradeStatus. Later entries take precedence.
+    changes = {}
 
     pairs = set(pairs)
-    positions = set(n['pair'] for n in db.trades.find({'status':'open'}))
+    positions = ledger.pairs()
 
     if mode == 'ENABLED':
         enabled = pairs - positions
-        ops += [UpdateOne({'symbol':n}, {'$set':{'botTradeStatus':'ENABLED'}})\
-            for n in enabled]
+        changes.update({n:'ENABLED' for n in enabled})
     elif mode == 'DISABLED':
         disabled = pairs - positions
-        ops += [UpdateOne({'symbol':n}, {'$set':{'botTradeStatus':'DISABLED'}})\
-            for n in disabled]
+        changes.update({n:'DISABLED' for n in disabled})
 
     if exclusively is True:
         all_ = set(n['symbol'] for n in db.assets.find({'status':'TRADING'}))
         inverse = all_ - pairs - positions
-        ops += [UpdateOne({'symbol':n}, {'$set':{'botTradeStatus':'DISABLED'}})\
-            for n in inverse]
+        changes.update({n:'DISABLED' for n in inverse})
 
-    ops += [UpdateOne({'symbol':n}, {'$set':{'botTradeStatus':'TEMP'}})\
-        for n in positions]
-    ops = [n for n in ops if n is not None]
+    changes.update({n:'TEMP' for n in positions})
+    ops = [UpdateOne({'symbol':k}, {'$set':{'botTradeStatus':v}}) \
+        for k, v in changes.items()]
 
     lock.acquire()
     print("{} pair(s) enabled, {} disabled, {} temp."\
@@ -96,17 +103,17 @@ def set_pairs(pairs, mode, exclusively=False, query_temp=False):
         querylist += list(positions)
 
     # Query historic candle data + load.
-    for pair in querylist:
+    if len(querylist) > 0:
         lock.acquire()
-        print("Retrieving {} candles...".format(pair))
+        print("Retrieving {} candles...".format(", ".join(querylist)))
         lock.release()
-        candles.bulk_append_dfc(candles.api_update([pair], TRD_FREQS, silent=True))
+        candles.api_update(querylist, TRD_FREQS, silent=True)
 
-    # Update DB and alert websock thread to update sockets.
+    # Update DB and registry. Registry alerts websock thread to update
+    # sockets.
     if len(ops) > 0:
         result = db.assets.bulk_write(ops)
         #print("Updated {} DB permissions.".format(len(ops)))
-
-        e_pairs.set()
+        registry.update(changes)
 
     return (enabled,disabled,inverse,positions)
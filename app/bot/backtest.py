@@ -0,0 +1,382 @@
+# app.bot.backtest
+import logging
+from datetime import datetime
+import pytz
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+from dateparser import parse
+from bsonnumpy import sequence_to_ndarray
+from docs.conf import *
+from docs.botconf import *
+import app
+from . import candles, ledger, rules, signals, trade
+from app.common.timer import Timer
+from app.common.timeutils import strtofreq
+
+log = logging.getLogger('backtest')
+# Candle windows per signals.window_indicators call. Temporary arrays hold
+# WINDOW_CHUNK x history floats each.
+WINDOW_CHUNK = 4096
+
+#------------------------------------------------------------------------------
+class SimClient():
+    """Stand-in for app.bot.client during backtests. Quotes the order book
+    from the newest replayed close of each pair with a fixed @spread_pct.
+    """
+    def __init__(self, spread_pct=BACKTEST_SPREAD_PCT):
+        self.spread_pct = spread_pct
+        self.prices = {}
+
+    #--------------------------------------------------------------------------
+    def get_orderbook_ticker(self, symbol=None):
+        price = self.prices[symbol]
+        half = price * self.spread_pct / 200
+        return {
+            'symbol': symbol,
+            'bidPrice': str(price - half),
+            'bidQty': '1.0',
+            'askPrice': str(price + half),
+            'askQty': '1.0'
+        }
+
+#------------------------------------------------------------------------------
+def load_db(pairs, freqstrs, startstr, endstr=None):
+    """Candles from db.candles as a candles.dtype record array.
+    """
+    query = {
+        'pair': {'$in':pairs},
+        'freqstr': {'$in':freqstrs},
+        'open_time': {'$gte':parse(startstr)}
+    }
+    if endstr:
+        query['open_time']['$lte'] = parse(endstr)
+    proj = {k:True for k in candles.dtype.names}
+    proj['_id'] = False
+
+    batches = app.get_db().candles.find_raw_batches(query, proj)
+    return sequence_to_ndarray(batches, candles.dtype, batches.count())
+
+#------------------------------------------------------------------------------
+def load_file(path):
+    """Candles saved with save_file().
+    """
+    return np.load(path)
+
+#------------------------------------------------------------------------------
+def save_file(path, data):
+    np.save(path, data)
+
+#------------------------------------------------------------------------------
+class Sim():
+    """State of one backtest: the candles being replayed, their rule fields,
+    compiled rules, quotes, clock and book of positions. Stands in for the
+    candle store, client, ledger and active rules the live trade loop uses,
+    without touching them.
+    """
+    def __init__(self, data, history, spread_pct, algos, ema):
+        self.data = data
+        self.history = history
+        self.ema = ema
+        self.algos = algos
+        self.algo = {n['name']:n for n in algos}
+        self.ruleset = rules.compile_algos(algos)
+        self.client = SimClient(spread_pct)
+        self.now = None
+        # Positions: (pair, freqstr) -> [records], (freqstr, algo) -> record.
+        self.by_key, self.by_algo = {}, {}
+        self.closed = []
+        # _id -> row of the newest candle replayed for an open position.
+        self.last_row = {}
+
+        pairs, pair_idx = np.unique(data['pair'], return_inverse=True)
+        freqstrs, freq_idx = np.unique(data['freqstr'], return_inverse=True)
+        self.pairs = [n.decode('utf-8') for n in pairs]
+        self.freqstrs = [n.decode('utf-8') for n in freqstrs]
+        self.pair_idx, self.freq_idx = pair_idx, freq_idx
+        self.freq_ms = np.array([strtofreq(n) * 1000 for n in self.freqstrs])
+
+        # Rows of each (pair, freq) in open_time order, and each row's
+        # position among them.
+        key_idx = pair_idx * len(freqstrs) + freq_idx
+        by_key = np.lexsort((data['open_time'], key_idx))
+        self.key_rows = np.split(by_key,
+            np.flatnonzero(np.diff(key_idx[by_key])) + 1)
+        self.key_idx = np.empty(len(data), dtype=np.int64)
+        self.key_pos = np.empty(len(data), dtype=np.int64)
+        for i, rows in enumerate(self.key_rows):
+            self.key_idx[rows] = i
+            self.key_pos[rows] = np.arange(len(rows))
+
+    #--------------------------------------------------------------------------
+    def precompute(self):
+        """Rule fields of every candle over the @history rows ending at it,
+        and each algo's entry hits.
+        """
+        self.fields = {k: np.empty(len(self.data)) for k in signals.entry_fields}
+        for rows in self.key_rows:
+            for k, v in window_fields(self.data[rows], self.history,
+                self.ema).items():
+                self.fields[k][rows] = v
+
+        check_fields(self.ruleset)
+        self.hits = [rules.evaluate(n['name'], 'entry', self.fields,
+            self.ruleset) for n in self.algos]
+        self.any_hit = np.logical_or.reduce(self.hits)
+
+    #--------------------------------------------------------------------------
+    def candle(self, n):
+        """Candle dict of row @n, as the trade loop receives it.
+        """
+        row = self.data[n]
+        freq_ms = self.freq_ms[self.freq_idx[n]]
+        c = {k: float(row[k]) for k in ['open', 'close', 'high', 'low',
+            'trades', 'volume', 'buy_vol']}
+        c.update({
+            'open_time': to_dt(int(row['open_time'])),
+            'close_time': to_dt(int(row['open_time']) + freq_ms - 1),
+            'pair': self.pairs[self.pair_idx[n]],
+            'freqstr': self.freqstrs[self.freq_idx[n]],
+            'closed': True
+        })
+        return c
+
+    #--------------------------------------------------------------------------
+    def snapshot(self, n):
+        """trade.snapshot of row @n over the @history rows of its (pair, freq)
+        ending at it, as the live store would hold them.
+        """
+        rows = self.key_rows[self.key_idx[n]]
+        p = self.key_pos[n]
+        arr = self.data[rows[max(0, p - self.history + 1):p + 1]]
+        df = pd.DataFrame({k: arr[k].astype(np.float64) for k in candles.columns[3:]},
+            index=pd.DatetimeIndex(arr['open_time'].astype('datetime64[ms]')\
+                .astype('datetime64[ns]'), name='open_time'))
+        ss = trade.snapshot(self.candle(n), df=df, ema=self.ema)
+        ss['time'] = self.now
+        return ss
+
+    #--------------------------------------------------------------------------
+    def fields_snapshot(self, n):
+        """Snapshot of row @n from its precomputed rule fields only. Enough
+        for exit rules and trade stats, not stored in trade records.
+        """
+        values = {k: v[n] for k, v in self.fields.items()}
+        indicators = {k: values[k] for k in values if '.' not in k}
+        indicators['macd'] = {k[5:]: values[k] for k in values \
+            if k.startswith('macd.')}
+        return {'time': self.now, 'book': None, 'indicators': indicators,
+            'candle': {'close': float(self.data['close'][n]), 'closed': True}}
+
+    #--------------------------------------------------------------------------
+    def step(self, record, n):
+        """Update open position @record with its candle row @n, and exit it if
+        its algo says so. Mirrors trade.update_stats and trade.eval_exit.
+        """
+        ss = self.fields_snapshot(n)
+        record['stats'] = trade.fold_stats(record, ss)
+        record['snapshot_count'] += 1
+        self.last_row[record['_id']] = n
+
+        algo = self.algo[record['algo']]
+        section = trade.exit_section(record, ss['candle'], ss, algo,
+            self.ruleset)
+        if section is None:
+            return
+
+        ss = self.snapshot(n)
+        ss['book'] = trade.book(self.client, record['pair'])
+        ledger.apply(record, trade.close_update(record, ss, section, algo,
+            self.now, self.ruleset))
+        ledger.apply(record, {'$set': {'last':ss,
+            'snapshot_count':record['snapshot_count']+1}})
+
+        key = (record['pair'], record['freqstr'])
+        self.by_key[key].remove(record)
+        del self.by_algo[(record['freqstr'], record['algo'])]
+        del self.last_row[record['_id']]
+        self.closed.append(record)
+
+    #--------------------------------------------------------------------------
+    def enter(self, freqstr, batch):
+        """Open positions for candle rows @batch closing together on
+        @freqstr. Mirrors trade.eval_entries: each algo without an open
+        position on @freqstr buys its first hit.
+        """
+        for algo, hits in zip(self.algos, self.hits):
+            if (freqstr, algo['name']) in self.by_algo:
+                continue
+            hit = [n for n in batch if hits[n]]
+            if len(hit) == 0:
+                continue
+
+            n = hit[0]
+            ss = self.snapshot(n)
+            pair = ss['pair']
+            ss['book'] = trade.book(self.client, pair)
+            record = trade.open_record(ss, algo, guess_quote(pair), self.now,
+                self.ruleset)
+            record['_id'] = ObjectId()
+            record['snapshot_count'] = 1
+            record['stats'] = trade.fold_stats(record, ss)
+
+            self.by_key.setdefault((pair, freqstr), []).append(record)
+            self.by_algo[(freqstr, algo['name'])] = record
+            self.last_row[record['_id']] = n
+
+    #--------------------------------------------------------------------------
+    def open_trades(self):
+        """Open position records, their 'last' snapshot taken at the newest
+        candle replayed.
+        """
+        records = [n for group in self.by_key.values() for n in group]
+        for record in records:
+            n = self.last_row[record['_id']]
+            self.now = to_dt(int(self.data['open_time'][n]) + \
+                self.freq_ms[self.freq_idx[n]] - 1)
+            record['last'] = self.snapshot(n)
+        return records
+
+#------------------------------------------------------------------------------
+def run(data, history=BACKTEST_HIST_LEN, spread_pct=BACKTEST_SPREAD_PCT,
+    algos=None, ema=None):
+    """Replay closed candles in close_time order through the trade loop's
+    exit and entry logic, as evaluated at a candle close barrier. Orders
+    fill against SimClient quotes and pay BINANCE_PCT_FEE in
+    trade.close_update.
+    Rule fields of every candle are precomputed per (pair, freq) over the
+    @history rows ending at it, the frame the live store would hold, so the
+    replay only evaluates rules and steps positions. Full snapshots are
+    taken for trade records only.
+    All state lives in a Sim. The live candle store, client, ledger, rules
+    and macd streams are neither read nor replaced, so a backtest can run
+    alongside the trade loop. Nothing is read from or written to DB or the
+    exchange.
+    @data: candles.dtype record array (see load_db/load_file)
+    @history: candle rows kept per (pair, freq), like the live store
+    @algos: TRD_ALGOS style list to trade instead of botconf's
+    @ema: macd periods, default docs.conf macd_ema
+    Returns dict with 'trades' (trades document schema) and 'summary'.
+    """
+    t1 = Timer()
+    sim = Sim(data, history, spread_pct, TRD_ALGOS if algos is None else algos,
+        ema)
+    sim.precompute()
+    t_fields = t1.elapsed(unit='s')
+
+    close_time = data['open_time'] + sim.freq_ms[sim.freq_idx] - 1
+    order = np.argsort(close_time, kind='stable')
+    close_time = close_time[order]
+    bounds = np.append(np.flatnonzero(np.diff(close_time)) + 1, len(order))
+
+    pairs = [sim.pairs[n] for n in sim.pair_idx[order]]
+    freqstrs = [sim.freqstrs[n] for n in sim.freq_idx[order]]
+    closes = data['close'][order].tolist()
+    any_hit = sim.any_hit[order].tolist()
+    close_ms = close_time.tolist()
+    order = order.tolist()
+
+    i = 0
+    for j in bounds.tolist():
+        sim.now = to_dt(close_ms[i])
+        batches = {}
+        for m in range(i, j):
+            key = (pairs[m], freqstrs[m])
+            sim.client.prices[key[0]] = closes[m]
+            for record in list(sim.by_key.get(key, [])):
+                sim.step(record, order[m])
+            if any_hit[m]:
+                batches.setdefault(key[1], []).append(order[m])
+
+        for freqstr, batch in batches.items():
+            sim.enter(freqstr, batch)
+        i = j
+
+    records = sim.closed + sim.open_trades()
+    summary = summarize(records)
+    summary.update({
+        'candles': len(data),
+        'fields_s': round(t_fields, 2),
+        'elapsed_s': t1.elapsed(unit='s'),
+        'candles_per_min': int(len(data) / max(t1.elapsed(unit='s'), 0.001) * 60)
+    })
+    log.info("Backtest: %s", summary)
+    return {'trades':records, 'summary':summary}
+
+#------------------------------------------------------------------------------
+def window_fields(arr, history, ema=None):
+    """Rule fields (signals.entry_fields) at every candle of one (pair,
+    freq), each over the @history rows ending at it.
+    @arr: candles.dtype record array of the key in open_time order
+    Returns dict of field -> ndarray shaped like @arr.
+    """
+    pad = np.full(history - 1, np.nan)
+    cols = {k: np.concatenate((pad, arr[k].astype(np.float64))) \
+        for k in ['open', 'close', 'high', 'low', 'volume', 'buy_vol']}
+    fields = {k: np.empty(len(arr)) for k in signals.entry_fields}
+
+    for i in range(0, len(arr), WINDOW_CHUNK):
+        n = min(WINDOW_CHUNK, len(arr) - i)
+        win = {k: windows(v[i:], history, n) for k, v in cols.items()}
+        values = signals.window_indicators(win['close'], win['open'],
+            win['high'], win['low'], win['volume'], win['buy_vol'], ema=ema)
+        for k, v in values.items():
+            fields[k][i:i+n] = v
+    return fields
+
+#------------------------------------------------------------------------------
+def windows(values, rows, n):
+    """Read-only view of @n overlapping windows of @rows consecutive
+    @values, one per column. Column i starts at values[i].
+    """
+    step = values.strides[0]
+    return np.lib.stride_tricks.as_strided(values, shape=(rows, n),
+        strides=(step, step), writeable=False)
+
+#------------------------------------------------------------------------------
+def check_fields(ruleset):
+    """Raise ValueError if @ruleset reads fields a backtest doesn't compute:
+    entry rules may use signals.entry_fields, exit rules trade stats too.
+    """
+    stats = ['stats.{}'.format(k) for keys, fn in trade.stat_keys for k in keys]
+    missing = set()
+    for name, sections in ruleset.items():
+        for section, _rules in sections.items():
+            known = set(signals.entry_fields)
+            if section != 'entry':
+                known |= set(stats)
+            missing |= set(f for r in _rules for f in r.fields) - known
+    if len(missing) > 0:
+        raise ValueError("Rule fields not available in backtests: {}".format(
+            ', '.join(sorted(missing))))
+
+#------------------------------------------------------------------------------
+def summarize(records):
+    """Closed trade count, wins, win rate, total net gain and max drawdown
+    (of cumulative pct_net_gain in end_time order).
+    """
+    closed = sorted([n for n in records if n['status'] == 'closed'],
+        key=lambda n: n['end_time'])
+    gains = np.array([n['pct_net_gain'] for n in closed], dtype=np.float64)
+    equity = np.cumsum(gains)
+    drawdown = np.maximum.accumulate(np.append(0, equity))[1:] - equity
+
+    return {
+        'n_trades': len(closed),
+        'n_open': len(records) - len(closed),
+        'wins': int((gains > 0).sum()),
+        'win_rate': round(float((gains > 0).mean()) * 100, 1) if len(gains) else 0.0,
+        'net_gain': round(float(gains.sum()), 2),
+        'max_drawdown': round(float(drawdown.max()), 2) if len(gains) else 0.0
+    }
+
+#------------------------------------------------------------------------------
+def guess_quote(pair):
+    for quote in ['USDT', 'BTC', 'ETH', 'BNB']:
+        if pair.endswith(quote):
+            return quote
+    return None
+
+#------------------------------------------------------------------------------
+def to_dt(ms):
+    return datetime.fromtimestamp(ms / 1000, tz=pytz.utc)
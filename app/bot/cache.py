@@ -0,0 +1,112 @@
+# app.bot.cache
+import json
+import logging
+import os
+import shutil
+import numpy as np
+from docs.botconf import *
+import app, app.bot
+from . import symbols
+from .store import columns
+from app.common.timer import Timer
+from app.common.utils import to_dt, dt_to_ms, utc_datetime as now
+from app.common.timeutils import freqtostr
+
+log = logging.getLogger('cache')
+
+# On-disk columnar snapshot of the candle store, written on shutdown and
+# loaded on startup. One <pair>_<freqstr>.times.npy (datetime64[ns]) and
+# .values.npy (float64, store column order) per key, plus a manifest.
+MANIFEST = 'manifest.json'
+
+#------------------------------------------------------------------------------
+def save(path=CANDLE_CACHE_DIR):
+    """Write closed candles of every store key to @path. Built in a temp dir
+    and swapped in, so an interrupted save leaves the previous cache intact.
+    Returns number of candles written.
+    """
+    t1 = Timer()
+    tmp, old = path + '.tmp', path + '.old'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    store = app.bot.dfc
+    now_ns = np.datetime64(now().replace(tzinfo=None), 'ns')
+    manifest = {'saved':dt_to_ms(now()), 'columns':columns, 'keys':{}}
+    total = 0
+
+    for (pair, freq) in store.keys():
+        freqstr = freqtostr(freq)
+        name = '{}_{}'.format(pair, freqstr)
+        with store.lock:
+            buf = store.get(pair, freq)
+            times = buf.times[buf.start:buf.end]
+            # Drop the live (unclosed) candle.
+            n = np.searchsorted(times, now_ns - np.timedelta64(freq, 's'),
+                side='right')
+            if n == 0:
+                continue
+            np.save(os.path.join(tmp, name + '.times.npy'), times[:n])
+            np.save(os.path.join(tmp, name + '.values.npy'),
+                buf.values[buf.start:buf.start+n])
+            last = int(times[n-1].astype('datetime64[ms]').astype(np.int64))
+        manifest['keys'][name] = {'pair':pair, 'freqstr':freqstr, 'rows':int(n),
+            'last':last}
+        total += n
+
+    with open(os.path.join(tmp, MANIFEST), 'w') as f:
+        json.dump(manifest, f)
+
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, old)
+    os.rename(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+
+    log.info("{:,} candles, {} keys cached in {:,.0f} ms.".format(
+        total, len(manifest['keys']), t1.elapsed()))
+    return total
+
+#------------------------------------------------------------------------------
+def load(path=CANDLE_CACHE_DIR, tail=True):
+    """Merge cached candles into the store, then load from DB only the
+    candles persisted since each key's newest cached candle.
+    @tail: also query the DB tail
+    Returns number of cached candles loaded.
+    """
+    from . import candles
+    t1 = Timer()
+    try:
+        with open(os.path.join(path, MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        log.info("No candle cache at %s. e=%s", path, str(e))
+        return 0
+    if manifest.get('columns') != columns:
+        log.info("Candle cache columns changed, ignoring cache.")
+        return 0
+
+    store = app.bot.dfc
+    total = 0
+    # freqstr -> {pair: newest cached open_time ms}
+    lasts = {}
+
+    for name, key in manifest['keys'].items():
+        try:
+            times = np.load(os.path.join(path, name + '.times.npy'), mmap_mode='r')
+            values = np.load(os.path.join(path, name + '.values.npy'), mmap_mode='r')
+        except (OSError, ValueError) as e:
+            log.error("Cache key %s unreadable. e=%s", name, str(e))
+            continue
+        store.merge(key['pair'], symbols.freq(key['freqstr']), times, values)
+        lasts.setdefault(key['freqstr'], {})[key['pair']] = key['last']
+        total += len(times)
+
+    log.info("{:,} cached candles loaded in {:,.0f} ms.".format(total,
+        t1.elapsed()))
+
+    if tail:
+        for freqstr, pairs in lasts.items():
+            candles.bulk_load(list(pairs), [freqstr],
+                startdt=to_dt(min(pairs.values())/1000))
+        log.info("Cache + DB tail loaded in {:,.0f} ms.".format(t1.elapsed()))
+    return total
@@ -1,34 +1,55 @@
-# app.bot.candapp.bot.dfc
+# app.bot.candles
 import logging
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dateparser import parse
 import pandas as pd
 import numpy as np
 from pymongo import ReplaceOne
-from pymongo.errors import OperationFailure
 from bsonnumpy import sequence_to_ndarray
 from docs.conf import *
 from docs.botconf import *
 import app, app.bot
-from . import lock
+from . import lock, coverage, symbols, writer
 from app.common.timer import Timer
-from app.common.utils import strtodt, strtoms
+from app.common.ratelimit import TokenBucket
+from app.common.utils import strtodt, strtoms, to_dt
 from app.common.timeutils import strtofreq
 
 log = logging.getLogger('candles')
 
 columns = ['pair', 'freq', 'open_time', 'open', 'close', 'high', 'low',
     'trades', 'volume', 'buy_vol']
+# Fixed-size record layout of db.candles docs loaded with bsonnumpy.
+# open_time is ms since epoch.
+dtype = np.dtype([
+    ('pair', 'S12'),
+    ('freqstr', 'S3'),
+    ('open_time', np.int64),
+    ('open', np.float64),
+    ('close', np.float64),
+    ('high', np.float64),
+    ('low', np.float64),
+    ('buy_vol', np.float64),
+    ('volume', np.float64),
+    ('trades', np.int32)
+])
+# Shared Binance request weight budget for all REST kline queries.
+bucket = TokenBucket(BINANCE_REQ_WEIGHT_LIMIT, per=60)
+# Progress metrics of the last api_update backfill.
+stats = {}
+stats_lock = threading.Lock()
+# pair -> epoch secs since the pair was first seen neither enabled nor held.
+inactive_since = {}
 
 #------------------------------------------------------------------------------
 def bulk_load(pairs, freqstrs, startstr=None, startdt=None):
-    """Merge only newly updated DB records into dataframe to avoid ~150k
+    """Merge only newly updated DB records into candle store to avoid ~150k
     DB reads every main loop.
     """
     db = app.get_db()
     t1 = Timer()
-    columns = ['open', 'close', 'high', 'low', 'trades', 'volume', 'buy_vol']
     exclude = ['_id', 'quote_vol','sell_vol', 'close_time']
     proj = dict(zip(exclude, [False]*len(exclude)))
     query = {
@@ -46,18 +67,6 @@ def bulk_load(pairs, freqstrs, startstr=None, startdt=None):
         print("No db matches for query {}.".format(query))
         return app.bot.dfc
 
-    dtype = np.dtype([
-        ('pair', 'S12'),
-        ('freqstr', 'S3'),
-        ('open_time', np.int64),
-        ('open', np.float64),
-        ('close', np.float64),
-        ('high', np.float64),
-        ('low', np.float64),
-        ('buy_vol', np.float64),
-        ('volume', np.float64),
-        ('trades', np.int32)
-    ])
     # Bulk load mongodb records into predefined, fixed-size numpy array.
     # 10x faster than manually casting mongo cursor into python list.
     try:
@@ -66,53 +75,53 @@ def bulk_load(pairs, freqstrs, startstr=None, startdt=None):
         print(str(e))
         return app.bot.dfc
 
-    # Build multi-index dataframe from ndarray
-    df = pd.DataFrame(ndarray)
-    df['open_time'] = pd.to_datetime(df['open_time'], unit='ms')
-    df['freqstr'] = df['freqstr'].str.decode('utf-8')
-    df['pair'] = df['pair'].str.decode('utf-8')
-    # Convert freqstr->freq to enable index sorting
-    df = df.rename(columns={'freqstr':'freq'})
-    [df['freq'].replace(n, strtofreq(n), inplace=True) for n in TRD_FREQS]
-    df.sort_values(by=['pair','freq','open_time'], inplace=True)
-
-    dfc = pd.DataFrame(df[columns].values,
-        index = pd.MultiIndex.from_arrays(
-            [df['pair'], df['freq'], df['open_time']],
-            names = ['pair','freq','open_time']),
-        columns = columns
-    ).sort_index()
-
-    n_bulk = len(dfc)
-
-    app.bot.dfc = pd.concat([app.bot.dfc, dfc])
-    app.bot.dfc = app.bot.dfc[~app.bot.dfc.index.duplicated(keep='first')]
-
-    n_merged = len(dfc) - n_bulk
+    n_merged = merge_ndarray(ndarray)
 
     log.debug("{:,} docs loaded, {:,} merged in {:,.1f} ms."\
-        .format(n_bulk, n_merged, t1))
+        .format(len(ndarray), n_merged, t1))
 
     return app.bot.dfc
 
 #------------------------------------------------------------------------------
-def bulk_save(data, silent=False):
-    """db.candles collection has unique index on (pair, freq, open_time) key
-    so we can bulk insert without having to check for duplicates. Just need
-    to set ordered=False and catch the exception, but every item insert
-    will be attempted. May still be slow performance-wise...
+def merge_ndarray(ndarray):
+    """Merge dtype record array @ndarray into the candle store. Splits it
+    into contiguous (pair, freq) blocks and merges each into its store
+    buffer.
+    Returns number of new rows.
+    """
+    # lexsort on the key columns is ~4x faster than a structured sort.
+    ndarray = ndarray[np.lexsort((ndarray['open_time'], ndarray['freqstr'],
+        ndarray['pair']))]
+    pairs_, freqstrs_ = ndarray['pair'], ndarray['freqstr']
+    bounds = np.flatnonzero((pairs_[1:] != pairs_[:-1]) |
+        (freqstrs_[1:] != freqstrs_[:-1])) + 1
+    n_before = len(app.bot.dfc)
+
+    for block in np.split(ndarray, bounds):
+        if len(block) == 0:
+            continue
+        pair = block['pair'][0].decode('utf-8')
+        freq = strtofreq(block['freqstr'][0].decode('utf-8'))
+        app.bot.dfc.merge(pair, freq,
+            block['open_time'].astype('datetime64[ms]'),
+            np.stack([block[n] for n in columns[3:]], axis=1).astype(np.float64))
+
+    return len(app.bot.dfc) - n_before
+
+#------------------------------------------------------------------------------
+def bulk_save(data, silent=False, wait=False):
+    """Queue candles for the DB writer thread. Closed candles already
+    persisted (per the writer's last saved open_time and coverage index)
+    are dropped in memory instead of being rejected by the unique
+    (pair, freq, open_time) index; unclosed candles are never saved.
+    @wait: block until queued candles are written
     """
     t1 = Timer()
-    n_insert = None
-    try:
-        result = app.get_db().candles.insert_many(data, ordered=False)
-    except OperationFailure as e:
-        n_insert = len(data) - len(e.details['writeErrors'])
-        #print(e.details['writeErrors'][0])
-    else:
-        n_insert = len(result.inserted_ids)
-
-    msg = "Saved {}/{} new records. [{} ms]".format(n_insert, len(data), t1)
+    n_queued = writer.submit(data)
+    if wait:
+        writer.flush()
+
+    msg = "Queued {}/{} new records. [{} ms]".format(n_queued, len(data), t1)
     log.debug(msg)
     if silent is False:
         lock.acquire()
@@ -121,57 +130,154 @@ def bulk_save(data, silent=False):
 
 #------------------------------------------------------------------------------
 def api_update(pairs, freqstrs, startstr=None, silent=False):
-    db = app.get_db()
-    client = app.bot.client
+    """Concurrent historic kline backfill for all (pair, freqstr) keys.
+    Only ranges missing from the coverage index are queried; persisted
+    history the candle store lacks is loaded from DB instead. Each range is
+    split into fixed BINANCE_REST_QUERY_LIMIT
+    pages which are fetched by a bounded worker pool, throttled by the
+    shared request weight bucket. Pages are merged into the candle store
+    as they arrive and saved to DB once all are done.
+    Returns list of candle dicts.
+    """
     t1 = Timer()
     candles = []
+    pages = []
+    # Pages fetched, including those where exchange had no candles.
+    done = []
 
+    # Parse date strings once, dateparser is slow.
+    end = strtoms("now utc")
+    start = strtoms(startstr or DEF_KLINE_HIST_LEN)
+    start_1d = strtoms("120 days ago utc")
+
+    # Only query ranges not already persisted.
     for pair in pairs:
         for freqstr in freqstrs:
-            if freqstr == '1d':
-                data = query_api(pair, freqstr, startstr="120 days ago utc")
+            _start = start_1d if freqstr == '1d' else start
+            for a, b in coverage.gaps(pair, freqstr, _start, end):
+                pages += page_ranges(pair, freqstr, a, b)
+
+    with stats_lock:
+        stats.update({'pages':len(pages), 'done':0, 'klines':0, 'errors':0,
+            'weight':0, 'wait_ms':0.0})
+    step = max(int(len(pages)/10), 1)
+
+    with ThreadPoolExecutor(max_workers=BACKFILL_WORKERS) as pool:
+        futures = {pool.submit(query_page, *n):n for n in pages}
+
+        for future in as_completed(futures):
+            pair, freqstr, data = future.result()
+            if data is None:
+                data = []
             else:
-                data = query_api(pair, freqstr, startstr=startstr)
-
-            if len(data) == 0:
-                continue
-            for i in range(0, len(data)):
-                x = data[i]
-                x = [
-                    pd.to_datetime(int(x[0]), unit='ms', utc=True),
-                    float(x[1]),
-                    float(x[2]),
-                    float(x[3]),
-                    float(x[4]),
-                    float(x[5]),
-                    pd.to_datetime(int(x[6]), unit='ms', utc=True),
-                    float(x[7]),
-                    int(x[8]),
-                    float(x[9]),
-                    float(x[10]),
-                    None
-                ]
-                d = dict(zip(BINANCE_REST_KLINES, x))
-                d.update({'pair': pair, 'freqstr': freqstr})
-                data[i] = d
+                done.append(futures[future])
+            data = to_candles(pair, freqstr, data)
+            bulk_append_dfc(data)
             candles += data
-
-    bulk_save(candles, silent=silent)
+            stats['done'] += 1
+            stats['klines'] += len(data)
+
+            if stats['done'] % step == 0 or stats['done'] == len(pages):
+                msg = "Backfill {done}/{pages} pages, {klines:,} klines, "\
+                    "weight {weight}, throttled {wait_ms:,.0f} ms, "\
+                    "{errors} errors.".format(**stats)
+                log.debug(msg)
+                if silent is False:
+                    lock.acquire()
+                    print(msg)
+                    lock.release()
+
+    failed = writer.stats['failed']
+    if len(candles) > 0:
+        bulk_save(candles, silent=silent, wait=True)
+    # Fetched ranges are complete even where exchange had no candles. Failed
+    # pages stay gaps and are queried again next time, as does everything
+    # if the writer lost any candles.
+    if writer.stats['failed'] > failed:
+        log.error("Backfill candles not persisted, coverage not updated.")
+        done = []
+    keys = {}
+    for pair, freqstr, a, b in done:
+        keys.setdefault((pair, freqstr), []).append([a, b])
+    [coverage.add(k[0], k[1], v) for k, v in keys.items()]
+
+    # Load persisted history the store doesn't hold yet.
+    for freqstr in freqstrs:
+        ms = strtofreq(freqstr) * 1000
+        _start = start_1d if freqstr == '1d' else start
+        _start = -(-_start // ms) * ms
+        # Rows older than the retention limit would be trimmed on load.
+        limit = app.bot.dfc.limit(ms//1000)
+        if limit is not None:
+            _start = max(_start, (end // ms - limit + 1) * ms)
+        load = []
+        for pair in pairs:
+            # Oldest persisted open_time within query range.
+            first = next((max(a, _start) for a, b in \
+                coverage.ranges(pair, freqstr) if b >= _start), None)
+            if first is not None and \
+                app.bot.dfc.first_time(pair, ms//1000) > first:
+                load.append(pair)
+        if len(load) > 0:
+            bulk_load(load, [freqstr], startdt=to_dt(_start/1000))
+
+    stats['elapsed_ms'] = t1.elapsed()
     return candles
 
 #------------------------------------------------------------------------------
-def query_api(pair, freqstr, startstr=None, endstr=None):
-    """Get Historical Klines (candles) from Binance.
-    @freqstr: 1m, 3m, 5m, 15m, 30m, 1h, ettc
+def evict_inactive(grace=CANDLE_EVICT_SEC):
+    """Drop store history of pairs that have been neither enabled nor held
+    for @grace seconds. Their DB coverage is kept, so re-enabling a pair
+    reloads its history from DB.
+    Returns list of evicted pairs.
+    """
+    from . import ledger, macd, registry
+    t = time.time()
+    active = registry.get(with_temp=True) | ledger.pairs()
+    stored = set(n[0] for n in app.bot.dfc.keys())
+
+    for pair in stored - active:
+        inactive_since.setdefault(pair, t)
+    for pair in list(inactive_since):
+        if pair not in stored or pair in active:
+            del inactive_since[pair]
+
+    evict = [k for k, v in inactive_since.items() if t - v >= grace]
+    if len(evict) == 0:
+        return evict
+    rows = app.bot.dfc.evict(evict)
+    macd.evict_streams(set(evict))
+    [inactive_since.pop(n) for n in evict]
+
+    mem = app.bot.dfc.memory()
+    log.info("Evicted {:,} rows of {} inactive pairs. Store: {} keys, {:,} "\
+        "rows, {:,.1f} MB.".format(rows, len(evict), len(mem),
+        mem['rows'].sum(), mem['bytes'].sum()/1e6))
+    return evict
+
+#------------------------------------------------------------------------------
+def page_ranges(pair, freqstr, start, end):
+    """Split [@start, @end] ms time range into (pair, freqstr, start, end)
+    pages of BINANCE_REST_QUERY_LIMIT klines each.
+    """
+    ms_page = strtofreq(freqstr) * 1000 * BINANCE_REST_QUERY_LIMIT
+
+    return [(pair, freqstr, n, min(n + ms_page - 1, end)) \
+        for n in range(start, end, ms_page)]
+
+#------------------------------------------------------------------------------
+def query_page(pair, freqstr, start, end, retries=5):
+    """Rate limited get_klines request for a single page.
+    Returns (pair, freqstr, klines). klines is None if all @retries failed.
     """
     client = app.bot.client
-    t1 = Timer()
-    ms_period = strtofreq(freqstr) * 1000
-    end = strtoms(endstr or "now utc")
-    start = strtoms(startstr or DEF_KLINE_HIST_LEN)
-    results = []
+    weight = kline_weight(BINANCE_REST_QUERY_LIMIT)
 
-    while start < end:
+    for attempt in range(retries):
+        wait = bucket.acquire(weight)
+        with stats_lock:
+            stats['wait_ms'] = stats.get('wait_ms', 0.0) + wait * 1000
+            stats['weight'] = stats.get('weight', 0) + weight
         try:
             data = client.get_klines(
                 symbol=pair,
@@ -179,71 +285,190 @@ def query_api(pair, freqstr, startstr=None, endstr=None):
                 limit=BINANCE_REST_QUERY_LIMIT,
                 startTime=start, endTime=end)
         except Exception as e:
-            log.exception("Binance API request error. e=%s", str(e))
+            with stats_lock:
+                stats['errors'] = stats.get('errors', 0) + 1
+            # 429: weight limit exceeded, 418: IP banned for ignoring 429s.
+            if getattr(e, 'status_code', None) in (418, 429):
+                bucket.pause(60)
+            elif attempt < retries - 1:
+                time.sleep(2 ** attempt)
+            log.debug("Binance API request error. e=%s", str(e))
             continue
-
-        if len(data) == 0:
-            start += ms_period
         else:
-            results += data
-            start = data[-1][0] + ms_period
+            return (pair, freqstr, data)
+
+    log.error("Giving up on %s %s page at %s after %s attempts.",
+        pair, freqstr, start, retries)
+    return (pair, freqstr, None)
+
+#------------------------------------------------------------------------------
+def query_api(pair, freqstr, startstr=None, endstr=None):
+    """Get Historical Klines (candles) from Binance.
+    @freqstr: 1m, 3m, 5m, 15m, 30m, 1h, ettc
+    """
+    t1 = Timer()
+    results = []
+
+    end = strtoms(endstr or "now utc")
+    start = strtoms(startstr or DEF_KLINE_HIST_LEN)
+
+    for page in page_ranges(pair, freqstr, start, end):
+        results += query_page(*page)[2] or []
 
     log.debug('%s %s %s queried [%ss].', len(results), freqstr, pair,
         t1.elapsed(unit='s'))
     return results
 
 #------------------------------------------------------------------------------
-def modify_dfc(c):
-    """Edit or append a single index to global candle dataframe.
-    @c: candle dict
+def kline_weight(limit):
+    """Binance request weight of a klines query returning @limit rows.
     """
-    pair = c['pair']
-    freq = strtofreq(c['freqstr'])
-    open_time = pd.Timestamp(c['open_time'].replace(tzinfo=None))
+    if limit < 100:
+        return 1
+    elif limit < 500:
+        return 2
+    elif limit <= 1000:
+        return 5
+    return 10
 
-    index = (pair, freq, open_time)
+#------------------------------------------------------------------------------
+def to_candles(pair, freqstr, data):
+    """Format raw REST klines into candle dicts.
+    """
+    if len(data) == 0:
+        return []
+    # Convert timestamps per page, scalar to_datetime calls are slow.
+    open_times = pd.to_datetime([int(x[0]) for x in data], unit='ms', utc=True)
+    close_times = pd.to_datetime([int(x[6]) for x in data], unit='ms', utc=True)
+    candles = []
+
+    for i, x in enumerate(data):
+        x = [
+            open_times[i],
+            float(x[1]),
+            float(x[2]),
+            float(x[3]),
+            float(x[4]),
+            float(x[5]),
+            close_times[i],
+            float(x[7]),
+            int(x[8]),
+            float(x[9]),
+            float(x[10]),
+            None
+        ]
+        d = dict(zip(BINANCE_REST_KLINES, x))
+        d.update({'pair': pair, 'freqstr': freqstr})
+        candles.append(d)
+    return candles
+
+#------------------------------------------------------------------------------
+def from_kline(k):
+    """Format raw websocket kline payload (msg['k']) into candle dict.
+    """
+    return {
+        "open_time": pd.to_datetime(k['t'], unit='ms', utc=True),
+        "close_time": pd.to_datetime(k['T'], unit='ms', utc=True),
+        "pair": k['s'],
+        "freqstr": k['i'],
+        "open": np.float64(k['o']),
+        "close": np.float64(k['c']),
+        "high": np.float64(k['h']),
+        "low": np.float64(k['l']),
+        "trades": k['n'],
+        "volume": np.float64(k['v']),
+        "buy_vol": np.float64(k['V']),
+        "quote_volume": np.float64(k['q']),
+        "quote_buy_vol": np.float64(k['Q']),
+        "closed": k['x']
+    }
 
-    # Modify existing DF index.
-    if index in app.bot.dfc.index:
+#------------------------------------------------------------------------------
+class Kline():
+    """Compact websocket kline record with epoch ms open/close times and
+    plain float fields. Reads like a candle dict: c['close'] is the close
+    attribute, c['open_time'] and c['close_time'] build tz-aware datetimes
+    on access. Use to_dict() where a real candle dict is stored.
+    """
+    __slots__ = ('pair', 'freqstr', 'open_ms', 'close_ms', 'open', 'close',
+        'high', 'low', 'trades', 'volume', 'buy_vol', 'quote_volume',
+        'quote_buy_vol', 'closed')
+    keys = ['open_time', 'close_time', 'pair', 'freqstr', 'open', 'close',
+        'high', 'low', 'trades', 'volume', 'buy_vol', 'quote_volume',
+        'quote_buy_vol', 'closed']
+
+    def __getitem__(self, k):
+        if k == 'open_time':
+            return to_dt(self.open_ms/1000)
+        elif k == 'close_time':
+            return to_dt(self.close_ms/1000)
         try:
-            app.bot.dfc.ix[index] = [c[n] for n in columns[3:]]
-        except Exception as e:
-            log.debug(str(e))
-            log.debug("candle: {}".format(c))
-            log.debug("app.bot.dfc.ix: {}".format(app.bot.dfc.ix[index]))
-    # Create index in new DF and append.
-    else:
-        c_ = c.copy()
-        c_['freq'] = strtofreq(c_['freqstr'])
-        c_['open_time'] = open_time
-        c_ = { k:v for k,v in c_.items() if k in columns}
-
-        df = pd.DataFrame.from_dict([c_], orient='columns')\
-            .set_index(['pair','freq','open_time'])
-        app.bot.dfc = app.bot.dfc.append(df)
-        app.bot.dfc = app.bot.dfc.sort_index()
+            return getattr(self, k)
+        except AttributeError:
+            raise KeyError(k)
+
+    def __contains__(self, k):
+        return k in self.keys
+
+    def __repr__(self):
+        return 'Kline({})'.format(self.to_dict())
+
+    def to_dict(self):
+        return {k:self[k] for k in self.keys}
+
+#------------------------------------------------------------------------------
+def decode_kline(k):
+    """Websocket kline payload (msg['k']) to Kline. Lean alternative to
+    from_kline for the per-message path, no pandas or numpy scalars.
+    """
+    c = Kline()
+    c.pair = k['s']
+    c.freqstr = k['i']
+    c.open_ms = k['t']
+    c.close_ms = k['T']
+    c.open = float(k['o'])
+    c.close = float(k['c'])
+    c.high = float(k['h'])
+    c.low = float(k['l'])
+    c.trades = k['n']
+    c.volume = float(k['v'])
+    c.buy_vol = float(k['V'])
+    c.quote_volume = float(k['q'])
+    c.quote_buy_vol = float(k['Q'])
+    c.closed = k['x']
+    return c
+
+#------------------------------------------------------------------------------
+def open_ts(c):
+    """open_time of candle dict or Kline @c as naive UTC pd.Timestamp.
+    """
+    if type(c) is Kline:
+        return pd.Timestamp(c.open_ms, unit='ms')
+    return pd.Timestamp(c['open_time'].replace(tzinfo=None))
+
+#------------------------------------------------------------------------------
+def modify_dfc(c):
+    """Edit or append a single index to global candle store.
+    @c: candle dict or Kline
+    """
+    open_time = open_ts(c)
+    app.bot.dfc.upsert(c['pair'], symbols.freq(c['freqstr']), open_time,
+        [c[n] for n in columns[3:]])
 
 #------------------------------------------------------------------------------
 def bulk_append_dfc(candlelist):
-    """Append multiple indexes to global candle dataframe.
+    """Append multiple indexes to global candle store. Existing
+    (pair,freq,open_time) rows are kept over duplicates.
     @candles: list of candle dicts
     """
-    candles_ = []
-    # Rebuild candle list formatted for dataframe.
+    groups = {}
     for c in candlelist:
-        c_ = c.copy()
-        c_['freq'] = strtofreq(c_['freqstr'])
-        c_['open_time'] = pd.Timestamp(c_['open_time'].replace(tzinfo=None))
-        c_ = { k:v for k,v in c_.items() if k in columns}
-        candles_.append(c_)
-
-    df = pd.DataFrame.from_dict(candles_, orient='columns')\
-        .set_index(['pair','freq','open_time'])
-
-    app.bot.dfc = app.bot.dfc.append(df).sort_index()
+        groups.setdefault((c['pair'], c['freqstr']), []).append(c)
 
-    # Drop any rows that have duplicate (pair,freq,open_time) indexes.
-    app.bot.dfc = app.bot.dfc[~app.bot.dfc.index.duplicated(keep='first')]
-    app.bot.dfc = app.bot.dfc.sort_index()
+    for (pair, freqstr), group in groups.items():
+        times = [pd.Timestamp(c['open_time'].replace(tzinfo=None)) \
+            for c in group]
+        values = [[c[n] for n in columns[3:]] for c in group]
+        app.bot.dfc.merge(pair, symbols.freq(freqstr), times, values)
 
     return app.bot.dfc
@@ -0,0 +1,126 @@
+# app.bot.coverage
+import logging
+import threading
+import numpy as np
+import app
+from app.common.utils import dt_to_ms, utc_datetime as now
+from app.common.timeutils import strtofreq
+
+log = logging.getLogger('coverage')
+
+# Persisted open_time ranges per (pair, freqstr) as sorted, merged lists of
+# [start_ms, end_ms] (inclusive). Mirrors db.candle_coverage.
+index = {}
+lock = threading.RLock()
+
+#------------------------------------------------------------------------------
+def ranges(pair, freqstr):
+    """Covered ranges for (pair, freqstr). Loaded from db.candle_coverage on
+    first use, or rebuilt from db.candles if no coverage doc exists yet.
+    """
+    key = (pair, freqstr)
+    if key in index:
+        return index[key]
+
+    doc = app.get_db().candle_coverage.find_one(
+        {'pair':pair, 'freqstr':freqstr})
+    _ranges = doc['ranges'] if doc else rebuild(pair, freqstr)
+
+    with lock:
+        return index.setdefault(key, _ranges)
+
+#------------------------------------------------------------------------------
+def rebuild(pair, freqstr):
+    """Derive covered ranges from candles already in db.candles. One-time
+    cost per key.
+    """
+    db = app.get_db()
+    ms = strtofreq(freqstr) * 1000
+    cursor = db.candles.find({'pair':pair, 'freqstr':freqstr},
+        {'_id':0, 'open_time':1}).sort('open_time', 1)
+    times = np.array([dt_to_ms(n['open_time']) for n in cursor], dtype=np.int64)
+
+    if len(times) == 0:
+        return []
+    bounds = np.flatnonzero(np.diff(times) > ms)
+    starts = np.append(times[0], times[bounds+1])
+    ends = np.append(times[bounds], times[-1])
+    _ranges = [[int(a), int(b)] for a, b in zip(starts, ends)]
+
+    save(pair, freqstr, _ranges)
+    log.debug("Rebuilt %s %s coverage, %s range(s).", pair, freqstr,
+        len(_ranges))
+    return _ranges
+
+#------------------------------------------------------------------------------
+def gaps(pair, freqstr, start, end):
+    """Uncovered [start, end] ms ranges within [@start, @end].
+    """
+    ms = strtofreq(freqstr) * 1000
+    # Align to candle open_times.
+    start = -(-start // ms) * ms
+    missing = []
+
+    for a, b in ranges(pair, freqstr):
+        if b < start:
+            continue
+        if a > end:
+            break
+        if a > start:
+            missing.append([start, a - ms])
+        start = max(start, b + ms)
+
+    if start <= end:
+        missing.append([start, end])
+    return missing
+
+#------------------------------------------------------------------------------
+def add(pair, freqstr, new):
+    """Mark list of [start, end] ms open_time ranges as persisted. Only
+    closed candles count, the live candle is clipped off.
+    """
+    ms = strtofreq(freqstr) * 1000
+    last_closed = (dt_to_ms(now()) // ms) * ms - ms
+    new = [[a, min(b, last_closed)] for a, b in new if a <= last_closed]
+    if len(new) == 0:
+        return
+
+    with lock:
+        _ranges = merge(ranges(pair, freqstr) + new, ms)
+        index[(pair, freqstr)] = _ranges
+    save(pair, freqstr, _ranges)
+
+#------------------------------------------------------------------------------
+def add_candles(candles):
+    """Mark open_times of saved closed candle dicts as persisted.
+    """
+    now_ms = dt_to_ms(now())
+    keys = {}
+    for c in candles:
+        if dt_to_ms(c['close_time']) >= now_ms:
+            continue
+        keys.setdefault((c['pair'], c['freqstr']), []).append(
+            dt_to_ms(c['open_time']))
+
+    for (pair, freqstr), times in keys.items():
+        add(pair, freqstr, [[n, n] for n in times])
+
+#------------------------------------------------------------------------------
+def merge(_ranges, ms):
+    """Union of [start, end] ranges. Ranges @ms apart (adjacent candles)
+    are joined.
+    """
+    merged = []
+    for a, b in sorted(_ranges):
+        if merged and a <= merged[-1][1] + ms:
+            merged[-1][1] = max(merged[-1][1], b)
+        else:
+            merged.append([a, b])
+    return merged
+
+#------------------------------------------------------------------------------
+def save(pair, freqstr, _ranges):
+    app.get_db().candle_coverage.update_one(
+        {'pair':pair, 'freqstr':freqstr},
+        {'$set': {'ranges':_ranges}},
+        upsert=True)
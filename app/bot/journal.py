@@ -0,0 +1,158 @@
+# app.bot.journal
+import json
+import logging
+import os
+import threading
+from docs.botconf import *
+from . import writer
+
+log = logging.getLogger('journal')
+
+# Active segment file object and its sequence number.
+active, seq = None, 0
+n_active = 0
+stats = {'appended':0, 'replayed':0, 'flushed':0, 'segments':0, 'corrupt':0}
+_lock = threading.Lock()
+
+#------------------------------------------------------------------------------
+def run(e_pairs, e_kill):
+    """Journal flusher thread. Replays segments left over from a previous
+    run, then periodically seals the active segment and drains sealed
+    segments to DB through the writer. Segments still on disk at shutdown
+    are replayed on next startup.
+    """
+    replay()
+
+    while not e_kill.isSet():
+        e_kill.wait(JOURNAL_FLUSH_SEC)
+        rotate()
+        drain()
+
+    with _lock:
+        _close()
+    print("Journal thread: terminating...")
+
+#------------------------------------------------------------------------------
+def append(k):
+    """Append raw closed kline payload @k (websocket msg['k']) to the active
+    segment. Flushed to OS on every write so it survives a process crash.
+    Segments are fsynced when sealed, every JOURNAL_FLUSH_SEC, so a host
+    crash loses at most that much.
+    """
+    global n_active
+    line = json.dumps(k, separators=(',',':')) + '\n'
+
+    with _lock:
+        if active is None:
+            _open()
+        active.write(line)
+        active.flush()
+        n_active += 1
+        stats['appended'] += 1
+
+#------------------------------------------------------------------------------
+def rotate():
+    """Seal the active segment if it holds any records. The next append
+    opens a new one.
+    """
+    with _lock:
+        if n_active > 0:
+            _close()
+
+#------------------------------------------------------------------------------
+def replay():
+    """Seal any segment left open by a crashed run and drain all segments
+    found on disk.
+    """
+    global seq
+    os.makedirs(JOURNAL_DIR, exist_ok=True)
+    found = segments()
+    if len(found) > 0:
+        with _lock:
+            if active is None:
+                seq = max(found) + 1
+        log.info("Replaying %s journal segment(s).", len(found))
+    n = drain(key='replayed')
+    if n > 0:
+        print("Replayed {} journaled candles.".format(n))
+
+#------------------------------------------------------------------------------
+def drain(key='flushed'):
+    """Write all sealed segments to DB in order, deleting each once its
+    candles are persisted. A segment is kept for the next drain if its
+    batch failed to write.
+    Returns number of candles written.
+    """
+    from .candles import from_kline
+    with _lock:
+        sealed = [n for n in segments() if active is None or n != seq]
+    total = 0
+
+    for n in sealed:
+        path = _path(n)
+        candles = [from_kline(k) for k in read(path)]
+        failed = writer.stats['failed']
+        writer.submit(candles)
+        writer.flush()
+
+        if writer.stats['failed'] > failed:
+            log.error("Journal segment %s not persisted, retrying later.", n)
+            break
+        os.remove(path)
+        total += len(candles)
+        with _lock:
+            stats[key] += len(candles)
+            stats['segments'] += 1
+
+    if total > 0:
+        log.debug("Drained {} candles from {} segment(s). {}".format(
+            total, len(sealed), stats))
+    return total
+
+#------------------------------------------------------------------------------
+def read(path):
+    """Klines in segment file @path. A torn final line from a crash
+    mid-write is skipped.
+    """
+    klines = []
+    with open(path) as f:
+        for line in f:
+            try:
+                klines.append(json.loads(line))
+            except ValueError:
+                stats['corrupt'] += 1
+                log.warning("Skipping corrupt journal record in %s.", path)
+    return klines
+
+#------------------------------------------------------------------------------
+def segments():
+    """Sorted sequence numbers of segment files on disk.
+    """
+    if not os.path.isdir(JOURNAL_DIR):
+        return []
+    return sorted(int(n[0:-4]) for n in os.listdir(JOURNAL_DIR) \
+        if n.endswith('.seg') and n[0:-4].isdigit())
+
+#------------------------------------------------------------------------------
+def _open():
+    global active, seq, n_active
+    os.makedirs(JOURNAL_DIR, exist_ok=True)
+    while os.path.exists(_path(seq)):
+        seq += 1
+    active = open(_path(seq), 'a')
+    n_active = 0
+
+#------------------------------------------------------------------------------
+def _close():
+    global active, seq, n_active
+    if active is not None:
+        active.flush()
+        os.fsync(active.fileno())
+        active.close()
+        active = None
+        seq += 1
+        n_active = 0
+
+#------------------------------------------------------------------------------
+def _path(n):
+    return os.path.join(JOURNAL_DIR, '{:012d}.seg'.format(n))
@@ -0,0 +1,224 @@
+# app.bot.ledger
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict as odict
+from queue import Queue, Empty
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne
+from docs.botconf import *
+import app
+
+log = logging.getLogger('ledger')
+
+# Authoritative in-process book of open positions. Mirrors db.trades
+# {'status':'open'}; writes reach DB asynchronously through the ledger thread.
+# _id -> trade record.
+book = {}
+# (pair, freqstr) -> [records], (freqstr, algo) -> [records].
+by_key, by_algo = {}, {}
+# Recently closed records, for reporting without a DB read.
+closed = odict()
+MAX_CLOSED = 100
+# Pending (collection name, pymongo write op), applied in order.
+q = Queue()
+# _id -> record with stats changed since last stats flush.
+dirty = {}
+stats = {'queued':0, 'written':0, 'errors':0, 'stats_flushed':0}
+loaded = False
+lock = threading.RLock()
+
+#------------------------------------------------------------------------------
+def run(e_pairs, e_kill):
+    """Ledger writer thread. Applies queued trade and trade snapshot writes
+    in order. Stats changes are coalesced into one write per trade every
+    STATS_FLUSH_SEC.
+    """
+    flushed = time.time()
+    while not e_kill.isSet():
+        if time.time() - flushed >= STATS_FLUSH_SEC:
+            flush_stats()
+            flushed = time.time()
+        drain(timeout=1)
+
+    flush_stats()
+    drain(timeout=0)
+    print("Ledger thread: terminating...")
+
+#------------------------------------------------------------------------------
+def load():
+    """Load open positions from DB. Only runs once.
+    """
+    from .snapshots import ensure_index, summarize
+    global loaded
+    with lock:
+        if loaded:
+            return
+        ensure_index()
+        for record in app.get_db().trades.find({'status':'open'}):
+            _index(summarize(record))
+        loaded = True
+        log.debug("%s open position(s) loaded.", len(book))
+
+#------------------------------------------------------------------------------
+def find(pair, freqstr):
+    """Open positions for (pair, freqstr).
+    """
+    load()
+    return list(by_key.get((pair, freqstr), []))
+
+#------------------------------------------------------------------------------
+def exists(freqstr, algo):
+    """True if @algo holds an open position on @freqstr.
+    """
+    load()
+    return len(by_algo.get((freqstr, algo), [])) > 0
+
+#------------------------------------------------------------------------------
+def open_trades():
+    load()
+    with lock:
+        return list(book.values())
+
+#------------------------------------------------------------------------------
+def pairs():
+    """Set of pairs with open positions.
+    """
+    load()
+    with lock:
+        return set(n[0] for n in by_key)
+
+#------------------------------------------------------------------------------
+def get(_id):
+    """Open or recently closed record by _id. Falls back to DB.
+    """
+    from .snapshots import summarize
+    with lock:
+        record = book.get(_id) or closed.get(_id)
+    return record or summarize(app.get_db().trades.find_one({'_id':_id}))
+
+#------------------------------------------------------------------------------
+def insert(record):
+    """Add new open position. Assigns its _id.
+    Returns _id.
+    """
+    load()
+    record['_id'] = ObjectId()
+    with lock:
+        _index(record)
+    queue('trades', InsertOne(_copy(record)))
+    return record['_id']
+
+#------------------------------------------------------------------------------
+def update(record, update):
+    """Apply $set/$inc/$push @update to in-memory @record and queue it for
+    DB. Records whose status is set to 'closed' leave the book.
+    """
+    apply(record, update)
+
+    if record['status'] == 'closed':
+        with lock:
+            _unindex(record)
+            closed[record['_id']] = record
+            while len(closed) > MAX_CLOSED:
+                closed.popitem(last=False)
+    queue('trades', UpdateOne({'_id':record['_id']}, update))
+
+#------------------------------------------------------------------------------
+def apply(record, update):
+    """Apply $set/$inc/$push @update to @record in memory only.
+    """
+    for k, v in update.get('$set', {}).items():
+        record[k] = v
+    for k, v in update.get('$inc', {}).items():
+        record[k] = record.get(k, 0) + v
+    for k, v in update.get('$push', {}).items():
+        record.setdefault(k, []).append(v)
+
+#------------------------------------------------------------------------------
+def set_stats(record, _stats):
+    """Replace @record stats in memory. Written to DB by the next stats
+    flush.
+    """
+    record['stats'] = _stats
+    with lock:
+        dirty[record['_id']] = record
+
+#------------------------------------------------------------------------------
+def flush_stats():
+    """Queue one stats $set per trade changed since the last flush.
+    """
+    global dirty
+    with lock:
+        records, dirty = list(dirty.values()), {}
+    for record in records:
+        queue('trades', UpdateOne({'_id':record['_id']},
+            {'$set':{'stats':record['stats']}}))
+    stats['stats_flushed'] += len(records)
+
+#------------------------------------------------------------------------------
+def flush():
+    """Block until all queued writes are applied.
+    """
+    q.join()
+
+#------------------------------------------------------------------------------
+def drain(timeout=1):
+    """Write all queued ops, waiting up to @timeout seconds for the first.
+    Consecutive ops on the same collection go in one ordered bulk write.
+    """
+    ops = []
+    try:
+        ops.append(q.get(timeout=timeout) if timeout else q.get_nowait())
+        while True:
+            ops.append(q.get_nowait())
+    except Empty:
+        pass
+
+    db = app.get_db()
+    i = 0
+    while i < len(ops):
+        coll = ops[i][0]
+        batch = list(itertools.takewhile(lambda n: n[0] == coll, ops[i:]))
+        try:
+            db[coll].bulk_write([n[1] for n in batch], ordered=True)
+            stats['written'] += len(batch)
+        except Exception as e:
+            stats['errors'] += 1
+            log.exception("%s write failed. e=%s", coll, str(e))
+        finally:
+            [q.task_done() for n in batch]
+        i += len(batch)
+
+#------------------------------------------------------------------------------
+def queue(coll, op):
+    """Queue pymongo write @op on collection @coll.
+    """
+    stats['queued'] += 1
+    q.put((coll, op))
+
+#------------------------------------------------------------------------------
+def _copy(record):
+    """Copy of @record with its own top-level lists, so later in-memory
+    updates don't leak into a queued insert.
+    """
+    return {k: list(v) if isinstance(v, list) else v \
+        for k, v in record.items()}
+
+#------------------------------------------------------------------------------
+def _index(record):
+    book[record['_id']] = record
+    by_key.setdefault((record['pair'], record['freqstr']), []).append(record)
+    by_algo.setdefault((record['freqstr'], record['algo']), []).append(record)
+
+#------------------------------------------------------------------------------
+def _unindex(record):
+    book.pop(record['_id'], None)
+    for idx, key in [(by_key, (record['pair'], record['freqstr'])),
+        (by_algo, (record['freqstr'], record['algo']))]:
+        group = [n for n in idx.get(key, []) if n['_id'] != record['_id']]
+        if len(group) > 0:
+            idx[key] = group
+        else:
+            idx.pop(key, None)
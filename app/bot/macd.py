@@ -1,5 +1,7 @@
 # app.bot.macd
 import logging
+import threading
+from collections import deque
 from pprint import pprint
 from datetime import timedelta as delta, datetime
 from dateparser import parse
@@ -12,9 +14,14 @@ from docs.botconf import *
 from app.common.utils import pct_diff, to_local, abc, strtodt, strtoms
 from app.common.timeutils import strtofreq, freqtostr
 import app, app.bot
-from . import candles, signals
+from . import candles, signals, symbols
 
 log = logging.getLogger('macd')
+# Streaming macd state for each (pair, freqstr) fed by the trade thread.
+streams = {}
+STREAM_LEN = 500
+# Held while a stream is updated or seeded, and while streams are evicted.
+_streams_lock = threading.RLock()
 
 #-----------------------------------------------------------------------------
 def generate(df, ema=None, normalize=True):
@@ -54,133 +61,348 @@ def generate(df, ema=None, normalize=True):
         df = df.join(pd.DataFrame(histo))
     return df
 
+#-----------------------------------------------------------------------------
+def generate_matrix(closes, ema=None, normalize=True):
+    """Macd histogram for many series at once. Same math as generate(),
+    applied column-wise to a 2-D dataframe of close prices (e.g. from
+    CandleStore.matrix).
+    Returns dataframe of macd_diff values shaped like @closes.
+    """
+    _ema = ema if ema else macd_ema
+    ewm = lambda df, span: df.ewm(span=span, adjust=True, ignore_na=False,
+        min_periods=_ema[1]).mean()
+
+    macd = ewm(closes, _ema[0]) - ewm(closes, _ema[1])
+    histo = macd - ewm(macd, _ema[2])
+    if not normalize:
+        return histo
+
+    pos = histo.where(histo >= 0)
+    neg = abs(histo.where(histo < 0))
+    pos = (pos - pos.min()) / (pos.max() - pos.min())
+    neg = ((neg - neg.min()) / (neg.max() - neg.min())) * -1
+    return pos.where(histo >= 0, neg)
+
+#-----------------------------------------------------------------------------
+def generate_rows(closes, ema=None, normalize=True):
+    """generate_matrix() for a 2-D ndarray of close prices, stepping every
+    column at once with signals.ewm_rows. Much faster for many short
+    columns, i.e. one candle window per column.
+    Returns ndarray shaped like @closes.
+    """
+    _ema = ema if ema else macd_ema
+    ewm = lambda x, span: signals.ewm_rows(x, span, min_periods=_ema[1])
+
+    macd = ewm(closes, _ema[0]) - ewm(closes, _ema[1])
+    histo = macd - ewm(macd, _ema[2])
+    if not normalize:
+        return histo
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pos = np.where(histo >= 0, histo, np.nan)
+        neg = np.abs(np.where(histo < 0, histo, np.nan))
+        pos_min, neg_min = np.fmin.reduce(pos, axis=0), np.fmin.reduce(neg, axis=0)
+        pos = (pos - pos_min) / (np.fmax.reduce(pos, axis=0) - pos_min)
+        neg = ((neg - neg_min) / (np.fmax.reduce(neg, axis=0) - neg_min)) * -1
+    return np.where(histo >= 0, pos, neg)
+
 #------------------------------------------------------------------------------
-def histo_phases(df, pair, freqstr, periods, to_bson=False):
-    """Groups and analyzes the MACD histogram phases within given timespan.
-    Determines how closely the histogram bars track with price.
+class MacdStream():
+    """Incremental macd for a single (pair, freqstr). Holds fast/slow/signal
+    EMA numerator/denominator sums so each kline updates in O(1). Values
+    match generate() (ewm adjust=True, min_periods=slow) within float
+    rounding.
+    Only closed candles are committed to the state. Unclosed candles are
+    evaluated against it without mutating it, so a revised or abandoned
+    live candle needs no rollback. Re-closing the last committed candle
+    rolls back one step before re-applying it.
     """
-    DF = pd.DataFrame
-    freq = strtofreq(freqstr)
-    df = df.copy()
-    dfmacd = generate(df).tail(periods)['macd_diff']
-    np_arr, descs, phases = [],[],[]
-    idx = 0
-
-    while idx < len(dfmacd):
-        try:
-            iloc, row, phase, desc = next_phase(dfmacd, freq, idx)
-        except Exception as e:
-            log.info("{}".format(pair))
-            pprint(dfmacd)
-
-        dfmacd = dfmacd#.drop_duplicates()
-        if row is None:
-            idx+=1
-            continue
-        else:
-            np_arr.append(row)
-            descs.append(desc)
-            phases.append(phase)
-            idx = iloc[1] + 1
-
-    dfh = DF(np_arr, columns=['start', 'end', 'bars', 'phase', 'ampMean', 'ampMax'])
-
-    # Gen labels and calc % price changes
-    lbls, pxy_corr, pct_py, pct_px = [],[],[],[]
-    j=0
-    for i in range(0, len(dfh)):
-        if j == len(abc):
-            j=0
-        lbls.append("{} ({})".format(abc[j].upper(), dfh.iloc[i]['phase']))
-        j+=1
-
-    # Determine correlation between histogram bars and price movement
-    # Find overall histogram=>candle close correlation
-    for i in range(0, len(dfh)):
-        _slice = df.loc[slice(dfh.iloc[i]['start'], dfh.iloc[i]['end'])]
-
-        py = pct_diff(_slice['low'].min(), _slice['high'].max())
-        if dfh['ampMean'].iloc[i] < 0:
-            py *= -1
-        pct_py.append(py)
-
-        pct_px.append(pct_diff(_slice.iloc[0]['open'], _slice.iloc[-1]['close']))
-
-        if len(phases[i]) == len(_slice):
-            pxy_corr.append(phases[i].corr(_slice['close']))
+    def __init__(self, ema=None):
+        self.ema = ema if ema else macd_ema
+        self.w = [1 - 2/(n+1) for n in self.ema]
+        # [fast_num, fast_den, slow_num, slow_den, n_obs, sig_num, sig_den,
+        #  n_macd, pos_min, pos_max, neg_min, neg_max]
+        self.state = [0.0, 0.0, 0.0, 0.0, 0, 0.0, 0.0, 0,
+            np.inf, -np.inf, np.inf, -np.inf]
+        self.prev = None
+        self.last_time = None
+        self.histo = deque(maxlen=STREAM_LEN)
+        self.live = None
+        # Oldest store open_time (ms) the stream was seeded from.
+        self.origin = None
+
+    #--------------------------------------------------------------------------
+    def seed(self, times, closes):
+        """Commit closed candles @times, @closes to a new stream in bulk.
+        Same state as update() on each in turn, with the EMA sums taken
+        from pandas ewm instead of a python loop.
+        """
+        n = len(closes) - 1
+        if n > 0:
+            x = pd.Series(closes[:-1], dtype=np.float64)
+            rows = np.arange(n)
+            ewm = lambda s, span: s.ewm(span=span, adjust=True,
+                ignore_na=False).mean().values
+            # EMA denominator after k observations: sum of w**i, i < k.
+            den = lambda w, k: (1 - w**k) / (1 - w)
+            wf, ws, wg = self.w
+            fast, slow = ewm(x, self.ema[0]), ewm(x, self.ema[1])
+            macd = np.where(rows >= self.ema[1] - 1, fast - slow, np.nan)
+            n_macd = max(n - self.ema[1] + 1, 0)
+            signal = ewm(pd.Series(macd), self.ema[2])
+            histo = np.where(rows >= 2*self.ema[1] - 2, macd - signal, np.nan)
+            pos, neg = histo[histo >= 0], -histo[histo < 0]
+
+            self.state = [
+                fast[-1] * den(wf, n), den(wf, n),
+                slow[-1] * den(ws, n), den(ws, n), n,
+                signal[-1] * den(wg, n_macd) if n_macd else 0.0,
+                den(wg, n_macd), n_macd,
+                pos.min() if len(pos) else np.inf,
+                pos.max() if len(pos) else -np.inf,
+                neg.min() if len(neg) else np.inf,
+                neg.max() if len(neg) else -np.inf]
+            self.histo.extend(zip(times[:-1][-STREAM_LEN:],
+                histo[-STREAM_LEN:].tolist()))
+            self.last_time = times[n-1]
+        if n >= 0:
+            self.update(times[-1], closes[-1], True)
+
+    #--------------------------------------------------------------------------
+    def step(self, state, x):
+        """Apply close price @x to copy of @state. Returns (state, macd,
+        signal, histo).
+        """
+        wf, ws, wg = self.w
+        s = list(state)
+        s[0] = x + wf*s[0]
+        s[1] = 1 + wf*s[1]
+        s[2] = x + ws*s[2]
+        s[3] = 1 + ws*s[3]
+        s[4] += 1
+        macd = signal = histo = np.nan
+
+        if s[4] >= self.ema[1]:
+            macd = s[0]/s[1] - s[2]/s[3]
+            s[5] = macd + wg*s[5]
+            s[6] = 1 + wg*s[6]
+            s[7] += 1
+            if s[7] >= self.ema[1]:
+                signal = s[5]/s[6]
+                histo = macd - signal
+                if histo >= 0:
+                    s[8], s[9] = min(s[8], histo), max(s[9], histo)
+                else:
+                    s[10], s[11] = min(s[10], -histo), max(s[11], -histo)
+        return (s, macd, signal, histo)
+
+    #--------------------------------------------------------------------------
+    def update(self, open_time, close, closed):
+        """Feed one kline. Returns (macd, signal, histo) raw values.
+        """
+        if self.last_time is not None and open_time == self.last_time:
+            if not closed:
+                return self.values()
+            # Closed candle revised. Roll back and re-apply.
+            self.state = self.prev
+            self.histo.pop()
+            self.last_time = self.histo[-1][0] if len(self.histo) else None
+
+        s, macd, signal, histo = self.step(self.state, close)
+
+        if closed:
+            self.prev, self.state = self.state, s
+            self.last_time = open_time
+            self.histo.append((open_time, histo))
+            self.live = None
         else:
-            pxy_corr.append(np.nan)
+            self.live = (open_time, histo, s)
+        return (macd, signal, histo)
+
+    #--------------------------------------------------------------------------
+    def values(self):
+        s = self.live[2] if self.live else self.state
+        if s[7] < 1:
+            return (np.nan, np.nan, np.nan)
+        macd = s[0]/s[1] - s[2]/s[3]
+        signal = s[5]/s[6] if s[7] >= self.ema[1] else np.nan
+        return (macd, signal, macd - signal)
+
+    #--------------------------------------------------------------------------
+    def series(self, periods):
+        """Normalized macd_diff series for last @periods candles, including
+        live candle. Identical to generate(df).tail(periods)['macd_diff'].
+        """
+        rows = list(self.histo)
+        s = self.state
+        if self.live:
+            rows.append(self.live[0:2])
+            s = self.live[2]
+        rows = rows[-periods:]
+        histo = np.array([n[1] for n in rows], dtype=np.float64)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            norm = np.where(histo >= 0,
+                (histo - s[8]) / (s[9] - s[8]),
+                -1 * ((-histo - s[10]) / (s[11] - s[10])))
+        norm[np.isnan(histo)] = np.nan
+
+        return pd.Series(norm,
+            index=pd.DatetimeIndex([n[0] for n in rows], name='open_time'),
+            name='macd_diff')
 
-    dfh['lbl'] = lbls
-    dfh['duration'] = dfh['end'] - dfh['start']
-    dfh['priceY'] = pct_py
-    dfh['priceX'] = pct_px
-    dfh['capt'] = abs(dfh['priceX'] / dfh['priceY'])
-    dfh['corr'] = pxy_corr
+#------------------------------------------------------------------------------
+def update_stream(c):
+    """Update macd stream for candle dict or Kline @c. Seeds state from the
+    candle store on first use, whenever candles are missing between the
+    last committed candle and @c, or when the store's oldest candle changed
+    (retention trim or older history loaded) so that normalization covers
+    the same window as generate() on the store frame.
+    """
+    pair, freqstr = c['pair'], c['freqstr']
+    freq = symbols.freq(freqstr)
+    open_time = candles.open_ts(c)
+
+    with _streams_lock:
+        stream = streams.get((pair, freqstr))
+        if stream is None or stream.last_time is None or \
+            open_time < stream.last_time or \
+            (open_time - stream.last_time).total_seconds() > freq or \
+            stream.origin != app.bot.dfc.first_time(pair, freq):
+            stream = seed_stream(pair, freqstr, open_time)
+        return stream.update(open_time, c['close'], c['closed'])
 
-    # Append cols/clean up formatting
-    dfh.index = dfh['start']
+#------------------------------------------------------------------------------
+def evict_streams(pairs):
+    """Drop streams of @pairs. They are reseeded on their next update.
+    """
+    with _streams_lock:
+        for k in [k for k in streams if k[0] in pairs]:
+            del streams[k]
 
-    dfh = dfh.sort_index()
-    dfh = dfh[['lbl', 'bars', 'duration', 'ampMean', 'ampMax',
-        'priceY', 'priceX', 'capt', 'corr']].round(2)
+#------------------------------------------------------------------------------
+def seed_stream(pair, freqstr, before):
+    """(Re)build stream for (pair, freqstr) from closed candles in the store
+    with open_time < @before.
+    """
+    stream = MacdStream()
+    freq = symbols.freq(freqstr)
+    stream.origin = app.bot.dfc.first_time(pair, freq)
+    try:
+        df = app.bot.dfc.frame(pair, freq)
+    except KeyError:
+        df = None
+
+    if df is not None:
+        closes = df['close'][df.index < before]
+        stream.seed(closes.index, closes.values)
+
+    with _streams_lock:
+        streams[(pair, freqstr)] = stream
+    return stream
+
+#------------------------------------------------------------------------------
+def histo_phases(df, pair, freqstr, periods, to_bson=False, dfmacd=None):
+    """Groups and analyzes the MACD histogram phases within given timespan.
+    Determines how closely the histogram bars track with price.
+    @dfmacd: optional precomputed normalized macd_diff series indexed like
+    @df (see generate_matrix)
+    A phase starts at each bar whose sign differs from the last non-zero
+    bar and runs until the next one. Zero/NaN bars extend the current phase;
+    leading ones are skipped. All phase stats are computed in one pass with
+    segmented reductions.
+    """
+    stream = streams.get((pair, freqstr))
+
+    if dfmacd is not None:
+        dfmacd = dfmacd.tail(periods)
+    elif stream is not None and len(stream.histo) >= periods and \
+        (stream.live or stream.histo[-1])[0] == df.index[-1]:
+        dfmacd = stream.series(periods)
+    else:
+        dfmacd = generate(df).tail(periods)['macd_diff']
+
+    histo = dfmacd.values
+    sign = np.sign(np.nan_to_num(histo))
+    nz = np.flatnonzero(sign)
+    starts = nz[np.concatenate(([True], sign[nz][1:] != sign[nz][:-1]))] \
+        if len(nz) else nz
+    ends = np.append(starts[1:], len(histo)) - 1
+    n_bars = ends - starts + 1
+    phases = [dfmacd.iloc[i:j+1] for i, j in zip(starts, ends)]
+
+    if len(starts) == 0:
+        return (_empty_phases(to_bson), phases)
+
+    # Drop leading zero/NaN bars so segments tile the arrays exactly.
+    off = starts[0]
+    seg_starts = starts - off
+    histo = histo[off:]
+    valid = ~np.isnan(histo)
+    h = np.where(valid, histo, 0.0)
+    n_valid = np.add.reduceat(valid.astype(np.int64), seg_starts)
+
+    # Candle rows covering each phase.
+    loc = df.index.get_indexer(dfmacd.index)[off:]
+    p0, p1 = loc[seg_starts], loc[ends - off]
+    close = np.where(valid, df['close'].values[loc], 0.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Histogram amplitude, NaN bars ignored.
+        amp_mean = np.add.reduceat(h, seg_starts) / n_valid
+        amp_max = np.fmax.reduceat(histo, seg_starts)
+
+        price_y = pct_diff(
+            np.minimum.reduceat(df['low'].values[p0[0]:p1[-1]+1], p0-p0[0]),
+            np.maximum.reduceat(df['high'].values[p0[0]:p1[-1]+1], p0-p0[0]))
+        price_y[amp_mean < 0] *= -1
+        price_x = pct_diff(df['open'].values[p0], df['close'].values[p1])
+        capt = np.abs(price_x / price_y)
+
+        # Pearson corr of histogram bars vs close price per phase.
+        seg = np.repeat(np.arange(len(starts)), n_bars)
+        dx = np.where(valid, h - (np.add.reduceat(h, seg_starts)/n_valid)[seg], 0)
+        dy = np.where(valid, close - (np.add.reduceat(close, seg_starts)/n_valid)[seg], 0)
+        corr = np.add.reduceat(dx*dy, seg_starts) / np.sqrt(
+            np.add.reduceat(dx*dx, seg_starts) * np.add.reduceat(dy*dy, seg_starts))
+    corr[n_valid < 2] = np.nan
+
+    signs = np.where(sign[starts] > 0, '+', '-')
+    index = dfmacd.index[starts]
+
+    dfh = pd.DataFrame({
+        'lbl': ["{} ({})".format(abc[i % len(abc)].upper(), signs[i]) \
+            for i in range(len(starts))],
+        'bars': n_bars,
+        'duration': dfmacd.index[ends] - index,
+        'ampMean': amp_mean,
+        'ampMax': amp_max,
+        'priceY': price_y,
+        'priceX': price_x,
+        'capt': capt,
+        'corr': corr
+    }, index=pd.Index(index, name='start')).round(2)
 
     if to_bson:
         dfh = dfh.reset_index()
         dfh['start'] = [str(to_local(n.to_pydatetime().replace(tzinfo=pytz.utc))) for n in dfh['start']]
         dfh['duration'] = dfh['duration'].apply(lambda x: str(x.to_pytimedelta()))
-        dfh['bars'].astype('int')
 
     return (dfh, phases)
 
 #------------------------------------------------------------------------------
-def next_phase(dfmacd, freq, start_idx):
-    """
-    """
-    diff = dfmacd.iloc[start_idx]
-
-    try:
-        if diff > 0:
-            signs = ('positive', '+')
-            skip = dfmacd.iloc[start_idx:][dfmacd < 0].head(1).index
-        elif diff < 0:
-            signs = ('negative', '-')
-            skip = dfmacd.iloc[start_idx:][dfmacd > 0].head(1).index
-        else:
-            return (None,None,None,None)
-    except Exception as e:
-        log.info(str(e))
-        log.info("Duplicate indices!")
-        log.info(dfmacd[dfmacd.index.duplicated()])
-        dfmacd = dfmacd.tail(-1)
-        raise
-
-    end_idx = len(dfmacd)-1 if skip.empty else dfmacd.index.get_loc(skip[0])-1
-    n_bars = end_idx - start_idx + 1
-    phase = dfmacd.iloc[start_idx:end_idx+1]
-
-    dt1 = phase.head(1).index[0].to_pydatetime()
-    local_dt1 = to_local(dt1.replace(tzinfo=pytz.utc))
-    dt2 = phase.tail(1).index[0].to_pydatetime()
-    local_dt2 = to_local(dt2.replace(tzinfo=pytz.utc))
-
-    return (
-        (start_idx, end_idx),
-        np.array([
-            dt1, dt2, n_bars, signs[1], phase.mean(), phase.max()
-        ]),
-        phase,
-        '{0:%b %d}-{1:%d} @ {0:%H:%m}-{1:%H:%m}: '\
-        '{2:} phase, {3:} bars x {4:.2f} amp.'\
-        .format(local_dt1, local_dt2, signs[1], n_bars, abs(phase.mean()))
-    )
+def _empty_phases(to_bson):
+    cols = ['lbl', 'bars', 'duration', 'ampMean', 'ampMax', 'priceY',
+        'priceX', 'capt', 'corr']
+    dfh = pd.DataFrame(columns=cols, index=pd.DatetimeIndex([], name='start'))
+    return dfh.reset_index() if to_bson else dfh
 
 #------------------------------------------------------------------------------
 def plot(pairs=None, freqstr=None, trades=None, startstr=None, indicators=None, normalize=False):
     '''Generate plotly chart html file.
     Stacked Subplots with a Shared X-Axis
     '''
-    from app.bot.candles import api_update, bulk_load, bulk_append_dfc
+    from app.bot.candles import api_update, bulk_load
     db = app.db
     startdt = None
     annotations, indicators, traces, indices = [],[],[],[]
@@ -195,13 +417,13 @@ def plot(pairs=None, freqstr=None, trades=None, startstr=None, indicators=None,
 
     # Price traces.
     for idx in set(indices):
-        if idx not in app.bot.dfc.index:
+        if idx not in app.bot.dfc:
             bulk_load([idx[0]], [freqtostr(idx[1])], startdt=startdt)
 
-            if idx not in app.bot.dfc.index:
-                bulk_append_dfc(api_update([idx[0]], [freqtostr(idx[1])]))
+            if idx not in app.bot.dfc:
+                api_update([idx[0]], [freqtostr(idx[1])])
 
-        df = app.bot.dfc.ix[idx[0:2]]
+        df = app.bot.dfc.frame(*idx[0:2])
 
         traces.append(go.Scatter(
             x = df.index,
@@ -210,13 +432,15 @@ def plot(pairs=None, freqstr=None, trades=None, startstr=None, indicators=None,
         ))
 
     # Trade entry/exit annotations
+    from app.bot.snapshots import summarize
     for trade in trades:
+        summarize(trade)
         yoffset=-20
-        df = app.bot.dfc.ix[(trade['pair'],strtofreq(trade['freqstr']))]
+        df = app.bot.dfc.frame(trade['pair'], strtofreq(trade['freqstr']))
         df_n = signals.normalize(df['close'])
 
         for n in [0, -1]:
-            ss = trade['snapshots'][n]
+            ss = trade['entry'] if n == 0 else trade['last']
             loc = df.index.get_loc(ss['candle']['open_time'].astimezone(pytz.utc))  #.replace(tzinfo=pytz.utc))
 
             annotations.append(dict(
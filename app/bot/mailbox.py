@@ -0,0 +1,111 @@
+# app.bot.mailbox
+import threading
+import time
+from collections import deque
+from queue import Empty
+
+#------------------------------------------------------------------------------
+class CandleMailbox():
+    """Coalescing hand-off of candles from websock to trade. Keeps at most
+    one pending unclosed update per (pair, freqstr): a newer update replaces
+    the pending one in place, keeping its position in line. Closed candles
+    are never dropped, and take the place of a pending unclosed update of
+    the same candle. Drop-in for the queue.Queue get/put/empty/qsize calls.
+    """
+    def __init__(self):
+        # FIFO of [candle, received] slots, replaced in place when
+        # coalescing.
+        self.slots = deque()
+        # (pair, freqstr) -> pending unclosed slot.
+        self.pending = {}
+        self.depth = 0
+        self.stats = {'put':0, 'closed':0, 'coalesced':0, 'got':0,
+            'max_depth':0}
+        self.cond = threading.Condition(threading.Lock())
+
+    def __len__(self):
+        return self.depth
+
+    #--------------------------------------------------------------------------
+    def put(self, c):
+        received = time.monotonic()
+        key = (c['pair'], c['freqstr'])
+        with self.cond:
+            self.stats['put'] += 1
+            slot = self.pending.pop(key, None)
+
+            if c['closed']:
+                self.stats['closed'] += 1
+                if slot is not None and slot[0]['open_time'] == c['open_time']:
+                    slot[:] = [c, received]
+                    self.stats['coalesced'] += 1
+                else:
+                    self._append([c, received])
+            elif slot is not None:
+                slot[:] = [c, received]
+                self.pending[key] = slot
+                self.stats['coalesced'] += 1
+            else:
+                slot = [c, received]
+                self.pending[key] = slot
+                self._append(slot)
+            self.cond.notify()
+
+    #--------------------------------------------------------------------------
+    def get(self, block=True, timeout=None):
+        """Oldest pending candle. Raises queue.Empty if none arrives within
+        @timeout seconds (or immediately if not @block).
+        """
+        return self.get_stamped(block, timeout)[0]
+
+    #--------------------------------------------------------------------------
+    def get_stamped(self, block=True, timeout=None):
+        """Like get(), returns (candle, time.monotonic() receipt time).
+        """
+        with self.cond:
+            if block:
+                deadline = None if timeout is None else time.monotonic() + timeout
+                while self.depth == 0:
+                    remain = None if deadline is None else deadline - time.monotonic()
+                    if remain is not None and remain <= 0:
+                        raise Empty
+                    self.cond.wait(remain)
+            elif self.depth == 0:
+                raise Empty
+
+            slot = self.slots.popleft()
+            c = slot[0]
+            key = (c['pair'], c['freqstr'])
+            if self.pending.get(key) is slot:
+                del self.pending[key]
+            self.depth -= 1
+            self.stats['got'] += 1
+            return tuple(slot)
+
+    #--------------------------------------------------------------------------
+    def get_nowait(self):
+        return self.get(block=False)
+
+    #--------------------------------------------------------------------------
+    def empty(self):
+        return self.depth == 0
+
+    #--------------------------------------------------------------------------
+    def qsize(self):
+        return self.depth
+
+    #--------------------------------------------------------------------------
+    def metrics(self):
+        """Queue depth and coalesce rate (fraction of puts merged into a
+        pending update) since creation.
+        """
+        with self.cond:
+            return dict(self.stats, depth=self.depth,
+                coalesce_rate=round(self.stats['coalesced'] /
+                    max(self.stats['put'], 1), 3))
+
+    #--------------------------------------------------------------------------
+    def _append(self, slot):
+        self.slots.append(slot)
+        self.depth += 1
+        self.stats['max_depth'] = max(self.stats['max_depth'], self.depth)
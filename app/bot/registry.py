@@ -0,0 +1,119 @@
+# app.bot.registry
+import logging
+import threading
+from pymongo.errors import PyMongoError
+from docs.botconf import *
+import app
+
+log = logging.getLogger('registry')
+
+# Versioned in-memory view of db.assets botTradeStatus. Sets are replaced,
+# never mutated, so readers can hold them without locking.
+status = {}
+# ENABLED pairs, and ENABLED + TEMP pairs.
+enabled, active = frozenset(), frozenset()
+version = 0
+subscribers = []
+loaded = False
+lock = threading.RLock()
+
+#------------------------------------------------------------------------------
+def run(e_pairs, e_kill):
+    """Registry watcher thread. Applies external db.assets botTradeStatus
+    changes through a change stream, or polls every PAIRS_REFRESH_SEC if
+    change streams aren't supported (standalone mongod).
+    """
+    load()
+    try:
+        watch(e_kill)
+    except PyMongoError as e:
+        log.info("Change stream unavailable, polling db.assets. e=%s", str(e))
+        while not e_kill.isSet():
+            e_kill.wait(PAIRS_REFRESH_SEC)
+            reload()
+    print("Registry thread: terminating...")
+
+#------------------------------------------------------------------------------
+def watch(e_kill):
+    pipeline = [{'$match': {'$or': [
+        {'operationType': {'$in': ['insert', 'replace']}},
+        {'updateDescription.updatedFields.botTradeStatus': {'$exists':True}}
+    ]}}]
+    with app.get_db().assets.watch(pipeline,
+        full_document='updateLookup', max_await_time_ms=1000) as stream:
+        while not e_kill.isSet():
+            change = stream.try_next()
+            if change is None or change.get('fullDocument') is None:
+                continue
+            doc = change['fullDocument']
+            update({doc['symbol']: doc.get('botTradeStatus')})
+
+#------------------------------------------------------------------------------
+def load():
+    """Build registry from db.assets. Only runs once.
+    """
+    with lock:
+        if not loaded:
+            reload()
+
+#------------------------------------------------------------------------------
+def reload():
+    """Rebuild registry from db.assets, notifying subscribers if anything
+    changed.
+    """
+    global loaded
+    cursor = app.get_db().assets.find(
+        {'botTradeStatus':{'$in':['ENABLED', 'TEMP']}},
+        {'_id':0, 'symbol':1, 'botTradeStatus':1})
+    new = {n['symbol']: n['botTradeStatus'] for n in cursor}
+
+    with lock:
+        changes = {k: new.get(k) for k in set(status) | set(new) \
+            if status.get(k) != new.get(k)}
+        loaded = True
+        update(changes)
+
+#------------------------------------------------------------------------------
+def update(changes):
+    """Apply {symbol: botTradeStatus} @changes atomically. Bumps version and
+    notifies subscribers if the enabled/temp sets changed.
+    """
+    global enabled, active, version
+    with lock:
+        changes = {k: v for k, v in changes.items() if status.get(k) != v}
+        if len(changes) == 0:
+            return version
+        for k, v in changes.items():
+            if v in ('ENABLED', 'TEMP'):
+                status[k] = v
+            else:
+                status.pop(k, None)
+        _enabled = frozenset(k for k, v in status.items() if v == 'ENABLED')
+        _active = frozenset(status)
+        if _enabled == enabled and _active == active:
+            return version
+        enabled, active = _enabled, _active
+        version += 1
+        callbacks = list(subscribers)
+
+    log.debug("Pair registry v%s: %s enabled, %s temp.", version,
+        len(enabled), len(active) - len(enabled))
+    for fn in callbacks:
+        fn(version)
+    return version
+
+#------------------------------------------------------------------------------
+def get(with_temp=False):
+    """Enabled (plus TEMP if @with_temp) pairs as frozenset. No DB access
+    once loaded.
+    """
+    if not loaded:
+        load()
+    return active if with_temp else enabled
+
+#------------------------------------------------------------------------------
+def subscribe(fn):
+    """Call fn(version) after every registry change.
+    """
+    with lock:
+        subscribers.append(fn)
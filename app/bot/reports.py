@@ -8,24 +8,22 @@ from docs.botconf import *
 from docs.conf import *
 import app, app.bot
 from app.common.utils import pct_diff, to_relative_str, utc_datetime as now
-from app.common.timeutils import strtofreq
-from . import macd, signals
+from . import ledger, macd, signals, symbols
 
 def tradelog(msg): log.log(99, msg)
 log = logging.getLogger('reports')
 
 #------------------------------------------------------------------------------
 def trades(trade_ids):
-    db = app.get_db()
     cols = ['freq', "type", "Δprice", "macd", "rsi", "zscore", "time", "algo", "details"]
     data, indexes = [], []
 
     for _id in trade_ids:
-        record = db.trades.find_one({"_id":_id})
+        record = ledger.get(_id)
         indexes.append(record['pair'])
-        ss1 = record['snapshots'][0]
-        ss_new = record['snapshots'][-1]
-        df = app.bot.dfc.loc[record['pair'], strtofreq(record['freqstr'])].tail(100)
+        ss1 = record['entry']
+        ss_new = record['last']
+        df = app.bot.dfc.frame(record['pair'], symbols.freq(record['freqstr'])).tail(100)
 
         if len(record['orders']) > 1:
             c1 = ss1['candle']
@@ -80,32 +78,31 @@ def trades(trade_ids):
 def positions():
     """Position summary.
     """
-    db = app.get_db()
     cols = ["freq", "price", "Δprice", "macd", "rsi", "zscore", "time", "algo"]
     data, indexes = [], []
-    opentrades = db.trades.find({'status':'open'})
+    opentrades = ledger.open_trades()
+    dfi = signals.bulk_indicators(set(
+        (n['pair'], symbols.freq(n['freqstr'])) for n in opentrades),
+        rsi_periods=None)
 
     for record in opentrades:
-        ss1 = record['snapshots'][0]
+        ss1 = record['entry']
         c1 = ss1['candle']
-        ss_new = record['snapshots'][-1]
-        freq = strtofreq(record['freqstr'])
-        df = app.bot.dfc.loc[record['pair'], freq]
-        dfmacd, phases = macd.histo_phases(df, record['pair'], record['freqstr'], 100)
+        ind = dfi.loc[(record['pair'], symbols.freq(record['freqstr']))]
 
         data.append([
             c1['freqstr'],
-            df.iloc[-1]['close'],
-            pct_diff(c1['close'], df.iloc[-1]['close']),
-            phases[-1].iloc[-1],
-            signals.rsi(df['close'], 14),
-            signals.zscore(df['close'], df.iloc[-1]['close'], 21),
+            ind['close'],
+            pct_diff(c1['close'], ind['close']),
+            ind['macd'],
+            ind['rsi'],
+            ind['zscore'],
             to_relative_str(now() - record['start_time']),
             record['algo']
         ])
         indexes.append(record['pair'])
 
-    if opentrades.count() == 0:
+    if len(opentrades) == 0:
         tradelog("0 open positions")
     else:
         df = pd.DataFrame(data, index=pd.Index(indexes), columns=cols)
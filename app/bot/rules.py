@@ -0,0 +1,160 @@
+# app.bot.rules
+import ast
+import logging
+from functools import reduce
+import numpy as np
+from docs.botconf import *
+
+log = logging.getLogger('rules')
+
+def _and(*args): return reduce(np.logical_and, args)
+def _or(*args): return reduce(np.logical_or, args)
+
+# Functions callable from rule expressions. All work elementwise on arrays.
+funcs = {
+    'pct': lambda a, b: ((b-a)/a)*100,
+    'abs': np.abs,
+    'min': np.minimum,
+    'max': np.maximum
+}
+
+#------------------------------------------------------------------------------
+class Rule():
+    """Single TRD_ALGOS condition compiled from an expression string, i.e.
+    "10 < rsi < 40" or "macd.value < 0 or macd.ampSlope < 0". Dotted names
+    are looked up as flat fields ('macd.value', 'stats.minPrice'), chained
+    comparisons and and/or/not are rewritten into elementwise numpy ops, so
+    the same rule evaluates one snapshot (scalar fields) or many pairs at
+    once (array fields).
+    """
+    def __init__(self, expr):
+        self.expr = expr.strip()
+        self.fields = set()
+        tree = _Vectorize(self.fields).visit(
+            ast.parse(self.expr, mode='eval').body)
+        # Node layouts differ across python versions, so templates are
+        # parsed rather than built by hand.
+        fn = ast.parse('lambda _v: None', mode='eval')
+        fn.body.body = tree
+        ast.fix_missing_locations(fn)
+        self.fn = eval(compile(fn, '<rule>', 'eval'),
+            dict(funcs, __builtins__={}, np=np, _and=_and, _or=_or))
+
+    def __repr__(self):
+        return self.expr
+
+    def __call__(self, values):
+        """Evaluate against @values: dict of field -> scalar or array.
+        """
+        return self.fn(values)
+
+#------------------------------------------------------------------------------
+class _Vectorize(ast.NodeTransformer):
+    """Rewrite a rule expression into elementwise form, collecting the
+    field names it reads.
+    """
+    def __init__(self, fields):
+        self.fields = fields
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        operands = [node.left] + node.comparators
+        parts = [ast.Compare(left=operands[i], ops=[op],
+            comparators=[operands[i+1]]) for i, op in enumerate(node.ops)]
+        return parts[0] if len(parts) == 1 else _call('_and', parts)
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        return _call('_and' if isinstance(node.op, ast.And) else '_or',
+            node.values)
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return _call('np.logical_not', [node.operand])
+        return node
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in funcs:
+            raise ValueError("Unknown function in rule: {}".format(
+                ast.dump(node.func)))
+        node.args = [self.visit(n) for n in node.args]
+        return node
+
+    def visit_Attribute(self, node):
+        return self._field(node)
+
+    def visit_Name(self, node):
+        return self._field(node)
+
+    def _field(self, node):
+        path = []
+        while isinstance(node, ast.Attribute):
+            path.insert(0, node.attr)
+            node = node.value
+        if not isinstance(node, ast.Name):
+            raise ValueError("Invalid field in rule.")
+        name = '.'.join([node.id] + path)
+        self.fields.add(name)
+        return ast.parse('_v[{!r}]'.format(name), mode='eval').body
+
+def _call(fn, args):
+    func = ast.Name(id=fn, ctx=ast.Load())
+    if '.' in fn:
+        mod, attr = fn.split('.')
+        func = ast.Attribute(value=ast.Name(id=mod, ctx=ast.Load()),
+            attr=attr, ctx=ast.Load())
+    return ast.Call(func=func, args=args, keywords=[])
+
+#------------------------------------------------------------------------------
+def compile_algos(algos):
+    """Compile TRD_ALGOS condition strings.
+    Returns {algo name: {section: [Rule]}}.
+    """
+    return {algo['name']: {section: [Rule(n) for n in algo[section]['conditions']] \
+        for section in ['entry', 'target', 'failure']} for algo in algos}
+
+#------------------------------------------------------------------------------
+def flatten(indicators, stats=None):
+    """Snapshot indicators (and trade @stats) as flat rule fields, i.e.
+    {'rsi':.., 'macd.value':.., 'stats.minPrice':..}.
+    """
+    values = {}
+    for k, v in indicators.items():
+        if isinstance(v, dict):
+            values.update({'{}.{}'.format(k, k2): v2 for k2, v2 in v.items()})
+        else:
+            values[k] = v
+    if stats:
+        values.update({'stats.{}'.format(k): v for k, v in stats.items()})
+    return values
+
+#------------------------------------------------------------------------------
+def evaluate(name, section, values, ruleset=None):
+    """True (or boolean array for array @values) where all @section rules of
+    algo @name hold.
+    @ruleset: compile_algos() result to use instead of the active rules
+    """
+    return _and(*[rule(values) for rule in (ruleset or compiled)[name][section]])
+
+#------------------------------------------------------------------------------
+def describe(name, section, ruleset=None):
+    """Rule expression strings of algo @name @section.
+    @ruleset: compile_algos() result to use instead of the active rules
+    """
+    if ruleset is not None:
+        return [r.expr for r in ruleset[name][section]]
+    return descriptions[name][section]
+
+#------------------------------------------------------------------------------
+def load(algos):
+    """Compile @algos and make them the active rule set.
+    """
+    global compiled, descriptions
+    compiled = compile_algos(algos)
+    descriptions = {name: {section: [r.expr for r in rules] \
+        for section, rules in sections.items()} for name, sections in compiled.items()}
+
+# Compiled once at import.
+compiled, descriptions = {}, {}
+load(TRD_ALGOS)
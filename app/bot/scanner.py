@@ -11,8 +11,8 @@ import app, app.bot
 from app.common.timer import Timer
 from app.common.utils import to_local, utc_datetime as now, strtoms
 from app.common.timeutils import strtofreq
-from . import set_pairs, get_pairs, macd, tickers, trade
-from .candles import api_update, bulk_append_dfc
+from . import set_pairs, get_pairs, candles, macd, signals, tickers, trade
+from .candles import api_update
 from . import lock
 
 log = logging.getLogger('scanner')
@@ -39,6 +39,7 @@ def run(e_pairs, e_kill):
             set_pairs([],'ENABLED', exclusively=True)
             # Scan and enable any additional filtered pairs.
             sma_med_trend_filter()
+            candles.evict_inactive()
             tmr.reset()
         time.sleep(3)
     print("Scanner thread: terminating...")
@@ -60,18 +61,23 @@ def sma_med_trend_filter():
     filtered = trend['filters'][0](tickers.binance_24h())
     results = []
 
+    api_update(filtered, [trend['freqstr']], silent=True)
+
+    # SMA slope for every filtered pair in one pass.
+    dfsma = signals.sma_slope(
+        app.bot.dfc.matrix([(n, freq) for n in filtered]), trend['span'])
+
     for pair in filtered:
-        bulk_append_dfc(api_update([pair], [trend['freqstr']], silent=True))
-        sma = app.bot.dfc.loc[pair, freq]['close']\
-            .rolling(trend['span']).mean().pct_change()*100
+        sma = dfsma[(pair, freq)].dropna()
 
         if all([fn(sma) for fn in trend['conditions']]):
-            set_pairs([pair], 'ENABLED')
             results.append({
                 'pair': pair,
                 lbl: sma.iloc[-1]
             })
-        time.sleep(3)
+
+    if len(results) > 0:
+        set_pairs([n['pair'] for n in results], 'ENABLED')
 
     df = pd.DataFrame(results)\
         .set_index('pair').sort_values(lbl).round(1)
@@ -120,12 +126,21 @@ def macd_med_trend_filter():
     TRD_FREQS = docs.botconf.TRD_FREQS
     DEF_KLINE_HIST_LEN = docs.botconf.DEF_KLINE_HIST_LEN
 
-    for pair in app.bot.get_pairs():
-        for freqstr in TRD_FREQS:
-            freq = strtofreq(freqstr)
-            periods = int((strtoms("now utc") - strtoms(DEF_KLINE_HIST_LEN)) / ((freq * 1000))) #/2))
-            df = app.bot.dfc.loc[pair,freq]
-            dfh, phases = macd.histo_phases(df, pair, freqstr, periods)
+    pairs = app.bot.get_pairs()
+
+    for freqstr in TRD_FREQS:
+        freq = strtofreq(freqstr)
+        periods = int((strtoms("now utc") - strtoms(DEF_KLINE_HIST_LEN)) / ((freq * 1000))) #/2))
+        keys = [(pair, freq) for pair in pairs if (pair, freq) in app.bot.dfc]
+        # Normalized histogram for all pairs of this freq in one pass.
+        dfmacd = macd.generate_matrix(app.bot.dfc.matrix(keys))
+
+        for pair, freq in keys:
+            df = app.bot.dfc.frame(pair, freq)
+            histo = pd.Series(dfmacd[(pair, freq)].values[-len(df):],
+                index=df.index, name='macd_diff')
+            dfh, phases = macd.histo_phases(df, pair, freqstr, periods,
+                dfmacd=histo)
 
             # Format for log output
             dfh = dfh.tail(3)
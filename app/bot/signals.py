@@ -6,10 +6,15 @@ import pandas as pd
 import numpy as np
 from docs.conf import ema9
 import app, app.bot
+from app.common.utils import pct_diff
 from app.common.timeutils import strtofreq
 from . import candles
 
 log = logging.getLogger('signals')
+# Rule fields computed by window_indicators/entry_indicators.
+entry_fields = ['buyRatio', 'rsi', 'wickSlope', 'zscore', 'macd.value',
+    'macd.bars', 'macd.ampMean', 'macd.ampMax', 'macd.ampSlope',
+    'macd.priceY', 'macd.priceX']
 
 #-----------------------------------------------------------------------------
 def rsi(df, span):
@@ -34,6 +39,182 @@ def zscore(series, value, span):
     z = (value - ema.mean()) / ema.std()
     return z.round(2)
 
+#-----------------------------------------------------------------------------
+def sma_slope(df, span):
+    """Percent change of the @span period SMA. Works column-wise on a 2-D
+    dataframe of closes.
+    """
+    return df.rolling(span).mean().pct_change() * 100
+
+#-----------------------------------------------------------------------------
+def bulk_indicators(keys, periods=None, sma_span=5, rsi_span=14, z_span=21,
+    ema=None, rsi_periods=100):
+    """Latest close, SMA slope, RSI, z-score and MACD for many (pair, freq)
+    keys in one 2-D pass over the candle store instead of one series at a
+    time. Values per key match rsi(), zscore(), sma_slope() and the
+    normalized macd histogram over the same history.
+    @periods: rows of history to use per key, default all
+    @rsi_periods: rows of history for RSI, None for all. Snapshots use the
+    last 100, reports the full history as rsi(df['close'], 14) did
+    Returns dataframe indexed by (pair, freq).
+    """
+    from . import macd
+    keys = list(keys)
+    closes = app.bot.dfc.matrix(keys, periods)
+    if len(keys) == 0 or len(closes) == 0:
+        return pd.DataFrame(columns=['close', 'smaSlope', 'rsi', 'zscore',
+            'macd'])
+
+    rsi_closes = closes.tail(rsi_periods) if rsi_periods else closes
+    diff = rsi_closes.diff().ewm(span=rsi_span, min_periods=rsi_span)\
+        .mean().tail(rsi_span)
+    gains = diff.where(diff > 0)
+    rs = abs(gains.mean() / diff.where(diff < 0).mean())
+    _rsi = (100 - (100 / (1.0 + rs)))
+    _rsi = _rsi.where(_rsi.notnull(), (gains.count() > 0) * 100.0).round(0)
+
+    ema_z = closes.ewm(span=z_span).mean()
+    last = closes.iloc[-1]
+
+    dfi = pd.DataFrame({
+        'close': last,
+        'smaSlope': sma_slope(closes, sma_span).iloc[-1],
+        'rsi': _rsi,
+        'zscore': ((last - ema_z.mean()) / ema_z.std()).round(2),
+        'macd': macd.generate_matrix(closes, ema=ema).iloc[-1]
+    })
+    dfi.index.names = ['pair', 'freq']
+    return dfi
+
+#-----------------------------------------------------------------------------
+def ewm_rows(values, span, min_periods=0):
+    """Adjusted EWM down the rows of 2-D ndarray @values, same as
+    DataFrame.ewm(span=span, adjust=True, ignore_na=False,
+    min_periods=min_periods).mean(). Steps every column at once, so it is
+    much faster than pandas for many short columns. Tall arrays (few long
+    columns) still go through pandas.
+    """
+    if len(values) > values.shape[1]:
+        return pd.DataFrame(values).ewm(span=span, adjust=True,
+            ignore_na=False, min_periods=min_periods).mean().values
+    w = 1 - 2/(span + 1)
+    k = values.shape[1]
+    out = np.empty(values.shape)
+    num, den, nobs = np.zeros(k), np.zeros(k), np.zeros(k)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i, x in enumerate(values):
+            valid = x == x
+            num = w*num + np.where(valid, x, 0.0)
+            den = w*den + valid
+            nobs += valid
+            out[i] = np.where(nobs >= max(min_periods, 1), num/den, np.nan)
+    return out
+
+#-----------------------------------------------------------------------------
+def entry_indicators(keys, periods=100, ema=None):
+    """Snapshot indicators used by entry rules for many (pair, freq) keys at
+    once, as flat rule fields (see rules.flatten and window_indicators).
+    Returns dataframe indexed by (pair, freq).
+    """
+    keys = list(keys)
+    dfc = app.bot.dfc
+    closes = dfc.matrix(keys)
+    if len(keys) == 0 or len(closes) == 0:
+        return pd.DataFrame(columns=entry_fields)
+    n = min(periods, len(closes))
+    mat = lambda col: dfc.matrix(keys, n, column=col).values
+    fields = window_indicators(closes.values, mat('open'), mat('high'),
+        mat('low'), mat('volume'), mat('buy_vol'), periods=periods, ema=ema)
+    dfi = pd.DataFrame(fields, index=closes.columns, columns=entry_fields)
+    dfi.index.names = ['pair', 'freq']
+    return dfi
+
+#-----------------------------------------------------------------------------
+def window_indicators(closes, _open, high, low, volume, buy_vol, periods=100,
+    ema=None, rsi_span=14, z_span=21, rsi_periods=100):
+    """Snapshot indicators at the newest row of many candle windows at once,
+    one window per column. Same values as trade.snapshot() on each window's
+    frame: rsi, zscore and buyRatio as in bulk_indicators, and the current
+    macd phase stats (bars, ampMean, ampMax, ampSlope, priceY, priceX) found
+    column-wise over the last @periods rows, matching the last row of
+    macd.histo_phases().
+    @closes: 2-D ndarray, rows oldest first, NaN padded at the top for
+    shorter windows (see CandleStore.matrix)
+    @_open, @high, @low: same layout, at least the last @periods rows
+    @volume, @buy_vol: same layout, at least the last row
+    Returns dict of entry_fields -> 1-D ndarray.
+    """
+    from . import macd
+    _histo = macd.generate_rows(closes, ema=ema)
+    n, k = min(periods, len(closes)), closes.shape[1]
+    _open, high, low = _open[-n:], high[-n:], low[-n:]
+    close, histo = closes[-n:], _histo[-n:]
+    volume, buy_vol = volume[-1], buy_vol[-1]
+    cols = np.arange(k)
+    rows = np.arange(n)[:,None]
+
+    # Current phase starts at the first non-zero bar after the last bar of
+    # opposite sign to the newest non-zero bar.
+    sign = np.sign(np.nan_to_num(histo))
+    nonzero = sign != 0
+    last_nz = np.where(nonzero.any(axis=0), n - 1 - np.argmax(nonzero[::-1], axis=0), -1)
+    s_last = sign[np.maximum(last_nz, 0), cols]
+    opposite = nonzero & (sign != s_last)
+    last_opp = np.where(opposite.any(axis=0), n - 1 - np.argmax(opposite[::-1], axis=0), -1)
+    start = np.argmax(nonzero & (rows > last_opp), axis=0)
+    has_phase = last_nz >= 0
+    phase = (rows >= start) & has_phase
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        n_phase = (phase & ~np.isnan(histo)).sum(axis=0)
+        amp_mean = np.where(phase, np.nan_to_num(histo), 0.0).sum(axis=0) / n_phase
+        amp_max = np.max(np.where(phase & ~np.isnan(histo), histo, -np.inf), axis=0)
+        price_y = pct_diff(np.fmin.reduce(np.where(phase, low, np.nan), axis=0),
+            np.fmax.reduce(np.where(phase, high, np.nan), axis=0))
+        price_y = np.where(amp_mean < 0, -price_y, price_y)
+        price_x = pct_diff(_open[start, cols], close[-1])
+        buy_ratio = np.where(volume > 0, buy_vol / volume, 0.0)
+
+        # ampSlope: adjusted ewm (span up to 3) of the phase's bar diffs,
+        # NaN diffs skipped, as snapshots compute it.
+        span = np.minimum(3, n - start)
+        alpha = 2 / (span + 1)
+        diff = np.vstack((np.full((1, k), np.nan), np.diff(histo, axis=0)))
+        valid = (rows > start) & ~np.isnan(diff)
+        w = np.where(valid, (1 - alpha) ** (n - 1 - rows), 0.0)
+        amp_slope = (np.where(valid, diff, 0.0) * w).sum(axis=0) / w.sum(axis=0)
+
+        # RSI and z-score as bulk_indicators computes them.
+        rsi_closes = closes[-rsi_periods:] if rsi_periods else closes
+        diff = np.diff(np.vstack((np.full((1, k), np.nan), rsi_closes)), axis=0)
+        diff = ewm_rows(diff, rsi_span, min_periods=rsi_span)[-rsi_span:]
+        gains, losses = diff > 0, diff < 0
+        rs = np.abs((np.where(gains, diff, 0.0).sum(axis=0) / gains.sum(axis=0)) /
+            (np.where(losses, diff, 0.0).sum(axis=0) / losses.sum(axis=0)))
+        rsi = 100 - (100 / (1.0 + rs))
+        rsi = np.where(np.isnan(rsi), gains.any(axis=0) * 100.0, rsi).round(0)
+
+        ema_z = ewm_rows(closes, z_span)
+        n_z = (~np.isnan(ema_z)).sum(axis=0)
+        mean_z = np.nansum(ema_z, axis=0) / n_z
+        std_z = np.sqrt(np.nansum((ema_z - mean_z)**2, axis=0) / (n_z - 1))
+        zscore = ((closes[-1] - mean_z) / std_z).round(2)
+
+    nan = np.full(k, np.nan)
+    return {
+        'buyRatio': buy_ratio.round(2),
+        'rsi': rsi,
+        'wickSlope': np.zeros(k),
+        'zscore': zscore,
+        'macd.value': np.where(has_phase, histo[-1], nan).round(2),
+        'macd.bars': np.where(has_phase, n - start, 0),
+        'macd.ampMean': np.where(has_phase, amp_mean, nan).round(2),
+        'macd.ampMax': np.where(has_phase & np.isfinite(amp_max), amp_max, nan).round(2),
+        'macd.ampSlope': np.where(has_phase, amp_slope, nan).round(2),
+        'macd.priceY': np.where(has_phase, price_y, nan).round(2),
+        'macd.priceX': np.where(has_phase, price_x, nan).round(2)
+    }
+
 #-----------------------------------------------------------------------------
 def normalize(s):
     """Normalize series between between 0..1
@@ -0,0 +1,58 @@
+# app.bot.snapshots
+import logging
+from pymongo import ASCENDING, InsertOne
+import app
+from . import ledger
+
+log = logging.getLogger('snapshots')
+
+# Append-only trade snapshot store. One db.trade_snapshots doc per snapshot,
+# keyed by (trade_id, seq). Trade documents only keep the 'entry' and 'last'
+# snapshots plus 'snapshot_count'.
+indexed = False
+
+#------------------------------------------------------------------------------
+def append(record, ss):
+    """Append snapshot @ss of open trade @record. Updates the trade's last
+    snapshot and count; the snapshot doc is written with the ledger's
+    ordered writes.
+    """
+    seq = record.get('snapshot_count', 0)
+    ledger.queue('trade_snapshots', InsertOne({
+        'trade_id': record['_id'],
+        'seq': seq,
+        'time': ss['time'],
+        'candle': ss['candle'],
+        'indicators': ss['indicators'],
+        'book': ss['book']
+    }))
+    ledger.update(record, {'$set': {'last':ss, 'snapshot_count':seq+1}})
+
+#------------------------------------------------------------------------------
+def find(trade_id, projection=None):
+    """Snapshots of trade @trade_id in order. Use @projection to fetch only
+    the fields needed, i.e. {'candle.close':1}.
+    """
+    ensure_index()
+    return list(app.get_db().trade_snapshots.find({'trade_id':trade_id},
+        projection).sort('seq', ASCENDING))
+
+#------------------------------------------------------------------------------
+def summarize(record):
+    """Convert a trade document with an embedded 'snapshots' array (old
+    format) to the entry/last summary in place. Returns @record.
+    """
+    if record is not None and 'snapshots' in record:
+        snaps = record.pop('snapshots')
+        record.setdefault('entry', snaps[0])
+        record.setdefault('last', snaps[-1])
+        record.setdefault('snapshot_count', len(snaps))
+    return record
+
+#------------------------------------------------------------------------------
+def ensure_index():
+    global indexed
+    if not indexed:
+        app.get_db().trade_snapshots.create_index(
+            [('trade_id', ASCENDING), ('seq', ASCENDING)], unique=True)
+        indexed = True
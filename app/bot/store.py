@@ -0,0 +1,290 @@
+# app.bot.store
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from . import symbols
+
+log = logging.getLogger('store')
+
+# Float columns held for every candle, in buffer column order.
+columns = ['open', 'close', 'high', 'low', 'trades', 'volume', 'buy_vol']
+DEF_CAPACITY = 512
+
+#------------------------------------------------------------------------------
+class CandleBuffer():
+    """Preallocated candle buffer for a single (pair, freq) key.
+    Rows live in a window [start:end) of fixed numpy arrays sorted by
+    open_time. Appending or revising the live candle is O(1). When the
+    window reaches the end of the arrays it is copied into a fresh
+    allocation (amortized O(1)), so views handed out earlier are never
+    shifted underneath their readers.
+    """
+    def __init__(self, capacity=DEF_CAPACITY, maxlen=None):
+        self.maxlen = maxlen
+        self.times = np.empty(capacity, dtype='datetime64[ns]')
+        self.values = np.empty((capacity, len(columns)), dtype=np.float64)
+        self.start = self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    #--------------------------------------------------------------------------
+    def last_time(self):
+        """open_time of newest row as int64 ns, or None if empty.
+        """
+        if self.end == self.start:
+            return None
+        return self.times[self.end-1].astype(np.int64)
+
+    #--------------------------------------------------------------------------
+    def first_time(self):
+        """open_time of oldest row as int64 ms, or None if empty.
+        """
+        if self.end == self.start:
+            return None
+        return int(self.times[self.start].astype('datetime64[ms]').astype(np.int64))
+
+    #--------------------------------------------------------------------------
+    def upsert(self, t, row):
+        """Revise the row at open_time @t or append it as the newest row.
+        @t: np.datetime64[ns] open_time
+        @row: sequence of floats in buffer column order
+        """
+        if self.end > self.start:
+            last = self.times[self.end-1]
+            if t == last:
+                self.values[self.end-1] = row
+                return
+            elif t < last:
+                # Out-of-order revision. Rare, fall back to merge.
+                return self.merge(np.array([t]), np.array([row], dtype=np.float64))
+        if self.end == len(self.times):
+            self._reserve(1)
+        self.times[self.end] = t
+        self.values[self.end] = row
+        self.end += 1
+        self._trim()
+
+    #--------------------------------------------------------------------------
+    def merge(self, times, values, keep='old'):
+        """Merge a block of rows, dropping duplicate open_times.
+        @times: datetime64[ns] array
+        @values: 2-D float array in buffer column order
+        @keep: 'old' keeps existing rows on duplicates, 'new' replaces them
+        """
+        if len(times) == 0:
+            return
+        order = np.argsort(times, kind='stable')
+        times, values = times[order], values[order]
+        # Fast path: entire block is newer than existing history.
+        if self.end == self.start or times[0] > self.times[self.end-1]:
+            uniq = np.concatenate(([True], times[1:] != times[:-1]))
+            times, values = times[uniq], values[uniq]
+            if self.maxlen is not None:
+                times, values = times[-self.maxlen:], values[-self.maxlen:]
+            if self.end + len(times) > len(self.times):
+                self._reserve(len(times))
+            self.times[self.end:self.end+len(times)] = times
+            self.values[self.end:self.end+len(times)] = values
+            self.end += len(times)
+            return self._trim()
+
+        old_t = self.times[self.start:self.end]
+        old_v = self.values[self.start:self.end]
+        if keep == 'old':
+            all_t = np.concatenate((old_t, times))
+            all_v = np.concatenate((old_v, values))
+        else:
+            all_t = np.concatenate((times, old_t))
+            all_v = np.concatenate((values, old_v))
+        order = np.argsort(all_t, kind='stable')
+        all_t, all_v = all_t[order], all_v[order]
+        uniq = np.concatenate(([True], all_t[1:] != all_t[:-1]))
+        all_t, all_v = all_t[uniq], all_v[uniq]
+        if self.maxlen is not None:
+            all_t, all_v = all_t[-self.maxlen:], all_v[-self.maxlen:]
+
+        # Replace arrays outright so existing views stay intact.
+        capacity = max(len(self.times), 2*len(all_t))
+        if self.maxlen is not None:
+            capacity = 2*self.maxlen
+        self.times = np.empty(capacity, dtype='datetime64[ns]')
+        self.values = np.empty((capacity, len(columns)), dtype=np.float64)
+        self.times[0:len(all_t)] = all_t
+        self.values[0:len(all_t)] = all_v
+        self.start, self.end = 0, len(all_t)
+        self._trim()
+
+    #--------------------------------------------------------------------------
+    def frame(self):
+        """DataFrame view over the buffer window indexed by open_time. Values
+        are not copied.
+        """
+        s, e = self.start, self.end
+        return pd.DataFrame(
+            self.values[s:e],
+            index=pd.DatetimeIndex(self.times[s:e], name='open_time'),
+            columns=columns,
+            copy=False)
+
+    #--------------------------------------------------------------------------
+    def nbytes(self):
+        """Allocated bytes, including unused capacity.
+        """
+        return self.times.nbytes + self.values.nbytes
+
+    #--------------------------------------------------------------------------
+    def _reserve(self, n):
+        """Move window to the head of a new allocation with room for @n more
+        rows.
+        """
+        size = self.end - self.start
+        capacity = max(len(self.times), 2*(size+n))
+        if self.maxlen is not None:
+            capacity = max(2*self.maxlen, size+n)
+        times = np.empty(capacity, dtype='datetime64[ns]')
+        values = np.empty((capacity, len(columns)), dtype=np.float64)
+        times[0:size] = self.times[self.start:self.end]
+        values[0:size] = self.values[self.start:self.end]
+        self.times, self.values = times, values
+        self.start, self.end = 0, size
+
+    #--------------------------------------------------------------------------
+    def _trim(self):
+        if self.maxlen is not None and self.end - self.start > self.maxlen:
+            self.start = self.end - self.maxlen
+
+#------------------------------------------------------------------------------
+class CandleStore():
+    """Historic candle data for all (pair, freq) keys, one CandleBuffer per
+    key. Replaces the (pair, freq, open_time) MultiIndex dataframe.
+    @maxlen: optional row limit per buffer, oldest rows are dropped
+    @retention: optional {freq: row limit} for buffers of that freq, used
+    where @maxlen isn't set
+    """
+    def __init__(self, maxlen=None, retention=None):
+        self.maxlen = maxlen
+        self.retention = retention or {}
+        self.buffers = {}
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return sum(len(n) for n in list(self.buffers.values()))
+
+    def __contains__(self, key):
+        return tuple(key[0:2]) in self.buffers
+
+    def keys(self):
+        return list(self.buffers.keys())
+
+    #--------------------------------------------------------------------------
+    def get(self, pair, freq):
+        """CandleBuffer for (pair, freq) or None.
+        """
+        return self.buffers.get((pair, freq))
+
+    #--------------------------------------------------------------------------
+    def limit(self, freq):
+        """Row limit for buffers of @freq, or None if unbounded.
+        """
+        return self.maxlen if self.maxlen is not None else self.retention.get(freq)
+
+    #--------------------------------------------------------------------------
+    def buffer(self, pair, freq):
+        buf = self.buffers.get((pair, freq))
+        if buf is None:
+            with self.lock:
+                buf = self.buffers.setdefault((pair, freq),
+                    CandleBuffer(maxlen=self.limit(freq)))
+        return buf
+
+    #--------------------------------------------------------------------------
+    def evict(self, pairs):
+        """Drop all history of @pairs.
+        Returns number of rows dropped.
+        """
+        pairs = set(pairs)
+        with self.lock:
+            keys = [k for k in self.buffers if k[0] in pairs]
+            return sum(len(self.buffers.pop(k)) for k in keys)
+
+    #--------------------------------------------------------------------------
+    def memory(self):
+        """Rows, row limit and allocated bytes per (pair, freq) key.
+        Returns dataframe indexed by (pair, freq), largest first.
+        """
+        with self.lock:
+            rows = [(k[0], k[1], len(v), v.maxlen, v.nbytes()) \
+                for k, v in self.buffers.items()]
+        df = pd.DataFrame(rows, columns=['pair', 'freq', 'rows', 'limit',
+            'bytes']).set_index(['pair', 'freq'])
+        return df.sort_values('bytes', ascending=False)
+
+    #--------------------------------------------------------------------------
+    def first_time(self, pair, freq):
+        """Oldest open_time held for (pair, freq) in ms. Infinity if none.
+        """
+        buf = self.buffers.get((pair, freq))
+        t = buf.first_time() if buf is not None else None
+        return float('inf') if t is None else t
+
+    #--------------------------------------------------------------------------
+    def upsert(self, pair, freq, open_time, row):
+        """Edit or append a single candle.
+        @open_time: naive UTC datetime/Timestamp
+        """
+        with self.lock:
+            self.buffer(pair, freq).upsert(
+                np.datetime64(open_time, 'ns'), row)
+
+    #--------------------------------------------------------------------------
+    def merge(self, pair, freq, times, values, keep='old'):
+        with self.lock:
+            self.buffer(pair, freq).merge(
+                np.asarray(times, dtype='datetime64[ns]'),
+                np.asarray(values, dtype=np.float64),
+                keep=keep)
+
+    #--------------------------------------------------------------------------
+    def frame(self, pair, freq):
+        """Dataframe view for (pair, freq), indexed by open_time. Raises
+        KeyError for unknown keys, as dfc.loc[pair, freq] did.
+        """
+        buf = self.buffers.get((pair, freq))
+        if buf is None or len(buf) == 0:
+            raise KeyError((pair, freq))
+        with self.lock:
+            return buf.frame()
+
+    #--------------------------------------------------------------------------
+    def matrix(self, keys, n=None, column='close'):
+        """2-D dataframe of @column for many keys, one column per key. Rows are
+        positional (last row = newest candle of every key), right-aligned and
+        NaN padded for keys with less history.
+        @n: number of rows, default longest history among @keys
+        """
+        keys = [tuple(k) for k in keys]
+        j = columns.index(column)
+        with self.lock:
+            bufs = [self.buffers.get(k) for k in keys]
+            lens = [len(b) if b is not None else 0 for b in bufs]
+            n = max(lens + [0]) if n is None else n
+            arr = np.full((n, len(keys)), np.nan)
+            for i, buf in enumerate(bufs):
+                m = min(n, lens[i])
+                if m > 0:
+                    arr[n-m:, i] = buf.values[buf.end-m:buf.end, j]
+        return pd.DataFrame(arr,
+            columns=symbols.index(keys) if len(keys) else None)
+
+    #--------------------------------------------------------------------------
+    def to_frame(self):
+        """Copy of the full store as a (pair, freq, open_time) MultiIndex
+        dataframe. For interactive use only.
+        """
+        with self.lock:
+            frames = {k: v.frame() for k, v in self.buffers.items() if len(v)}
+        if len(frames) == 0:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, names=['pair', 'freq', 'open_time'])
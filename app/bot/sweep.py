@@ -0,0 +1,98 @@
+# app.bot.sweep
+import contextlib
+import copy
+import itertools
+import logging
+import os
+import tempfile
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from docs.botconf import *
+from . import backtest
+from app.common.timer import Timer
+
+log = logging.getLogger('sweep')
+
+# Worker process state. Candle array memory-mapped from the sweep file, so
+# every worker reads the same pages instead of its own pickled copy.
+worker = {}
+
+#------------------------------------------------------------------------------
+def run(data, algo_name, params, processes=None, history=BACKTEST_HIST_LEN,
+    spread_pct=BACKTEST_SPREAD_PCT):
+    """Backtest every combination of @params for algo @algo_name over a
+    process pool, one backtest.run per configuration with that algo alone.
+    @data: candles.dtype record array (see backtest.load_db/load_file)
+    @params: dict of algo path -> list of values to try, i.e.
+        {'stoploss':[-1, -2.5], 'ema':[(12,26,9), (8,17,9)],
+         'entry.conditions.0':["10 < rsi < 40", "20 < rsi < 45"]}
+    @processes: pool size, default cpu count
+    Returns dataframe of parameters and backtest summary per configuration,
+    ranked by net gain, win rate and drawdown.
+    """
+    t1 = Timer()
+    base = [n for n in TRD_ALGOS if n['name'] == algo_name]
+    if len(base) == 0:
+        raise KeyError("Unknown algo '{}'".format(algo_name))
+
+    configs = grid(params)
+    args = [(configure(base[0], n), history, spread_pct) for n in configs]
+
+    fd, path = tempfile.mkstemp(suffix='.npy')
+    os.close(fd)
+    try:
+        backtest.save_file(path, data)
+        with Pool(processes, initializer=_attach, initargs=(path,)) as pool:
+            summaries = pool.map(_run, args, chunksize=1)
+    finally:
+        os.remove(path)
+
+    df = pd.DataFrame([{**{k:str(v) for k,v in n.items()}, **summary} \
+        for n, summary in zip(configs, summaries)])
+    df = df.sort_values(['net_gain', 'win_rate', 'max_drawdown'],
+        ascending=[False, False, True]).reset_index(drop=True)
+    df.index.name = 'rank'
+
+    log.info("Swept %s configs of '%s' in %s.", len(configs), algo_name,
+        t1.elapsed(unit='s'))
+    return df
+
+#------------------------------------------------------------------------------
+def grid(params):
+    """Every combination of @params values.
+    Returns list of {path: value} dicts.
+    """
+    keys = list(params.keys())
+    return [dict(zip(keys, n)) for n in itertools.product(
+        *[params[k] for k in keys])]
+
+#------------------------------------------------------------------------------
+def configure(algo, overrides):
+    """Copy of @algo with @overrides applied. Paths are dotted keys into the
+    algo dict, integers index lists, i.e. 'stoploss' or 'target.conditions.1'.
+    """
+    algo = copy.deepcopy(algo)
+    for path, value in overrides.items():
+        keys = path.split('.')
+        node = algo
+        for k in keys[:-1]:
+            node = node[int(k) if isinstance(node, list) else k]
+        node[int(keys[-1]) if isinstance(node, list) else keys[-1]] = value
+    return algo
+
+#------------------------------------------------------------------------------
+def _attach(path):
+    worker['data'] = np.load(path, mmap_mode='r')
+
+#------------------------------------------------------------------------------
+def _run(args):
+    """Backtest one configuration in a worker. The algo's 'ema' (default
+    docs.conf macd_ema) sets the macd periods of its run.
+    Returns backtest summary dict.
+    """
+    algo, history, spread_pct = args
+    with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f):
+        result = backtest.run(worker['data'], history=history,
+            spread_pct=spread_pct, algos=[algo], ema=algo.get('ema'))
+    return result['summary']
@@ -0,0 +1,82 @@
+# app.bot.symbols
+import logging
+import threading
+import pandas as pd
+from app.common.timeutils import freqtostr, strtofreq
+
+log = logging.getLogger('symbols')
+
+# Interned pair and frequency codes. Codes are never reassigned during a
+# process lifetime, but differ between runs, so they are never persisted.
+# Binance kline intervals, interned up front so freq codes are fixed.
+INTERVALS = ['1m', '3m', '5m', '15m', '30m', '1h', '2h', '4h', '6h', '8h',
+    '12h', '1d', '3d', '1w']
+
+# code -> pair, pair -> code
+pairs, pair_codes = [], {}
+# code -> freqstr, code -> freq seconds
+freqstrs, secs = [], []
+# freqstr or freq seconds -> code
+freq_codes = {}
+_level = None
+lock = threading.Lock()
+
+#------------------------------------------------------------------------------
+def load(symbols):
+    """Intern exchange @symbols (exchange info order) at startup.
+    """
+    [pair_code(n) for n in symbols]
+    log.debug("%s pairs interned.", len(pairs))
+
+#------------------------------------------------------------------------------
+def pair_code(pair):
+    code = pair_codes.get(pair)
+    if code is None:
+        with lock:
+            code = pair_codes.get(pair)
+            if code is None:
+                code = pair_codes[pair] = len(pairs)
+                pairs.append(pair)
+    return code
+
+#------------------------------------------------------------------------------
+def freq_code(freq):
+    """Code for freqstr ('5m') or frequency in seconds (300).
+    """
+    code = freq_codes.get(freq)
+    if code is None:
+        with lock:
+            sec = strtofreq(freq) if isinstance(freq, str) else int(freq)
+            code = freq_codes.get(sec)
+            if code is None:
+                code = len(freqstrs)
+                freqstrs.append(freqtostr(sec))
+                secs.append(sec)
+                freq_codes.update({freqstrs[-1]:code, sec:code})
+            freq_codes[freq] = code
+    return code
+
+#------------------------------------------------------------------------------
+def freq(freqstr):
+    """Frequency in seconds. Same as strtofreq() without parsing.
+    """
+    return secs[freq_code(freqstr)]
+
+#------------------------------------------------------------------------------
+def index(keys):
+    """(pair, freq) MultiIndex for (pair, freq seconds) @keys, built from
+    the interned codes instead of factorizing the labels.
+    """
+    global _level
+    pair_idx = [pair_code(n[0]) for n in keys]
+    freq_idx = [freq_code(n[1]) for n in keys]
+    level = _level
+    if level is None or len(level) != len(pairs):
+        level = _level = pd.Index(list(pairs), dtype=object)
+    return pd.MultiIndex(
+        levels=[level, pd.Index(list(secs), dtype='int64')],
+        codes=[pair_idx, freq_idx],
+        names=['pair', 'freq'],
+        verify_integrity=False)
+
+[freq_code(n) for n in INTERVALS]
@@ -22,6 +22,13 @@ def aggregate_mkt(freqstr=None):
         return print("Binance client error. {}".format(str(e)))
         lock.release()
 
+    return aggregate(dfT, freqstr=freqstr)
+
+#------------------------------------------------------------------------------
+def aggregate(dfT, freqstr=None):
+    """Summarize binance_24h() ticker dataframe @dfT by quote asset, log
+    it, and save it to db.tickers if @freqstr.
+    """
     dfV = pd.DataFrame(
         dfT.groupby('quoteAsset').apply(lambda x: x['quoteVol'].sum()),
         columns=['volume'])
@@ -82,8 +89,8 @@ def summarize(df, symbol):
     _df = df.copy()
     for idx, row in _df[_df.index.str.startswith(symbol)].iterrows():
         tmp = row['quoteVol']
-        _df.ix[idx,'quoteVol'] = row['volume']
-        _df.ix[idx,'volume'] = tmp
+        _df.loc[idx,'quoteVol'] = row['volume']
+        _df.loc[idx,'volume'] = tmp
     wt_price_change = \
         (_df['24hPriceChange'] * _df['quoteVol']).sum() / _df['quoteVol'].sum()
 
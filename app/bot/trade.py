@@ -6,7 +6,7 @@ import sys
 import logging
 import pytz
 from pprint import pformat
-import inspect
+from queue import Empty
 import numpy as np
 import pandas as pd
 from pprint import pprint
@@ -16,26 +16,52 @@ from binance.client import BinanceRequestException
 from docs.conf import *
 from docs.botconf import *
 import app, app.bot
-from app.bot import lock, get_pairs, set_pairs, candles, macd, reports, signals
+from app.bot import lock, get_pairs, set_pairs, candles, ledger, macd, reports, \
+    rules, signals, snapshots, symbols
 from app.common.timeutils import strtofreq
 from app.common.utils import pct_diff, utc_datetime as now
 from app.common.timer import Timer
+from app.common.histogram import Histogram
 
 spinner = itertools.cycle(['-', '/', '|', '\\'])
 log = logging.getLogger('trade')
 dfW = pd.DataFrame()
 start = now()
+algos = {n['name']:n for n in TRD_ALGOS}
+# pair -> quote asset symbol.
+quote_assets = {}
+# freqstr -> {'due': monotonic deadline, 'candles': {pair: (candle, received)}}
+# of closed candles awaiting vectorized entry evaluation.
+barrier = {}
+# Kline receipt to entry/exit evaluated, in ms.
+latency = Histogram('decision_ms')
+# Trade stat accumulators: ((minKey, maxKey, lastKey), snapshot value fn).
+stat_keys = [(tuple("{}{}".format(pfx, k.title().replace('_','')) \
+    for pfx in ['min', 'max', 'last']), fn) for k, fn in [
+        ("buy_ratio",       lambda ss: round(ss['indicators']['buyRatio'],2)),
+        ("macd",            lambda ss: round(ss['indicators']['macd']['value'],2)),
+        ("macd_amp_slope",  lambda ss: round(ss['indicators']['macd']['ampSlope'],2)),
+        ("rsi",             lambda ss: round(ss['indicators']['rsi'],0)),
+        ("wick_slope",      lambda ss: round(ss['indicators']['wickSlope'],2)),
+        ("zscore",          lambda ss: round(ss['indicators']['zscore'],2)),
+        ("price",           lambda ss: ss['candle']['close'])
+    ]]
 
 #---------------------------------------------------------------------------
 def run(e_pairs, e_kill):
-    """Main trading loop thread. Consumes candle data from queue and
-    manages/executes trades.
+    """Main trading loop thread. Blocks on the candle mailbox until a candle
+    arrives or the next report is due, then manages/executes trades.
+    Decision latency (kline receipt to entry/exit evaluated) is recorded in
+    the module latency histogram.
+    With CLOSE_BARRIER_MS > 0, entries for closed candles are held until all
+    enabled pairs of that freqstr have closed (or the barrier times out) and
+    evaluated together by eval_entries. The next bar of a held pair releases
+    its barrier early, before that bar reaches the store (see process).
     TODO: add in code for tracking unclosed candle wicks prices:
         # Clear all partial candle data
         dfW = dfW.drop([(c['pair'], strtofreq(c['freqstr']))])
     """
     from main import q
-    db = app.get_db()
     t1 = Timer()
     tmr1 = Timer(name='pos', expire='every 1 clock min utc', quiet=True)
     tmr10 = Timer(name='earn', expire='every 10 clock min utc', quiet=True)
@@ -49,23 +75,30 @@ def run(e_pairs, e_kill):
             break
         ent_ids, ex_ids = [], []
 
-        # Trading algo inner loop.
-        while q.empty() == False:
-            c = q.get()
-            candles.modify_dfc(c)
-            ss = snapshot(c)
-            query = {'pair':c['pair'], 'freqstr':c['freqstr'], 'status':'open'}
-
-            # Eval position entries/exits
-
-            for trade in db.trades.find(query):
-                update_stats(trade, ss)
-                ex_ids += eval_exit(trade, c, ss)
-
-            if c['closed'] and c['pair'] in get_pairs():
-                ent_ids += eval_entry(c, ss)
-
+        # Wait for candles until the next report or close barrier is due.
+        # Capped so e_kill is still checked every second.
+        timeout = min(tmr1.remain(), tmr10.remain(), 1000,
+            barrier_remain()) / 1000
+        try:
+            item = q.get_stamped(timeout=timeout)
+        except Empty:
+            update_spinner()
+            item = None
+
+        # Trading algo inner loop. Evaluate everything already queued before
+        # reporting.
+        while item is not None:
+            c, received = item
+            ids = process(c, received)
+            ent_ids += ids[0]
+            ex_ids += ids[1]
             n+=1
+            try:
+                item = q.get_stamped(block=False)
+            except Empty:
+                item = None
+
+        ent_ids += release()
 
         # Reporting outer loop.
         if tmr1.remain() == 0:
@@ -74,12 +107,13 @@ def run(e_pairs, e_kill):
         if tmr10.remain() == 0:
             reports.earnings()
             tmr10.reset()
+            log.info("Decision latency: %s", latency.summary())
         if len(ent_ids) + len(ex_ids) > 0:
             reports.trades(ent_ids + ex_ids)
         if n>75:
             lock.acquire()
-            print('{} queue items processed. [{:,.0f} ms/item]'\
-                .format(n, t1.elapsed()/n))
+            print('{} queue items processed. [{:,.0f} ms/item] {} {}'\
+                .format(n, t1.elapsed()/n, latency, q.metrics()))
             lock.release()
             t1.reset()
             n=0
@@ -90,33 +124,149 @@ def run(e_pairs, e_kill):
                 # TODO: check no other open positions hold this pair, safe
                 # for disabling.
                 set_pairs([c['pair']], 'DISABLED')
-        update_spinner()
-        time.sleep(0.1)
 
     print('Trade thread: Terminating...')
 
+#------------------------------------------------------------------------------
+def process(c, received):
+    """Apply candle @c to the candle store and macd stream, then evaluate
+    exits of its pair's positions and, if closed, its entry (or hold it at
+    the close barrier).
+    @received: monotonic receipt time of @c
+    Returns (entry trade ids, exit trade ids).
+    """
+    ent_ids, ex_ids = [], []
+    # A held entry is decided on its closed candle's row. Evaluate the
+    # barrier before the pair's next bar changes the store and stream.
+    if superseded(c):
+        ent_ids += release(c['freqstr'])
+
+    candles.modify_dfc(c)
+    macd.update_stream(c)
+    trades = ledger.find(c['pair'], c['freqstr'])
+    entry = c['closed'] and c['pair'] in get_pairs()
+    held = entry and CLOSE_BARRIER_MS > 0
+    # Snapshot only when something is evaluated for this candle.
+    ss = snapshot(c) if len(trades) > 0 or (entry and not held) else None
+
+    # Eval position entries/exits
+
+    for trade in trades:
+        update_stats(trade, ss)
+        ex_ids += eval_exit(trade, c, ss)
+
+    if held:
+        hold(c, received)
+    elif entry:
+        ent_ids += eval_entry(c, ss)
+
+    if not held:
+        latency.observe((time.monotonic() - received) * 1000)
+    return (ent_ids, ex_ids)
+
 #------------------------------------------------------------------------------
 def eval_entry(c, ss):
     """
     @c: candle dict
     @ss: snapshot dict
     """
-    db = app.get_db()
     ids = []
+    values = rules.flatten(ss['indicators'])
     for algo in TRD_ALGOS:
-        if db.trades.find_one(
-            {'freqstr':c['freqstr'], 'algo':algo['name'], 'status':'open'}):
+        if ledger.exists(c['freqstr'], algo['name']):
             continue
 
         # Test conditions eval to True
         try:
-            if all([fn(ss['indicators']) for fn in algo['entry']['conditions']]):
+            if rules.evaluate(algo['name'], 'entry', values):
                 ids.append(buy(ss, algo))
         except Exception as e:
             print("Error evaluating entry conditions. {}".format(str(e)))
 
     return ids
 
+#------------------------------------------------------------------------------
+def hold(c, received):
+    """Add closed candle @c to the close barrier of its freqstr.
+    """
+    batch = barrier.setdefault(c['freqstr'], {'due':time.monotonic() + \
+        CLOSE_BARRIER_MS/1000, 'candles':odict()})
+    batch['candles'][c['pair']] = (c, received)
+
+#------------------------------------------------------------------------------
+def superseded(c):
+    """True if @c is a later candle of a pair held at the close barrier of
+    its freqstr.
+    """
+    held = barrier.get(c['freqstr'], {}).get('candles', {}).get(c['pair'])
+    return held is not None and candles.open_ts(c) != candles.open_ts(held[0])
+
+#------------------------------------------------------------------------------
+def barrier_remain():
+    """ms until the earliest close barrier times out.
+    """
+    if len(barrier) == 0:
+        return float('inf')
+    due = min(n['due'] for n in barrier.values())
+    return max(due - time.monotonic(), 0) * 1000
+
+#------------------------------------------------------------------------------
+def release(freqstr=None):
+    """Evaluate entries of close barriers that are complete (every enabled
+    pair closed) or timed out.
+    @freqstr: also release this freqstr's barrier, complete or not
+    Returns list of new trade ids.
+    """
+    ids = []
+    pairs = get_pairs()
+    for _freqstr, batch in list(barrier.items()):
+        if _freqstr != freqstr and batch['due'] > time.monotonic() and \
+            not pairs.issubset(batch['candles']):
+            continue
+        del barrier[_freqstr]
+        ids += eval_entries(_freqstr, list(batch['candles'].values()))
+    return ids
+
+#------------------------------------------------------------------------------
+def eval_entries(freqstr, batch):
+    """Vectorized eval_entry for candles closing together on @freqstr.
+    Entry indicators for all pairs are computed as one matrix and every algo
+    rule is evaluated across them at once. Hits are confirmed against the
+    full snapshot before buying, so decisions match eval_entry.
+    @batch: list of (candle dict, receipt time)
+    """
+    ids = []
+    open_algos = [n for n in TRD_ALGOS if not ledger.exists(freqstr, n['name'])]
+
+    values = {}
+    try:
+        if len(open_algos) > 0:
+            freq = symbols.freq(freqstr)
+            dfi = signals.entry_indicators([(c['pair'], freq) for c, t in batch])
+            values = {k: dfi[k].values for k in dfi.columns}
+    except Exception as e:
+        print("Error computing entry indicators. {}".format(str(e)))
+        open_algos = []
+
+    # One failing algo doesn't drop the others' entries.
+    for algo in open_algos:
+        try:
+            hits = np.flatnonzero(rules.evaluate(algo['name'], 'entry', values))
+            for i in hits:
+                if ledger.exists(freqstr, algo['name']):
+                    break
+                ss = snapshot(batch[i][0])
+                if rules.evaluate(algo['name'], 'entry',
+                    rules.flatten(ss['indicators'])):
+                    ids.append(buy(ss, algo))
+        except Exception as e:
+            print("Error evaluating {} entry conditions. {}".format(
+                algo['name'], str(e)))
+
+    now_ = time.monotonic()
+    [latency.observe((now_ - t) * 1000) for c, t in batch]
+    return ids
+
 #------------------------------------------------------------------------------
 def eval_exit(t, c, ss):
     """
@@ -124,25 +274,31 @@ def eval_exit(t, c, ss):
     @s: candle dict
     @ss: snapshot dict
     """
-    algo = [n for n in TRD_ALGOS if n['name'] == t['algo']][0]
+    section = exit_section(t, c, ss, algos[t['algo']])
+    return [sell(t, ss, section)] if section else []
 
+#------------------------------------------------------------------------------
+def exit_section(t, c, ss, algo, ruleset=None):
+    """Exit of @algo that open trade @t meets at candle @c: 'stoploss',
+    'target' or 'failure'. None to hold.
+    @ss: snapshot dict of @c
+    @ruleset: compiled rules to use instead of the active ones
+    """
     # Stop loss.
-    diff = pct_diff(t['snapshots'][0]['candle']['close'], c['close'])
+    diff = pct_diff(t['entry']['candle']['close'], c['close'])
     if diff < algo['stoploss']:
-        return [sell(t, ss, 'stoploss')]
+        return 'stoploss'
 
+    values = rules.flatten(ss['indicators'], t['stats'])
     try:
-        # Target (success)
-        if all([fn(ss['indicators'], t['stats']) for fn in algo['target']['conditions']]):
-            return [sell(t, ss, 'target')]
-
-        # Failure
-        if all([fn(ss['indicators'], t['stats']) for fn in algo['failure']['conditions']]):
-            return [sell(t, ss, 'failure')]
+        # Target (success), then failure.
+        for section in ['target', 'failure']:
+            if rules.evaluate(algo['name'], section, values, ruleset):
+                return section
     except Exception as e:
         print("Error evaluating exit conditions. {}".format(str(e)))
 
-    return []
+    return None
 
 #------------------------------------------------------------------------------
 def buy(ss, algo):
@@ -150,33 +306,49 @@ def buy(ss, algo):
     @ss: snapshot dict
     @algo: algorithm definition dict
     """
-    db, client = app.db, app.bot.client
-
     if ss['book'] is None:
-        book = odict(client.get_orderbook_ticker(symbol=ss['pair']))
-        del book['symbol']
-        [book.update({k:np.float64(v)}) for k,v in book.items()]
-        ss['book'] = book
+        ss['book'] = book(app.bot.client, ss['pair'])
 
-    record = odict({
+    record = open_record(ss, algo, quote_asset(ss['pair']), now())
+    _id = ledger.insert(record)
+    snapshots.append(record, ss)
+    update_stats(record, ss)
+
+    lock.acquire()
+    print("BUY {} ({})".format(ss['pair'], algo['name']))
+    lock.release()
+
+    return _id
+
+#------------------------------------------------------------------------------
+def open_record(ss, algo, asset, time, ruleset=None):
+    """New position record (trades document schema, without _id) for @algo
+    entering at snapshot @ss, bought at its book's ask price.
+    @asset: quote asset of the pair
+    @time: datetime of the order
+    @ruleset: compiled rules to use instead of the active ones
+    """
+    return odict({
         'pair': ss['pair'],
-        'quote_asset': db.assets.find_one({'symbol':ss['pair']})['quoteAsset'],
+        'quote_asset': asset,
         'freqstr': ss['candle']['freqstr'],
         'status': 'open',
-        'start_time': now(),
+        'start_time': time,
         'algo': algo['name'],
         'stoploss': algo['stoploss'],
-        'snapshots': [ss],
+        'entry': ss,
+        'last': ss,
+        'snapshot_count': 0,
         'stats': {},
         'details': [{
             'algo': algo['name'],
             'section': 'entry',
-            'desc': algo_to_string(algo['name'], 'entry')
+            'desc': rules.describe(algo['name'], 'entry', ruleset)
         }],
         'orders': [odict({
             'action':'BUY',
             'ex': 'Binance',
-            'time': now(),
+            'time': time,
             'price': ss['book']['askPrice'],
             'volume': 1.0,
             'quote': TRD_AMT_MAX,
@@ -184,15 +356,6 @@ def buy(ss, algo):
         })]
     })
 
-    result = db.trades.insert_one(record)
-    update_stats(record, ss)
-
-    lock.acquire()
-    print("BUY {} ({})".format(ss['pair'], algo['name']))
-    lock.release()
-
-    return result.inserted_id
-
 #------------------------------------------------------------------------------
 def sell(trade, ss, section):
     """Close off existing position and calculate earnings.
@@ -200,24 +363,10 @@ def sell(trade, ss, section):
     @ss: snapshot dict
     @section: key name of evaluated algo conditions
     """
-    db, client = app.db, app.bot.client
-
-    # Algorithm criteria details
-    algo = [n for n in TRD_ALGOS \
-        if n['name'] == trade['algo']][0]
-    details = {
-        'name': algo['name'],
-        'section': section
-    }
-    if section == 'stoploss':
-        details.update({'desc':algo['stoploss']})
-    else:
-        details.update({'desc':algo_to_string(algo['name'], section)})
-
     # Get orderbook if not already stored in snapshot.
     if ss['book'] is None:
         try:
-            book = odict(client.get_orderbook_ticker(symbol=trade['pair']))
+            ss['book'] = book(app.bot.client, trade['pair'])
         except (BinanceRequestException, ConnectionError) as e:
             log.debug(str(e))
             lock.acquire()
@@ -225,60 +374,85 @@ def sell(trade, ss, section):
             lock.release()
             return []
 
-        del book['symbol']
-        [book.update({k:np.float64(v)}) for k,v in book.items()]
-        ss['book'] = book
+    update = close_update(trade, ss, section, algos[trade['algo']], now())
+    details = update['$push']['details']
+    snapshots.append(trade, ss)
+    ledger.update(trade, update)
+
+    lock.acquire()
+    print("SELL {} ({}) Details: {}. {}"\
+        .format(trade['pair'], details['name'],
+            details['section'].title(), details['desc']))
+    lock.release()
+    return trade['_id']
+
+#------------------------------------------------------------------------------
+def close_update(trade, ss, section, algo, time, ruleset=None):
+    """$push/$set update closing position @trade at snapshot @ss, sold at
+    its book's bid price, and its earnings.
+    @section: key name of evaluated @algo conditions
+    @time: datetime of the order
+    @ruleset: compiled rules to use instead of the active ones
+    """
+    # Algorithm criteria details
+    details = {
+        'name': algo['name'],
+        'section': section
+    }
+    if section == 'stoploss':
+        details.update({'desc':algo['stoploss']})
+    else:
+        details.update({'desc':rules.describe(algo['name'], section, ruleset)})
 
     # Profit/loss calculations.
     pct_fee = BINANCE_PCT_FEE
     bid = ss['book']['bidPrice']
-    ask = ss['book']['askPrice']
     buy_vol = np.float64(trade['orders'][0]['volume'])
     buy_quote = np.float64(trade['orders'][0]['quote'])
     p1 = np.float64(trade['orders'][0]['price'])
 
     pct_gain = pct_diff(p1, bid)
-    quote = buy_quote * (1 - pct_fee/100)
     fee = (bid * buy_vol) * (pct_fee/100)
-    pct_net_gain = net_earn = pct_gain - (pct_fee*2)
-    duration = now() - trade['start_time']
-
-    db.trades.update_one(
-        {'_id': trade['_id']},
-        {
-            '$push': {
-                'snapshots':ss,
-                'details': details,
-                'orders': odict({
-                    'action': 'SELL',
-                    'ex': 'Binance',
-                    'time': now(),
-                    'price': bid,
-                    'volume': 1.0,
-                    'quote': buy_quote,
-                    'fee': fee
-                })
-            },
-            '$set': {
-                'status': 'closed',
-                'end_time': now(),
-                'duration': int(duration.total_seconds()),
-                'pct_gain': pct_gain.round(4),
-                'pct_net_gain': pct_net_gain.round(4)
-            }
+    pct_net_gain = pct_gain - (pct_fee*2)
+    duration = time - trade['start_time']
+
+    return {
+        '$push': {
+            'details': details,
+            'orders': odict({
+                'action': 'SELL',
+                'ex': 'Binance',
+                'time': time,
+                'price': bid,
+                'volume': 1.0,
+                'quote': buy_quote,
+                'fee': fee
+            })
+        },
+        '$set': {
+            'status': 'closed',
+            'end_time': time,
+            'duration': int(duration.total_seconds()),
+            'pct_gain': pct_gain.round(4),
+            'pct_net_gain': pct_net_gain.round(4)
         }
-    )
+    }
 
-    lock.acquire()
-    print("SELL {} ({}) Details: {}. {}"\
-        .format(trade['pair'], details['name'],
-            details['section'].title(), details['desc']))
-    lock.release()
-    return trade['_id']
+#------------------------------------------------------------------------------
+def book(client, pair):
+    """Order book ticker of @pair from @client as snapshot 'book' dict.
+    """
+    ticker = odict(client.get_orderbook_ticker(symbol=pair))
+    del ticker['symbol']
+    [ticker.update({k:np.float64(v)}) for k,v in ticker.items()]
+    return ticker
 
 #------------------------------------------------------------------------------
-def snapshot(c):
+def snapshot(c, df=None, ema=None):
     """Gather state of trade--candle, indicators--each tick and save to DB.
+    @df: candle frame to use instead of the store's (i.e. a backtest
+    window). Its macd is generated with @ema periods instead of read from
+    the live macd streams.
     """
     global dfW
     book = None
@@ -289,10 +463,16 @@ def snapshot(c):
 
     # MACD Indicators
     dfm_dict = {}
-    df = app.bot.dfc.loc[pair, strtofreq(freqstr)]
+    hist = None
+    if df is None:
+        df = app.bot.dfc.frame(pair, symbols.freq(freqstr))
+    else:
+        hist = pd.Series(macd.generate_rows(df[['close']].values, ema=ema)[:,0],
+            index=df.index)
 
     try:
-        dfmacd, phases = macd.histo_phases(df, pair, freqstr, 100, to_bson=True)
+        dfmacd, phases = macd.histo_phases(df, pair, freqstr, 100,
+            to_bson=True, dfmacd=hist)
     except Exception as e:
         lock.acquire()
         print('snapshot exc')
@@ -319,7 +499,7 @@ def snapshot(c):
         'pair': pair,
         'time': now(),
         'book': None,
-        'candle': c,
+        'candle': c.to_dict() if type(c) is candles.Kline else c,
         'indicators': {
             'buyRatio': round(buyratio, 2),
             'rsi': signals.rsi(df['close'].tail(100), 14),
@@ -339,53 +519,50 @@ def update_stats(t, ss):
     """Track min/max key indicator ranges across trade lifetime.
     Snapshots in trade record only cover state at each candle close. This
     method allows us to capture the highs/lows in-between.
+    Stats are running accumulators updated in O(1) per tick, seeded from
+    the trade's entry/last snapshots the first time. The stats write to DB
+    is coalesced by the ledger; closed candle snapshots are appended to the
+    snapshot store right away.
     @t: trade record dict
     @ss: snapshot dict (from closed or unclosed candle)
     """
-    keys = {
-        "buy_ratio":       lambda ss: round(ss['indicators']['buyRatio'],2),
-        "macd":            lambda ss: round(ss['indicators']['macd']['value'],2),
-        "macd_amp_slope":  lambda ss: round(ss['indicators']['macd']['ampSlope'],2),
-        "rsi":             lambda ss: round(ss['indicators']['rsi'],0),
-        "wick_slope":      lambda ss: round(ss['indicators']['wickSlope'],2),
-        "zscore" :         lambda ss: round(ss['indicators']['zscore'],2),
-        "price":           lambda ss: ss['candle']['close']
-    }
-    snaps = t['snapshots'] + [ss]
-    stats = odict()
-
-    # Find Min, Max, and Last values for every indicator in trade history.
-    for k,fn in keys.items():
-        min_k = "min{}".format(k.title().replace('_',''))
-        stats[min_k] = min([fn(ss) for ss in snaps])
-
-        max_k = "max{}".format(k.title().replace('_',''))
-        stats[max_k] = max([fn(ss) for ss in snaps])
-
-        last_k = "last{}".format(k.title().replace('_',''))
-        stats[last_k] = fn(ss)
-
-    update = {'$set': {'stats':stats}}
+    stats = fold_stats(t, ss)
+    ledger.set_stats(t, stats)
+    if ss['candle']['closed'] is True and t['last'] is not ss:
+        snapshots.append(t, ss)
+    return stats
 
-    if ss['candle']['closed'] is True:
-        update['$push'] = {'snapshots':ss}
+#------------------------------------------------------------------------------
+def fold_stats(t, ss):
+    """Stats of trade @t with snapshot @ss folded in. Seeded from the
+    trade's entry/last snapshots if it has none yet.
+    Returns new stats dict.
+    """
+    prev = t.get('stats') or {}
+    if len(prev) == 0:
+        for snap in [t['entry'], t['last']]:
+            prev = accumulate(prev, snap)
+    return accumulate(prev, ss)
 
-    app.db.trades.update_one({'_id':t['_id']}, update)
-    return stats
+#------------------------------------------------------------------------------
+def accumulate(stats, ss):
+    """Fold snapshot @ss into min/max/last @stats dict.
+    Returns new stats dict.
+    """
+    new = odict()
+    for (min_k, max_k, last_k), fn in stat_keys:
+        v = fn(ss)
+        new[min_k] = min(stats[min_k], v) if min_k in stats else v
+        new[max_k] = max(stats[max_k], v) if max_k in stats else v
+        new[last_k] = v
+    return new
 
 #------------------------------------------------------------------------------
-def algo_to_string(name, section):
-    algo = [n for n in TRD_ALGOS if n['name'] == name][0]
-    conditions = algo[section]['conditions']
-
-    funcstrs = []
-    for func in conditions:
-        fstr = str(inspect.getsourcelines(func)[0])
-        fstr = fstr.strip("['\\n']").split(":")[1]
-        fstr = fstr.strip('\\n"').strip()
-        funcstrs.append(fstr)
-
-    return funcstrs
+def quote_asset(pair):
+    if pair not in quote_assets:
+        quote_assets[pair] = app.get_db().assets.find_one(
+            {'symbol':pair})['quoteAsset']
+    return quote_assets[pair]
 
 #-------------------------------------------------------------------------------
 def update_spinner():
@@ -8,43 +8,41 @@ import logging
 import threading
 import time
 import sys
-import pandas as pd
-import numpy as np
 from twisted.internet import reactor
 from binance.websockets import BinanceSocketManager
+from docs.conf import *
 from docs.botconf import *
 import app, app.bot
 from app.common.utils import colors
 from app.common.timeutils import strtofreq
 from app.common.timer import Timer
-from app.bot import lock, get_pairs, candles
+from app.bot import lock, get_pairs, candles, journal
 
 from main import q
 
 log = logging.getLogger('websock')
-connkeys, storedata = [], []
+# Combined stream connections. conn_key -> set of <symbol>@kline_<interval>
+# stream names.
+conns = {}
 ws = None
 
 #-------------------------------------------------------------------------------
 def run(e_pairs, e_kill):
-    global storedata, connkeys, ws
+    global ws
     client = app.bot.client
 
     #print("Connecting to websocket...")
     ws = BinanceSocketManager(client)
 
-    pairs = get_pairs()
-    connkeys += [ws.start_kline_socket(pair, recv_kline, interval=n) \
-        for n in TRD_FREQS for pair in pairs]
+    subscribe(streams(get_pairs()))
     lock.acquire()
-    print("Subscribed to {} kline sockets.".format(len(connkeys)))
+    print("Subscribed to {} kline streams over {} sockets.".format(
+        sum(len(n) for n in conns.values()), len(conns)))
     lock.release()
 
     ws.start()
     #print('Connected. Press Ctrl+C to quit')
 
-    tmr = Timer(name='pairs', expire='every 5 clock min utc', quiet=True)
-
     while True:
         if e_kill.isSet():
             break
@@ -53,52 +51,67 @@ def run(e_pairs, e_kill):
             update_sockets()
             e_pairs.clear()
 
-        if tmr.remain() == 0:
-            tmr.reset()
-            if len(storedata) > 0:
-                #print("websock_thread: saving new candles...")
-                candles.bulk_save(storedata)
-                storedata = []
-
-
         time.sleep(1)
 
     close_all()
     print("Websock thread: Terminating...")
 
+#-------------------------------------------------------------------------------
+def streams(pairs, freqstrs=None):
+    """Kline stream names for @pairs x @freqstrs (default TRD_FREQS).
+    """
+    return set('{}@kline_{}'.format(pair.lower(), n) \
+        for n in (freqstrs or TRD_FREQS) for pair in pairs)
+
+#-------------------------------------------------------------------------------
+def subscribe(names, size=None):
+    """Open combined stream connections for stream @names, up to @size
+    (default WS_STREAMS_PER_CONN) streams each.
+    """
+    size = min(size or WS_STREAMS_PER_CONN, BINANCE_WS_STREAM_LIMIT)
+    names = sorted(names)
+    for i in range(0, len(names), size):
+        chunk = names[i:i+size]
+        conns[ws.start_multiplex_socket(chunk, recv_kline)] = set(chunk)
+
 #-------------------------------------------------------------------------------
 def update_sockets():
-    """conn_key str format: <symbol>@kline_<interval>
+    """Rebalance combined stream connections to the enabled + temp pairs.
+    A combined connection's streams are fixed by its URL, so only
+    connections that lose a stream are restarted, together with any under
+    half full. Their remaining streams and streams of new pairs are packed
+    into new connections. Untouched connections keep streaming.
     """
-    global connkeys, storedata, ws
+    global ws
     log.debug("Websock thread: update_sockets")
 
-    old = set([n[0:n.index('@')].upper() for n in connkeys])
-    new = set(app.bot.get_pairs(with_temp=True))
-
-    # Removed pairs: close all sockets w/ matching symbols.
-    for pair in (old - new):
-        for k in connkeys:
-            if pair in k:
-                ws.stop_socket(k)
-                connkeys.pop(k)
+    want = streams(app.bot.get_pairs(with_temp=True))
+    have = set().union(*conns.values())
+    removed, added = have - want, want - have
+    if len(removed) + len(added) == 0:
+        return
 
-    # Added pairs: create sockets for each candle frequency.
-    newpairs = new - old
-    connkeys += [ws.start_kline_socket(i, recv_kline, interval=j) for j in TRD_FREQS for i in newpairs]
+    half = min(WS_STREAMS_PER_CONN, BINANCE_WS_STREAM_LIMIT) / 2
+    pending = set(added)
+    restart = [k for k, v in conns.items() if v & removed or len(v) < half]
+    for k in restart:
+        pending |= conns.pop(k) - removed
+        ws.stop_socket(k)
+    subscribe(pending)
 
-    log.debug("{} pair(s) removed, {} added. {} total sockets."\
-        .format(len(old-new), len(newpairs), len(connkeys)))
+    log.debug("{} stream(s) removed, {} added, {} sockets restarted. {} "\
+        "streams over {} sockets.".format(len(removed), len(added),
+        len(restart), len(want), len(conns)))
 
 #-------------------------------------------------------------------------------
 def recv_kline(msg):
     """Kline socket callback function. Formats raw candle data, feeds into
-    trading queue, adds to global dataframe, and saves to list for periodic
-    saving to DB.
+    trading queue, and appends closed candles to the journal for saving to
+    DB by the journal thread.
+    @msg: kline payload, or combined stream {'stream':.., 'data':payload}
     """
-    global storedata
-
-    if msg['e'] != 'kline':
+    msg = msg.get('data', msg)
+    if msg.get('e') != 'kline':
         lock.acquire()
         print(msg)
         lock.release()
@@ -106,25 +119,10 @@ def recv_kline(msg):
 
     k = msg['k']
 
-    candle = {
-        "open_time": pd.to_datetime(k['t'], unit='ms', utc=True),
-        "close_time": pd.to_datetime(k['T'], unit='ms', utc=True),
-        "pair": k['s'],
-        "freqstr": k['i'],
-        "open": np.float64(k['o']),
-        "close": np.float64(k['c']),
-        "high": np.float64(k['h']),
-        "low": np.float64(k['l']),
-        "trades": k['n'],
-        "volume": np.float64(k['v']),
-        "buy_vol": np.float64(k['V']),
-        "quote_volume": np.float64(k['q']),
-        "quote_buy_vol": np.float64(k['Q']),
-        "closed": k['x']
-    }
+    candle = candles.decode_kline(k)
 
     if k['x'] == True:
-        storedata.append(candle)
+        journal.append(k)
 
         lock.acquire()
         print("{}{:<7}{}{:>5}{:>12g}{}".format(colors.GRN, candle['pair'], colors.WHITE,
@@ -0,0 +1,181 @@
+# app.bot.writer
+import logging
+import threading
+import time
+from queue import Queue, Empty
+from bisect import bisect_right
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+from docs.botconf import *
+import app
+from app.common.utils import dt_to_ms, utc_datetime as now
+from . import coverage
+
+log = logging.getLogger('writer')
+
+# Pending ('insert'|'replace', candle) ops for the writer thread.
+q = Queue()
+# (pair, freqstr) -> (open_time ms, values) of newest persisted closed candle.
+last_saved = {}
+stats = {'inserted':0, 'replaced':0, 'skipped':0, 'errors':0, 'failed':0,
+    'batches':0}
+thread = None
+_lock = threading.Lock()
+_keys = ['open', 'close', 'high', 'low', 'trades', 'volume', 'buy_vol']
+
+#------------------------------------------------------------------------------
+def run(e_pairs, e_kill):
+    """DB writer thread. Drains queued candle ops into size/time bounded
+    bulk writes.
+    """
+    global thread
+    thread = threading.current_thread()
+
+    while not e_kill.isSet():
+        drain(block=True)
+
+    drain(block=False)
+    print("Writer thread: terminating...")
+
+#------------------------------------------------------------------------------
+def submit(candles):
+    """Queue closed candles that are new or changed since last persisted.
+    Unclosed candles and ones already in DB are skipped.
+    Returns number of candles queued.
+    """
+    now_ms = dt_to_ms(now())
+    n = 0
+
+    with _lock:
+        for c in candles:
+            if dt_to_ms(c['close_time']) >= now_ms:
+                stats['skipped'] += 1
+                continue
+
+            key = (c['pair'], c['freqstr'])
+            t = dt_to_ms(c['open_time'])
+            values = tuple(c[k] for k in _keys)
+            last_t, last_v = last_saved.get(key) or _seed(*key)
+
+            if last_t is None or t > last_t:
+                op = 'insert'
+                last_saved[key] = (t, values)
+            elif t == last_t:
+                if last_v is None or last_v == values:
+                    stats['skipped'] += 1
+                    continue
+                op = 'replace'
+                last_saved[key] = (t, values)
+            elif covered(key, t):
+                stats['skipped'] += 1
+                continue
+            else:
+                op = 'insert'
+
+            q.put((op, c))
+            n += 1
+    return n
+
+#------------------------------------------------------------------------------
+def flush():
+    """Block until all queued ops are written. Writes from calling thread
+    if writer thread isn't running.
+    """
+    if thread is not None and thread.is_alive():
+        q.join()
+    else:
+        drain(block=False)
+
+#------------------------------------------------------------------------------
+def drain(block=True):
+    """Write one batch of up to WRITER_BATCH_SIZE ops, waiting at most
+    WRITER_FLUSH_SEC for it to fill when @block. Non-blocking drains
+    write everything queued.
+    """
+    ops = []
+    deadline = time.time() + WRITER_FLUSH_SEC
+
+    while len(ops) < WRITER_BATCH_SIZE or not block:
+        timeout = deadline - time.time()
+        try:
+            if block and timeout > 0:
+                ops.append(q.get(timeout=timeout))
+            else:
+                ops.append(q.get_nowait())
+        except Empty:
+            break
+
+    if len(ops) > 0:
+        try:
+            write(ops)
+        finally:
+            [q.task_done() for n in ops]
+
+#------------------------------------------------------------------------------
+def write(ops):
+    """Bulk write one batch. Inserts are unordered so one duplicate doesn't
+    abort the rest.
+    """
+    db = app.get_db()
+    inserts = [c for op, c in ops if op == 'insert']
+    replaces = [ReplaceOne(
+        {'pair':c['pair'], 'freqstr':c['freqstr'], 'open_time':c['open_time']},
+        c, upsert=True) for op, c in ops if op == 'replace']
+    errors = [0, 0]
+    n_fail = 0
+
+    for i, (fn, batch) in enumerate([(db.candles.insert_many, inserts),
+        (db.candles.bulk_write, replaces)]):
+        if len(batch) == 0:
+            continue
+        try:
+            fn(batch, ordered=False)
+        except BulkWriteError as e:
+            # Mostly duplicate keys, i.e. already persisted.
+            errors[i] = len(e.details['writeErrors'])
+            log.debug("%s write errors. First: %s", errors[i],
+                e.details['writeErrors'][0])
+        except Exception as e:
+            errors[i] = len(batch)
+            n_fail += len(batch)
+            log.exception("Candle write failed. e=%s", str(e))
+
+    if n_fail == 0:
+        # Candles are persisted either way. Missing coverage only means the
+        # range is queried again on the next backfill.
+        try:
+            coverage.add_candles([c for op, c in ops])
+        except Exception as e:
+            log.exception("Coverage write failed. e=%s", str(e))
+
+    with _lock:
+        if n_fail > 0:
+            # Re-seed from DB on next submit so failed candles aren't
+            # skipped as already saved.
+            [last_saved.pop((c['pair'], c['freqstr']), None) for op, c in ops]
+        stats['failed'] += n_fail
+        stats['inserted'] += len(inserts) - errors[0]
+        stats['replaced'] += len(replaces) - errors[1]
+        stats['errors'] += sum(errors)
+        stats['batches'] += 1
+    log.debug("Wrote {} inserts, {} replaces, {} errors. {}".format(
+        len(inserts), len(replaces), sum(errors), stats))
+
+#------------------------------------------------------------------------------
+def covered(key, t):
+    """True if open_time @t (ms) is inside persisted coverage for @key.
+    """
+    _ranges = coverage.ranges(*key)
+    i = bisect_right(_ranges, [t, float('inf')]) - 1
+    return i >= 0 and _ranges[i][0] <= t <= _ranges[i][1]
+
+#------------------------------------------------------------------------------
+def _seed(pair, freqstr):
+    """Newest persisted candle for (pair, freqstr) from DB. Only queried
+    once per key.
+    """
+    doc = app.get_db().candles.find_one({'pair':pair, 'freqstr':freqstr},
+        sort=[('open_time', -1)])
+    if doc is None:
+        return (None, None)
+    return (dt_to_ms(doc['open_time']), tuple(doc.get(k) for k in _keys))
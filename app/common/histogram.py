@@ -0,0 +1,77 @@
+'''app.common.histogram'''
+import bisect
+import threading
+
+# Default latency bucket upper bounds (ms).
+DEF_BOUNDS = [0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+#------------------------------------------------------------------------------
+class Histogram():
+    """Thread-safe fixed-bucket histogram, Prometheus style: counts per
+    upper bound @bounds plus an overflow bucket, running sum and count.
+    """
+    def __init__(self, name, bounds=DEF_BOUNDS):
+        self.name = name
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        s = self.summary()
+        return "{} n={} mean={} p50={} p99={} max={}".format(self.name,
+            s['count'], s['mean'], s['p50'], s['p99'], s['max'])
+
+    #--------------------------------------------------------------------------
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.bounds, value)] += 1
+            self.sum += value
+            self.count += 1
+            self.max = max(self.max, value)
+
+    #--------------------------------------------------------------------------
+    def quantile(self, q):
+        """Upper bound of the bucket holding quantile @q (0-1). Values in
+        the overflow bucket report the observed max.
+        """
+        with self.lock:
+            if self.count == 0:
+                return None
+            rank = q * self.count
+            total = 0
+            for i, n in enumerate(self.counts):
+                total += n
+                if total >= rank and n > 0:
+                    return self.bounds[i] if i < len(self.bounds) else self.max
+            return self.max
+
+    #--------------------------------------------------------------------------
+    def summary(self):
+        """Dict of count, mean, p50/p90/p99, max and cumulative bucket
+        counts keyed by upper bound ('inf' for overflow).
+        """
+        buckets, total = {}, 0
+        with self.lock:
+            for bound, n in zip(self.bounds + ['inf'], self.counts):
+                total += n
+                buckets[bound] = total
+            count, _sum, _max = self.count, self.sum, self.max
+        return {
+            'count': count,
+            'mean': round(_sum / count, 2) if count else None,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'max': round(_max, 2),
+            'buckets': buckets
+        }
+
+    #--------------------------------------------------------------------------
+    def reset(self):
+        with self.lock:
+            self.counts = [0] * (len(self.bounds) + 1)
+            self.sum = self.max = 0.0
+            self.count = 0
@@ -0,0 +1,58 @@
+'''app.common.ratelimit'''
+import threading
+import time
+
+#------------------------------------------------------------------------------
+class TokenBucket():
+    """Thread-safe token bucket shared by API callers. Refills @rate tokens
+    every @per seconds, up to @rate tokens. Callers block in acquire() until
+    enough tokens (request weight) are available.
+    """
+    def __init__(self, rate, per=60.0):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.used = 0
+        self.waited = 0.0
+        self.lock = threading.Lock()
+
+    #--------------------------------------------------------------------------
+    def acquire(self, weight=1):
+        """Block until @weight tokens are taken. Returns seconds waited.
+        """
+        weight = min(weight, self.rate)
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                delay = max(self.paused_until - now, 0.0)
+                if delay == 0 and self.tokens >= weight:
+                    self.tokens -= weight
+                    self.used += weight
+                    self.waited += waited
+                    return waited
+                if delay == 0:
+                    delay = (weight - self.tokens) * self.per / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    #--------------------------------------------------------------------------
+    def pause(self, seconds):
+        """Empty the bucket and block all callers for @seconds, i.e. after
+        the server reports the limit was exceeded.
+        """
+        with self.lock:
+            self.tokens = 0.0
+            self.paused_until = max(self.paused_until,
+                time.monotonic() + seconds)
+
+    #--------------------------------------------------------------------------
+    def _refill(self, now):
+        # No refill while paused.
+        elapsed = max(now - max(self.updated, self.paused_until), 0.0)
+        self.updated = now
+        self.tokens = min(float(self.rate),
+            self.tokens + elapsed * self.rate / self.per)
@@ -7,11 +7,40 @@ def pct(a,b): return ((b-a)/a)*100
 ##### General ##################################################################
 
 DEF_KLINE_HIST_LEN = "72 hours ago utc"
+# Max concurrent REST kline queries during backfill.
+BACKFILL_WORKERS = 8
+# DB candle writer batch limits.
+WRITER_BATCH_SIZE = 1000
+WRITER_FLUSH_SEC = 2
+# Websocket candle journal segment dir and flush interval.
+JOURNAL_DIR = "journal"
+JOURNAL_FLUSH_SEC = 10
+# Kline streams per combined websocket connection. Capped by
+# BINANCE_WS_STREAM_LIMIT, kept lower to bound the subscription URL length.
+WS_STREAMS_PER_CONN = 200
+# Candle store snapshot written on shutdown, loaded on startup
+CANDLE_CACHE_DIR = "cache"
+# Candle store rows kept per (pair, freqstr), oldest dropped first. Unlisted
+# freqstrs are unbounded.
+CANDLE_RETENTION = {'1m':2000, '5m':2000, '30m':1000, '1h':1000, '1d':400}
+# Seconds a pair may stay disabled (no position) before its candles are
+# evicted from the store.
+CANDLE_EVICT_SEC = 3600
+# Interval for coalesced trade stats writes.
+STATS_FLUSH_SEC = 5
+# Backtest candle rows kept per (pair, freq) and simulated bid/ask spread (%).
+BACKTEST_HIST_LEN = 500
+BACKTEST_SPREAD_PCT = 0.1
+# db.assets poll interval for pair registry if change streams are unavailable.
+PAIRS_REFRESH_SEC = 30
 
 ##### Trading Conf #############################################################
 
 TRD_AMT_MAX = 50.00
 TRD_FREQS = ['5m', '30m', '1h', '1d']
+# Max wait (ms) for all enabled pairs of a freqstr to close before their
+# entries are evaluated together. 0 evaluates each closed candle on arrival.
+CLOSE_BARRIER_MS = 1500
 
 # Trend definitions for algorithmic filtering of trading pairs.
 # @sma: 1d moving avg dataframe
@@ -29,7 +58,9 @@ TRD_PAIRS = {
 
 # Trading algorithm definitions. No limits to number running concurrently in
 # simulation mode.
-# @ss: snapshot dict, @t: trade record dict
+# Conditions are expressions compiled by app.bot.rules. Fields are snapshot
+# indicators (rsi, buyRatio, macd.value, ...) and, for target/failure, trade
+# stats (stats.minPrice, ...). Functions: pct, abs, min, max.
 TRD_ALGOS = [
     {
         "name": "rsi",
@@ -37,18 +68,18 @@ TRD_ALGOS = [
         "stoploss": -2.5,
         "entry": {
             "conditions": [
-                lambda ss: 10 < ss['rsi'] < 40
+                "10 < rsi < 40"
             ],
         },
         "target": {
             "conditions": [
-                lambda ss,st: ss['rsi'] > 70,
-                lambda ss,st: pct(st['minPrice'], st['lastPrice']) > 0.75
-           ]
+                "rsi > 70",
+                "pct(stats.minPrice, stats.lastPrice) > 0.75"
+            ]
         },
         "failure": {
             "conditions": [
-                lambda ss,st: ss['rsi'] < 5
+                "rsi < 5"
             ]
         }
     },
@@ -58,21 +89,21 @@ TRD_ALGOS = [
         "stoploss": -0.75,
         "entry": {
             "conditions": [
-                lambda ss: ss['macd']['value'] > 0,
-                lambda ss: ss['macd']['bars'] < 3,
-                lambda ss: ss['macd']['priceY'] > 0,
-                lambda ss: ss['macd']['priceX'] > 0
+                "macd.value > 0",
+                "macd.bars < 3",
+                "macd.priceY > 0",
+                "macd.priceX > 0"
             ]
         },
         "target": {
             "conditions": [
-                lambda ss,st: ss['macd']['ampMax'] > ss['macd']['value'] > 0,
-                lambda ss,st: pct(st['minPrice'], st['lastPrice']) > 0.75
+                "macd.ampMax > macd.value > 0",
+                "pct(stats.minPrice, stats.lastPrice) > 0.75"
             ]
         },
         "failure": {
             "conditions": [
-                lambda ss,st: ss['macd']['value'] < 0 or ss['macd']['ampSlope'] < 0
+                "macd.value < 0 or macd.ampSlope < 0"
             ]
         }
     }
@@ -51,6 +51,10 @@ macd_ema = (12,26,9)
 # Candle format for both REST and WSS API
 BINANCE_PCT_FEE = 0.05
 BINANCE_REST_QUERY_LIMIT = 500
+# Request weight allowed per minute per IP
+BINANCE_REQ_WEIGHT_LIMIT = 1200
+# Max streams per combined stream connection
+BINANCE_WS_STREAM_LIMIT = 1024
 BINANCE_REST_KLINES = [
     'open_time',
     'open',
@@ -4,18 +4,19 @@ import sys
 import logging
 import time
 from threading import Thread, Event
-from queue import Queue
 from binance.client import Client
 from docs.conf import *
 from docs.botconf import *
 import app, app.bot
+from app.bot.mailbox import CandleMailbox
 
 ##### Globals #####
 
 log = logging.getLogger('main')
 divstr = "***** %s *****"
-# Candle data queue. Feeder is bot.websock, consumer is bot.trade
-q = Queue()
+# Candle data mailbox, latest unclosed update per (pair, freqstr). Feeder is
+# bot.websock, consumer is bot.trade
+q = CandleMailbox()
 # Enabled pair change event
 e_pairs = Event()
 # Thread termination event
@@ -26,7 +27,8 @@ if __name__ == '__main__':
     app.set_db(host)
     app.bot.init(e_pairs)
 
-    from app.bot import candles, scanner, trade, websock
+    from app.bot import cache, candles, journal, ledger, registry, scanner, \
+        trade, websock, writer
 
     # Handle input commands
     try:
@@ -40,7 +42,8 @@ if __name__ == '__main__':
     # Create worker threads. Set as daemons so they terminate
     # automatically if main process is killed.
     threads = []
-    for func in [websock.run, trade.run, scanner.run]:
+    for func in [websock.run, trade.run, scanner.run, writer.run, journal.run,
+        ledger.run, registry.run]:
         threads.append(Thread(
             name='{}.{}'.format(func.__module__, func.__name__),
             target=func,
@@ -69,6 +72,8 @@ if __name__ == '__main__':
     print("Broke main loop")
     # Wait for remaining threads to finish
     [t.join() for t in threads if t.is_alive()]
+    print("Caching candles...")
+    cache.save()
 
     print("Goodbye")
     [log.log(lvl, divstr % "Terminating") \
@@ -0,0 +1,192 @@
+# tests/backtest.py
+import os,sys,inspect
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+import contextlib
+import time
+from datetime import timedelta
+from unittest import mock
+import numpy as np
+from docs.botconf import BACKTEST_HIST_LEN, BACKTEST_SPREAD_PCT
+from app.common.timeutils import strtofreq
+from app.bot import backtest, candles, ledger, sweep
+from benchmark import synth_candles
+
+#------------------------------------------------------------------------------
+def synth_data(n_pairs=20, freqstrs=['5m', '1h'], n_candles=2000):
+    """Random-walk candles for @n_pairs synthetic pairs as a candles.dtype
+    record array, as loaded by backtest.load_db.
+    """
+    blocks = []
+    for i in range(n_pairs):
+        for freqstr in freqstrs:
+            freq = strtofreq(freqstr)
+            df = synth_candles(n_candles, freq=freq, seed=i*10 + len(blocks))
+            arr = np.zeros(len(df), dtype=candles.dtype)
+            arr['pair'] = 'PAIR{}BTC'.format(i)
+            arr['freqstr'] = freqstr
+            arr['open_time'] = df.index.values.astype('datetime64[ms]').astype(np.int64)
+            for k in ['open', 'close', 'high', 'low', 'volume', 'buy_vol']:
+                arr[k] = df[k].values
+            arr['trades'] = df['trades'].values
+            blocks.append(arr)
+    return np.concatenate(blocks)
+
+#------------------------------------------------------------------------------
+def run_backtest(n_pairs=20, n_candles=2000):
+    """Replay synthetic candles through backtest.run and report throughput.
+    """
+    import app.bot
+    from app.bot import macd, rules, trade
+    live = (app.bot.dfc, app.bot.client, rules.compiled, trade.TRD_ALGOS,
+        macd.streams, dict(ledger.book), len(macd.streams))
+    data = synth_data(n_pairs, n_candles=n_candles)
+    results = backtest.run(data)
+    # Live module state was neither replaced nor written to.
+    assert live == (app.bot.dfc, app.bot.client, rules.compiled,
+        trade.TRD_ALGOS, macd.streams, ledger.book, len(macd.streams))
+    print("{:,} candles replayed. {}".format(len(data), results['summary']))
+
+    keys = ['pair', 'quote_asset', 'freqstr', 'status', 'start_time', 'algo',
+        'stoploss', 'entry', 'last', 'snapshot_count', 'stats', 'details',
+        'orders']
+    for record in results['trades']:
+        assert set(keys).issubset(record)
+        if record['status'] == 'closed':
+            assert len(record['orders']) == 2
+            assert record['end_time'] >= record['start_time']
+    return results['summary']
+
+#------------------------------------------------------------------------------
+def run_sweep(n_pairs=5, n_candles=1000, processes=None):
+    """Sweep 'macd' algo entry bars and ema periods over synthetic candles.
+    The ema periods are applied per worker process, so results must differ
+    between them.
+    """
+    data = synth_data(n_pairs, n_candles=n_candles)
+    df = sweep.run(data, 'macd', {
+        'entry.conditions.1': ["macd.bars < 3", "macd.bars < 2"],
+        'ema': [(12, 26, 9), (8, 17, 9)]
+    }, processes=processes)
+    print(df[['entry.conditions.1', 'ema', 'n_trades', 'net_gain', 'win_rate',
+        'max_drawdown']].to_string())
+
+    assert len(df) == 4
+    assert df['net_gain'].is_monotonic_decreasing
+    # Same entry rule, different ema: the override took effect.
+    for cond, group in df.groupby('entry.conditions.1'):
+        assert group[['n_trades', 'net_gain']].drop_duplicates().shape[0] == 2, \
+            cond
+    return df
+
+#------------------------------------------------------------------------------
+def run_sweep_worker(n_pairs=3, n_candles=600):
+    """A config without 'ema' run on a worker after one with 'ema' uses the
+    default macd periods, not the previous config's.
+    """
+    import docs.conf
+    from docs.botconf import TRD_ALGOS
+    from app.bot import macd
+
+    data = synth_data(n_pairs, n_candles=n_candles)
+    algo = [n for n in TRD_ALGOS if n['name'] == 'macd'][0]
+    default = {k:v for k, v in algo.items() if k != 'ema'}
+    fast = dict(default, ema=(8, 17, 9))
+    run = lambda n: sweep._run((n, BACKTEST_HIST_LEN, BACKTEST_SPREAD_PCT))
+
+    saved = macd.macd_ema
+    sweep.worker['data'] = data
+    try:
+        alone = run(default)
+        after = run(fast), run(default)
+    finally:
+        macd.macd_ema = saved
+        sweep.worker.clear()
+    print("default ema: {}, after (8, 17, 9): {}".format(alone, after[1]))
+
+    assert macd.macd_ema == docs.conf.macd_ema
+    assert after[0]['n_trades'] != alone['n_trades']
+    keys = ['n_trades', 'wins', 'net_gain', 'max_drawdown']
+    assert [after[1][k] for k in keys] == [alone[k] for k in keys]
+
+#------------------------------------------------------------------------------
+def run_close_barrier(n_pairs=3, n_candles=300):
+    """Closed candles held at the close barrier, then the next (unclosed)
+    bar of the first pair arrives before the barrier is released. Its entry
+    must still be decided and recorded on the closed bar's values.
+    """
+    import app.bot
+    from app.bot import registry, rules, trade
+    from app.bot.store import CandleStore
+
+    data = synth_data(n_pairs, freqstrs=['5m'], n_candles=n_candles)
+    pairs = ['PAIR{}BTC'.format(i) for i in range(n_pairs)]
+    algo = {'name':'barrier', 'stoploss':-100.0,
+        'entry': {'conditions': ["rsi >= 0"]},
+        'target': {'conditions': ["rsi > 100"]},
+        'failure': {'conditions': ["rsi < 0"]}}
+
+    def candle(row, closed=True, close=None):
+        c = {k:float(row[k]) for k in ['open', 'close', 'high', 'low',
+            'trades', 'volume', 'buy_vol']}
+        c.update({'pair':row['pair'].decode('utf-8'), 'freqstr':'5m',
+            'open_time':backtest.to_dt(int(row['open_time'])),
+            'closed':closed})
+        c['close_time'] = c['open_time'] + timedelta(seconds=299)
+        if close is not None:
+            c['close'] = c['high'] = close
+        return c
+
+    client = backtest.SimClient()
+    ruleset = rules.compile_algos([algo])
+    with contextlib.ExitStack() as stack:
+        for target, attr, value in [(app.bot, 'dfc', CandleStore()),
+            (app.bot, 'client', client), (trade, 'TRD_ALGOS', [algo]),
+            (trade, 'algos', {'barrier':algo}), (rules, 'compiled', ruleset),
+            (rules, 'descriptions', {'barrier': {k: rules.describe('barrier',
+                k, ruleset) for k in ruleset['barrier']}}),
+            (ledger, 'loaded', True), (ledger, 'queue', lambda *args: None),
+            (registry, 'loaded', True), (registry, 'enabled', frozenset()),
+            (registry, 'active', frozenset()), (registry, 'version', 0)]:
+            stack.enter_context(mock.patch.object(target, attr, value))
+        for d in [ledger.book, ledger.by_key, ledger.by_algo, ledger.closed,
+            trade.barrier, registry.status]:
+            stack.enter_context(mock.patch.dict(d, clear=True))
+        registry.update({n:'ENABLED' for n in pairs})
+        [trade.quote_assets.setdefault(n, 'BTC') for n in pairs]
+
+        rows = [data[data['pair'] == n.encode()] for n in pairs]
+        candles.merge_ndarray(np.concatenate([n[:-2] for n in rows]))
+        held = [candle(n[-2]) for n in rows]
+        for c in held:
+            client.prices[c['pair']] = c['close']
+            trade.process(c, time.monotonic())
+        assert set(trade.barrier['5m']['candles']) == set(pairs)
+        expected = trade.snapshot(held[0])
+
+        live = candle(rows[0][-1], closed=False, close=held[0]['close']*1.5)
+        ids = trade.process(live, time.monotonic())[0]
+        for batch in trade.barrier.values():
+            batch['due'] = 0
+        ids += trade.release()
+        records = ledger.open_trades()
+
+    assert len(ids) == 1 and len(records) == 1
+    entry = records[0]['entry']
+    assert entry['candle']['open_time'] == held[0]['open_time']
+    values, expected = rules.flatten(entry['indicators']), \
+        rules.flatten(expected['indicators'])
+    for k in expected:
+        assert values[k] == expected[k] or \
+            np.isclose(values[k], expected[k], equal_nan=True), k
+    print("Entry on {} decided on the closed bar despite a live update "\
+        "during the barrier.".format(records[0]['pair']))
+
+##### Main
+if __name__ == '__main__':
+    run_backtest()
+    run_sweep()
+    run_sweep_worker()
+    run_close_barrier()
@@ -0,0 +1,481 @@
+# tests/benchmark.py
+import os,sys,inspect
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+import json
+import platform
+import shutil
+import tempfile
+import timeit
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import app, app.bot
+from app.common.utils import pct_diff
+from app.bot import cache, candles, macd, signals, tickers, trade
+from app.bot.store import CandleStore
+
+BASELINE = os.path.join(currentdir, 'bench_baseline.json')
+RESULTS = os.path.join(currentdir, 'bench_results.json')
+# Median time ratio vs baseline flagged as a regression.
+THRESHOLD = 1.25
+
+#------------------------------------------------------------------------------
+def synth_candles(n, freq=300, seed=0):
+    """Random-walk candle dataframe indexed by open_time, same layout as
+    app.bot.dfc.frame().
+    """
+    rng = np.random.RandomState(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.002, n)))
+    _open = np.append(close[0], close[:-1])
+    spread = np.abs(rng.normal(0, 0.001, n)) * close
+    volume = rng.uniform(10, 1000, n)
+    return pd.DataFrame({
+            'open': _open,
+            'close': close,
+            'high': np.maximum(_open, close) + spread,
+            'low': np.minimum(_open, close) - spread,
+            'trades': rng.randint(1, 500, n).astype(np.float64),
+            'volume': volume,
+            'buy_vol': volume * rng.uniform(0, 1, n)
+        },
+        index=pd.date_range('2018-01-01', periods=n,
+            freq='{}s'.format(freq), name='open_time'))
+
+#------------------------------------------------------------------------------
+def histo_phases_loop(df, pair, freqstr, periods):
+    """Pre-vectorization histo_phases (per-phase boolean mask scan). Kept as
+    reference for benchmarking/verifying macd.histo_phases.
+    """
+    dfmacd = macd.generate(df.copy()).tail(periods)['macd_diff']
+    rows, phases = [], []
+    idx = 0
+
+    while idx < len(dfmacd):
+        diff = dfmacd.iloc[idx]
+        if diff > 0:
+            skip = dfmacd.iloc[idx:][dfmacd < 0].head(1).index
+        elif diff < 0:
+            skip = dfmacd.iloc[idx:][dfmacd > 0].head(1).index
+        else:
+            idx += 1
+            continue
+        end = len(dfmacd)-1 if skip.empty else dfmacd.index.get_loc(skip[0])-1
+        phase = dfmacd.iloc[idx:end+1]
+        rows.append([phase.index[0], phase.index[-1], end-idx+1,
+            '+' if diff > 0 else '-', phase.mean(), phase.max()])
+        phases.append(phase)
+        idx = end + 1
+
+    dfh = pd.DataFrame(rows,
+        columns=['start', 'end', 'bars', 'phase', 'ampMean', 'ampMax'])
+    py, px, corr = [], [], []
+    for i in range(len(dfh)):
+        _slice = df.loc[slice(dfh.iloc[i]['start'], dfh.iloc[i]['end'])]
+        y = pct_diff(_slice['low'].min(), _slice['high'].max())
+        py.append(y * -1 if dfh['ampMean'].iloc[i] < 0 else y)
+        px.append(pct_diff(_slice.iloc[0]['open'], _slice.iloc[-1]['close']))
+        corr.append(phases[i].corr(_slice['close']))
+
+    dfh['priceY'], dfh['priceX'], dfh['corr'] = py, px, corr
+    dfh['capt'] = abs(dfh['priceX'] / dfh['priceY'])
+    dfh.index = dfh['start']
+    return (dfh[['bars', 'ampMean', 'ampMax', 'priceY', 'priceX', 'capt',
+        'corr']].round(2), phases)
+
+#------------------------------------------------------------------------------
+def bench_histo_phases(n_candles=5000, repeat=5):
+    """Compare vectorized vs loop histo_phases on the snapshot (100 periods)
+    and scanner full-history (macd_med_trend_filter) cases.
+    """
+    df = synth_candles(n_candles)
+    results = {}
+
+    for lbl, periods in [('snapshot', 100), ('full_history', n_candles)]:
+        new, _ = macd.histo_phases(df, 'BENCH', '5m', periods)
+        old, _ = histo_phases_loop(df, 'BENCH', '5m', periods)
+        cols = old.columns.tolist()
+        assert np.allclose(new[cols].values.astype(float),
+            old[cols].values.astype(float), atol=0.011, equal_nan=True)
+
+        t_new = min(timeit.repeat(
+            lambda: macd.histo_phases(df, 'BENCH', '5m', periods),
+            number=1, repeat=repeat)) * 1000
+        t_old = min(timeit.repeat(
+            lambda: histo_phases_loop(df, 'BENCH', '5m', periods),
+            number=1, repeat=repeat)) * 1000
+        results[lbl] = {'phases':len(new), 'loop_ms':round(t_old,1),
+            'vector_ms':round(t_new,1), 'speedup':round(t_old/t_new,1)}
+        print("histo_phases {:<13} {:>4} phases: loop {:>8,.1f} ms, "\
+            "vectorized {:>6,.1f} ms ({:.1f}x)".format(
+            lbl, len(new), t_old, t_new, t_old/t_new))
+    return results
+
+#------------------------------------------------------------------------------
+def synth_ndarray(n_pairs, n_candles, freqstr='5m', freq=300):
+    """@n_pairs x @n_candles synthetic candles as a candles.dtype record
+    array, as bulk_load gets from bsonnumpy.
+    """
+    blocks = []
+    for i in range(n_pairs):
+        df = synth_candles(n_candles, freq=freq, seed=i)
+        arr = np.zeros(len(df), dtype=candles.dtype)
+        arr['pair'] = 'PAIR{}BTC'.format(i)
+        arr['freqstr'] = freqstr
+        arr['open_time'] = df.index.values.astype('datetime64[ms]').astype(np.int64)
+        for k in candles.columns[3:]:
+            arr[k] = df[k].values
+        blocks.append(arr)
+    return np.concatenate(blocks)
+
+#------------------------------------------------------------------------------
+def synth_store(n_pairs, n_candles):
+    """CandleStore holding synth_ndarray() candles, and the newest candle
+    dict of each pair.
+    """
+    saved = app.bot.dfc
+    app.bot.dfc = CandleStore()
+    try:
+        candles.merge_ndarray(synth_ndarray(n_pairs, n_candles))
+        store = app.bot.dfc
+    finally:
+        app.bot.dfc = saved
+
+    last = []
+    for i in range(n_pairs):
+        df = store.frame('PAIR{}BTC'.format(i), 300)
+        row = df.iloc[-1]
+        last.append({'pair':'PAIR{}BTC'.format(i), 'freqstr':'5m',
+            'open_time':df.index[-1].tz_localize('UTC'),
+            'close_time':df.index[-1].tz_localize('UTC') + pd.Timedelta(seconds=299),
+            'closed':True, **{k:row[k] for k in candles.columns[3:]}})
+    return store, last
+
+#------------------------------------------------------------------------------
+def synth_tickers(n_pairs, seed=0):
+    """binance_24h() style ticker dataframe for @n_pairs pairs.
+    """
+    rng = np.random.RandomState(seed)
+    quotes = ['BTC', 'ETH', 'BNB', 'USDT']
+    symbols = ['PAIR{}{}'.format(i, quotes[i % 4]) for i in range(n_pairs)]
+    df = pd.DataFrame({
+        'lastPrice': rng.uniform(0.1, 100, n_pairs),
+        '24hPriceChange': rng.normal(0, 5, n_pairs),
+        'quoteVol': rng.uniform(1, 1000, n_pairs),
+        'volume': rng.uniform(1, 1e5, n_pairs),
+        'baseAsset': ['PAIR{}'.format(i) for i in range(n_pairs)],
+        'quoteAsset': [quotes[i % 4] for i in range(n_pairs)]
+    }, index=pd.Index(symbols, name='symbol'))
+    return df.sort_index()
+
+#------------------------------------------------------------------------------
+def cases(n_pairs, n_candles):
+    """Hot path benchmarks over @n_pairs pairs of @n_candles history.
+    Returns {name: fn}. Per-series functions run once per pair, as a scan
+    of every pair would.
+    """
+    arr = synth_ndarray(n_pairs, n_candles)
+    store, last = synth_store(n_pairs, n_candles)
+    frames = [store.frame(c['pair'], 300) for c in last]
+    dicts = [{**c, 'open_time':c['open_time'] - pd.Timedelta(minutes=5*n),
+        'close_time':c['close_time'] - pd.Timedelta(minutes=5*n)} \
+        for c in last for n in range(10)]
+    dfT = synth_tickers(max(n_pairs, 10))
+    # Raw websocket kline payloads, as passed to websock.recv_kline.
+    klines = [{'t':int(c['open_time'].timestamp()*1000),
+        'T':int(c['close_time'].timestamp()*1000), 's':c['pair'], 'i':'5m',
+        'o':str(c['open']), 'c':str(c['close']), 'h':str(c['high']),
+        'l':str(c['low']), 'n':int(c['trades']), 'v':str(c['volume']),
+        'V':str(c['buy_vol']), 'q':'0', 'Q':'0', 'x':False} \
+        for c in last for n in range(10)]
+
+    def in_store(fn):
+        def run():
+            saved = app.bot.dfc
+            app.bot.dfc = store
+            try:
+                fn()
+            finally:
+                app.bot.dfc = saved
+        return run
+
+    def bulk_load():
+        saved = app.bot.dfc
+        app.bot.dfc = CandleStore()
+        try:
+            candles.merge_ndarray(arr.copy())
+        finally:
+            app.bot.dfc = saved
+
+    return {
+        'candles.bulk_load': bulk_load,
+        'candles.modify_dfc': in_store(lambda: [candles.modify_dfc(c) for c in last]),
+        'candles.bulk_append_dfc': in_store(lambda: candles.bulk_append_dfc(dicts)),
+        # Message decode plus store update, dict vs Kline record.
+        'candles.from_kline': in_store(lambda: [candles.modify_dfc(
+            candles.from_kline(k)) for k in klines]),
+        'candles.decode_kline': in_store(lambda: [candles.modify_dfc(
+            candles.decode_kline(k)) for k in klines]),
+        'macd.generate': lambda: [macd.generate(df.copy()) for df in frames],
+        'macd.histo_phases': lambda: [macd.histo_phases(df, 'BENCH', '5m', 100) \
+            for df in frames],
+        'signals.rsi': lambda: [signals.rsi(df['close'].tail(100), 14) \
+            for df in frames],
+        'signals.zscore': lambda: [signals.zscore(df['close'],
+            df['close'].iloc[-1], 21) for df in frames],
+        'trade.snapshot': in_store(lambda: [trade.snapshot(c) for c in last]),
+        'tickers.aggregate_mkt': lambda: tickers.aggregate(dfT)
+    }
+
+#------------------------------------------------------------------------------
+def run_suite(sizes=[(10, 500), (10, 2000), (100, 500), (100, 2000)],
+    repeat=5, only=None):
+    """Time every case at each (n_pairs, n_candles) size.
+    @only: list of case names to run, default all
+    Returns results dict: {'meta':{..}, 'results':{'<case> <pairs>x<candles>':
+    {'min_ms', 'median_ms'}}}.
+    """
+    results = {}
+    for n_pairs, n_candles in sizes:
+        for name, fn in cases(n_pairs, n_candles).items():
+            if only and name not in only:
+                continue
+            fn()
+            times = np.array(timeit.repeat(fn, number=1, repeat=repeat)) * 1000
+            key = '{} {}x{}'.format(name, n_pairs, n_candles)
+            results[key] = {'min_ms':round(times.min(), 3),
+                'median_ms':round(float(np.median(times)), 3)}
+            print("{:<36} {:>10,.2f} ms".format(key, results[key]['median_ms']))
+
+    return {
+        'meta': {
+            'time': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'repeat': repeat
+        },
+        'results': results
+    }
+
+#------------------------------------------------------------------------------
+def save(results, path=RESULTS):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+#------------------------------------------------------------------------------
+def compare(results, path=BASELINE, threshold=THRESHOLD):
+    """Compare median times in @results against baseline file @path.
+    Returns list of (case, baseline ms, ms, ratio) slower than @threshold x
+    baseline.
+    """
+    with open(path) as f:
+        baseline = json.load(f)['results']
+
+    regressions = []
+    for key, r in results['results'].items():
+        if key not in baseline:
+            continue
+        base = baseline[key]['median_ms']
+        ratio = r['median_ms'] / base if base > 0 else 1.0
+        flag = ''
+        if ratio > threshold:
+            flag = 'REGRESSION'
+            regressions.append((key, base, r['median_ms'], round(ratio, 2)))
+        elif ratio < 1 / threshold:
+            flag = 'faster'
+        print("{:<36} {:>10,.2f} -> {:>10,.2f} ms {:>6.2f}x {}".format(
+            key, base, r['median_ms'], ratio, flag))
+    return regressions
+
+#------------------------------------------------------------------------------
+def bench_cold_start(n_pairs=100, n_candles=20000):
+    """Store load time from a bsonnumpy style record array (bulk_load
+    without the DB read) vs the on-disk candle cache. Checks the cache
+    round trip is exact.
+    """
+    arr = synth_ndarray(n_pairs, n_candles)
+    saved = app.bot.dfc
+    path = os.path.join(tempfile.mkdtemp(), 'cache')
+    try:
+        app.bot.dfc = CandleStore()
+        t_merge = min(timeit.repeat(lambda: candles.merge_ndarray(arr),
+            number=1, repeat=1)) * 1000
+        src = app.bot.dfc
+        cache.save(path)
+
+        app.bot.dfc = CandleStore()
+        t_cache = min(timeit.repeat(lambda: cache.load(path, tail=False),
+            number=1, repeat=1)) * 1000
+        for k in src.keys():
+            a, b = src.get(*k), app.bot.dfc.get(*k)
+            assert np.array_equal(a.times[a.start:a.end], b.times[b.start:b.end])
+            assert np.array_equal(a.values[a.start:a.end], b.values[b.start:b.end])
+    finally:
+        app.bot.dfc = saved
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+    print("{:,} candles: record array merge {:,.0f} ms, cache load {:,.0f} ms "\
+        "({:.1f}x)".format(len(arr), t_merge, t_cache, t_merge/t_cache))
+    return {'merge_ms':round(t_merge, 1), 'cache_ms':round(t_cache, 1)}
+
+#------------------------------------------------------------------------------
+def bench_retention(n_pairs=100, n_candles=20000, limit=2000):
+    """Store memory of @n_pairs keys of @n_candles rows unbounded vs with a
+    @limit row retention, and eviction of half the pairs. Checks bounded
+    buffers hold exactly the newest @limit rows.
+    """
+    arr = synth_ndarray(n_pairs, n_candles)
+    saved = app.bot.dfc
+    try:
+        app.bot.dfc = CandleStore()
+        candles.merge_ndarray(arr)
+        full = app.bot.dfc
+        app.bot.dfc = CandleStore(retention={300:limit})
+        candles.merge_ndarray(arr)
+        # Second pass takes the slow (reallocating) merge path.
+        candles.merge_ndarray(arr[::2])
+        bounded = app.bot.dfc
+    finally:
+        app.bot.dfc = saved
+
+    for k in full.keys():
+        a, b = full.get(*k), bounded.get(*k)
+        assert len(b) == limit
+        assert np.array_equal(a.times[a.end-limit:a.end], b.times[b.start:b.end])
+        assert np.array_equal(a.values[a.end-limit:a.end], b.values[b.start:b.end])
+
+    mem_full, mem = full.memory(), bounded.memory()
+    pairs = ['PAIR{}BTC'.format(i) for i in range(0, n_pairs, 2)]
+    rows = bounded.evict(pairs)
+    assert rows == len(pairs) * limit
+    assert len(bounded.keys()) == n_pairs - len(pairs)
+
+    print("{} keys: unbounded {:,.1f} MB, {:,} row retention {:,.1f} MB, "\
+        "{:,.1f} MB after evicting {} pairs".format(len(mem), mem_full['bytes'].sum()/1e6,
+        limit, mem['bytes'].sum()/1e6, bounded.memory()['bytes'].sum()/1e6,
+        len(pairs)))
+    return {'full_mb':mem_full['bytes'].sum()/1e6, 'bounded_mb':mem['bytes'].sum()/1e6}
+
+#------------------------------------------------------------------------------
+def check_entry_indicators(n_pairs=30, n_candles=400):
+    """signals.entry_indicators fields equal the flattened snapshot fields
+    for every pair, so vectorized entry rules see the same values.
+    """
+    from app.bot import rules
+    store, last = synth_store(n_pairs, n_candles)
+    saved = app.bot.dfc
+    app.bot.dfc = store
+    try:
+        dfi = signals.entry_indicators([(c['pair'], 300) for c in last])
+        for i, c in enumerate(last):
+            values = rules.flatten(trade.snapshot(c)['indicators'])
+            for k in dfi.columns:
+                if k in values:
+                    assert np.allclose(values[k], dfi[k].values[i],
+                        equal_nan=True), (c['pair'], k)
+    finally:
+        app.bot.dfc = saved
+    print("{} entry indicator fields match snapshots for {} pairs.".format(
+        len(dfi.columns), n_pairs))
+
+#------------------------------------------------------------------------------
+def check_report_indicators(n_pairs=30, n_candles=400):
+    """signals.bulk_indicators as reports.positions calls it equals the
+    per-series values reports showed before: rsi and zscore over the full
+    history, macd from histo_phases over 100 periods.
+    """
+    store, last = synth_store(n_pairs, n_candles)
+    saved = app.bot.dfc
+    app.bot.dfc = store
+    try:
+        dfi = signals.bulk_indicators([(c['pair'], 300) for c in last],
+            rsi_periods=None)
+        for c in last:
+            df = store.frame(c['pair'], 300)
+            dfmacd, phases = macd.histo_phases(df, c['pair'], '5m', 100)
+            ind = dfi.loc[(c['pair'], 300)]
+            assert ind['close'] == df.iloc[-1]['close']
+            assert ind['rsi'] == signals.rsi(df['close'], 14), c['pair']
+            assert np.isclose(ind['zscore'], signals.zscore(df['close'],
+                df.iloc[-1]['close'], 21)), c['pair']
+            assert np.isclose(ind['macd'], phases[-1].iloc[-1]), c['pair']
+    finally:
+        app.bot.dfc = saved
+    print("Report indicators match per-series values for {} pairs.".format(
+        n_pairs))
+
+#------------------------------------------------------------------------------
+def check_stream_retention(n_candles=900, limit=300):
+    """Feed candles one at a time through a store with a @limit row
+    retention and the macd stream. After every trim the stream must still
+    equal generate_matrix() on the trimmed store frame, and a bulk seeded
+    stream must equal one fed candle by candle.
+    """
+    df = synth_candles(n_candles)
+    pair, key = 'PAIR0BTC', ('PAIR0BTC', '5m')
+    saved, saved_streams = app.bot.dfc, macd.streams
+    app.bot.dfc = CandleStore(retention={300:limit})
+    macd.streams = {}
+    try:
+        for t, row in zip(df.index, df.itertuples()):
+            c = {'pair':pair, 'freqstr':'5m', 'open_time':t.tz_localize('UTC'),
+                'closed':True, **{k:getattr(row, k) for k in candles.columns[3:]}}
+            candles.modify_dfc(c)
+            macd.update_stream(c)
+        closes = app.bot.dfc.frame(pair, 300)[['close']]
+        assert len(closes) == limit
+        stream = macd.streams[key]
+        histo = macd.generate_matrix(closes, normalize=False)['close']
+        assert np.allclose(stream.values()[2], histo.iloc[-1])
+        norm = macd.generate_matrix(closes)['close'].tail(100)
+        assert np.allclose(stream.series(100).values, norm.values,
+            equal_nan=True)
+
+        looped = macd.MacdStream()
+        for t, x in zip(closes.index, closes['close'].values):
+            looped.update(t, x, True)
+        assert np.allclose(stream.state, looped.state)
+        assert np.allclose(stream.prev, looped.prev)
+        assert np.allclose([n[1] for n in stream.histo],
+            [n[1] for n in looped.histo], equal_nan=True)
+    finally:
+        app.bot.dfc, macd.streams = saved, saved_streams
+    print("Macd stream matches generate_matrix after {} retention trims.".format(
+        n_candles - limit))
+
+##### Main
+if __name__ == '__main__':
+    # Usage: benchmark.py [--baseline] [--histo-phases] [--cold-start]
+    #   [--retention] [--entry-indicators] [--report-indicators]
+    #   [--stream-retention]
+    # --baseline: save this run as the new baseline instead of comparing.
+    if '--histo-phases' in sys.argv:
+        bench_histo_phases()
+        sys.exit()
+    if '--cold-start' in sys.argv:
+        bench_cold_start()
+        sys.exit()
+    if '--retention' in sys.argv:
+        bench_retention()
+        sys.exit()
+    if '--entry-indicators' in sys.argv:
+        check_entry_indicators()
+        sys.exit()
+    if '--report-indicators' in sys.argv:
+        check_report_indicators()
+        sys.exit()
+    if '--stream-retention' in sys.argv:
+        check_stream_retention()
+        sys.exit()
+
+    results = run_suite()
+    save(results)
+    if '--baseline' in sys.argv or not os.path.exists(BASELINE):
+        save(results, BASELINE)
+        print("Baseline saved to {}".format(BASELINE))
+    elif len(compare(results)) > 0:
+        sys.exit(1)
@@ -0,0 +1,242 @@
+# tests/fake_binance.py
+import os,sys,inspect
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+import contextlib
+import functools
+import threading
+import time
+import zlib
+from collections import deque
+from unittest import mock
+import numpy as np
+from app.common.timeutils import strtofreq
+
+#------------------------------------------------------------------------------
+class FakeAPIException(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+#------------------------------------------------------------------------------
+class FakeClient():
+    """In-process stand-in for binance.client.Client serving deterministic
+    synthetic klines. Set as app.bot.client it bypasses HTTP entirely;
+    replay_server.RestServer serves it over HTTP to a real Client. Tracks
+    request weight over a rolling minute and raises a 429 FakeAPIException
+    when @weight_limit is exceeded, like the real exchange. Requests for
+    @fail symbols always raise a 500. Quotes and tickers are taken from the
+    synthetic 1m kline at now_ms, which replay_server.KlineFeed advances.
+    """
+    def __init__(self, latency=0.05, weight_limit=1200, now_ms=None,
+        pairs=None, fail=()):
+        self.pairs = list(pairs or [])
+        self.fail = set(fail)
+        self.latency = latency
+        self.weight_limit = weight_limit
+        self.now_ms = now_ms or int(time.time()*1000)
+        self.requests = deque()
+        self.n_requests = self.n_rejected = 0
+        self.peak_weight = 0
+        self.lock = threading.Lock()
+
+    #--------------------------------------------------------------------------
+    def get_klines(self, symbol=None, interval=None, limit=500,
+        startTime=None, endTime=None):
+        from app.bot.candles import kline_weight
+        self._charge(kline_weight(limit))
+        time.sleep(self.latency)
+        if symbol in self.fail:
+            raise FakeAPIException(500, 'Internal error')
+
+        ms_period = strtofreq(interval) * 1000
+        end = min(endTime or self.now_ms, self.now_ms)
+        if startTime is None:
+            startTime = end - end % ms_period - (limit-1) * ms_period
+        first = -(-startTime // ms_period) * ms_period
+        times = np.arange(first, end+1, ms_period)[0:limit]
+        return [self.kline(symbol, t, ms_period) for t in times]
+
+    #--------------------------------------------------------------------------
+    def get_orderbook_ticker(self, symbol=None, spread_pct=0.1):
+        self._charge(1)
+        price = self._price(symbol)
+        half = price * spread_pct / 200
+        return {'symbol':symbol, 'bidPrice':str(price - half), 'bidQty':'1.0',
+            'askPrice':str(price + half), 'askQty':'1.0'}
+
+    #--------------------------------------------------------------------------
+    def get_ticker(self, symbol=None):
+        self._charge(1 if symbol else 40)
+        tickers = []
+        for pair in ([symbol] if symbol else self.pairs):
+            k = self.kline(pair, self.now_ms - 86400000, 86400000)
+            last = self._price(pair)
+            tickers.append({'symbol':pair, 'openTime':k[0], 'closeTime':self.now_ms,
+                'lastPrice':str(last), 'priceChange':str(last - float(k[1])),
+                'priceChangePercent':str((last/float(k[1]) - 1) * 100),
+                'quoteVolume':k[7], 'volume':k[5], 'weightedAvgPrice':k[4]})
+        return tickers[0] if symbol else tickers
+
+    #--------------------------------------------------------------------------
+    def get_exchange_info(self):
+        self._charge(1)
+        quotes = ['USDT', 'BTC', 'ETH', 'BNB']
+        quote = lambda n: next((q for q in quotes if n.endswith(q)), n[-3:])
+        return {'timezone':'UTC', 'serverTime':self.now_ms, 'symbols': [
+            {'symbol':n, 'status':'TRADING', 'quoteAsset':quote(n),
+            'baseAsset':n[:-len(quote(n))]} for n in self.pairs]}
+
+    #--------------------------------------------------------------------------
+    def kline(self, symbol, t, ms_period):
+        rng = np.random.RandomState((zlib.crc32(symbol.encode()) + int(t/1000)) % 2**32)
+        o, c = rng.uniform(0.9, 1.1, 2)
+        v = rng.uniform(10, 1000)
+        return [int(t), str(o), str(max(o,c)*1.01), str(min(o,c)*0.99),
+            str(c), str(v), int(t + ms_period - 1), str(v*c),
+            int(rng.randint(1, 500)), str(v/2), str(v*c/2), '0']
+
+    #--------------------------------------------------------------------------
+    def _price(self, symbol):
+        return float(self.kline(symbol, self.now_ms - self.now_ms % 60000,
+            60000)[4])
+
+    #--------------------------------------------------------------------------
+    def _charge(self, weight):
+        now = time.monotonic()
+        with self.lock:
+            self.n_requests += 1
+            while self.requests and now - self.requests[0][0] > 60:
+                self.requests.popleft()
+            used = sum(n[1] for n in self.requests) + weight
+            if used > self.weight_limit:
+                self.n_rejected += 1
+                raise FakeAPIException(429, 'Too many requests')
+            self.requests.append((now, weight))
+            self.peak_weight = max(self.peak_weight, used)
+
+#------------------------------------------------------------------------------
+def offline(client, pairs, freqstrs, bulk_save=None):
+    """Patches running candles.api_update against @client without DB: an
+    empty candle store and coverage index for @pairs x @freqstrs, and
+    @bulk_save in place of candles.bulk_save. All undone on exit.
+    Returns ExitStack context manager.
+    """
+    import app.bot
+    from app.bot import candles, coverage
+    from app.bot.store import CandleStore
+
+    stack = contextlib.ExitStack()
+    stack.enter_context(mock.patch.object(app.bot, 'client', client))
+    stack.enter_context(mock.patch.object(app.bot, 'dfc', CandleStore()))
+    stack.enter_context(mock.patch.object(candles, 'bulk_save',
+        bulk_save or (lambda data, **kwargs: None)))
+    stack.enter_context(mock.patch.object(coverage, 'save',
+        lambda *args: None))
+    stack.enter_context(mock.patch.dict(coverage.index,
+        {(p, f): [] for p in pairs for f in freqstrs}))
+    return stack
+
+#------------------------------------------------------------------------------
+def run_backfill(n_pairs=20, freqstrs=['5m','1h'], latency=0.05,
+    network=False):
+    """Backfill @n_pairs synthetic pairs through candles.api_update against
+    FakeClient and report throughput and rate limit compliance.
+    @network: query through binance.client.Client and the HTTP/REST path
+    via a local replay_server.RestServer. Otherwise FakeClient is called
+    in-process and the REST path isn't exercised.
+    """
+    import app.bot
+    from app.bot import candles
+    from app.common.timer import Timer
+
+    client = api = FakeClient(latency=latency)
+    saved = []
+    pairs = ['PAIR{}BTC'.format(n) for n in range(n_pairs)]
+
+    with contextlib.ExitStack() as stack:
+        if network:
+            from binance.client import Client
+            from replay_server import RestServer
+            rest = RestServer(client)
+            rest.start()
+            stack.callback(rest.shutdown)
+            stack.enter_context(mock.patch.object(Client, 'API_URL',
+                rest.url + 'api'))
+            api = Client('', '')
+        # Run without DB: capture saves, start from empty coverage.
+        stack.enter_context(offline(api, pairs, freqstrs,
+            lambda data, **kwargs: saved.extend(data)))
+
+        t1 = Timer()
+        results = candles.api_update(pairs, freqstrs, silent=True)
+        elapsed = t1.elapsed(unit='s')
+
+        n_keys = sum(1 for n in app.bot.dfc.keys() if n[0] in pairs)
+        print("{:,} klines, {} pages, {} keys in {}s. {} requests, {} "\
+            "rejected, peak weight {}/min. stats={}".format(len(results),
+            candles.stats['pages'], n_keys, elapsed, client.n_requests,
+            client.n_rejected, client.peak_weight, candles.stats))
+        assert len(saved) == len(results)
+        assert n_keys == n_pairs * len(freqstrs)
+
+        # Second pass only queries the uncovered (live) tail of each key.
+        n_requests = client.n_requests
+        candles.api_update(pairs, freqstrs, silent=True)
+        print("Incremental pass: {} requests for {} keys.".format(
+            client.n_requests - n_requests, n_keys))
+        assert client.n_requests - n_requests == n_keys
+    return candles.stats
+
+#------------------------------------------------------------------------------
+def run_failed_pages(freqstrs=['1h']):
+    """Pages the exchange keeps failing must stay coverage gaps, so the next
+    api_update queries them again.
+    """
+    from app.bot import candles, coverage
+    from app.common.utils import strtoms
+    from docs.botconf import DEF_KLINE_HIST_LEN
+
+    pairs = ['OKBTC', 'FAILBTC']
+    start, end = strtoms(DEF_KLINE_HIST_LEN), strtoms("now utc") - 3600000
+
+    with offline(FakeClient(latency=0, fail=['FAILBTC']), pairs, freqstrs), \
+        mock.patch.object(candles, 'query_page',
+            # One attempt per page, skips the retry backoff.
+            functools.partial(candles.query_page, retries=1)):
+        candles.api_update(pairs, freqstrs, silent=True)
+
+        for freqstr in freqstrs:
+            assert len(coverage.gaps('OKBTC', freqstr, start, end)) == 0
+            assert len(coverage.gaps('FAILBTC', freqstr, start, end)) > 0
+        print("Failed pages left as gaps: {}".format(
+            coverage.gaps('FAILBTC', freqstrs[0], start, end)))
+
+#------------------------------------------------------------------------------
+def run_failed_writes(freqstrs=['1h']):
+    """Candles the writer fails to persist must stay coverage gaps, even
+    though their pages were fetched.
+    """
+    from app.bot import candles, coverage, writer
+    from app.common.utils import strtoms
+    from docs.botconf import DEF_KLINE_HIST_LEN
+
+    def bulk_save(data, **kwargs):
+        writer.stats['failed'] += len(data)
+
+    start, end = strtoms(DEF_KLINE_HIST_LEN), strtoms("now utc") - 3600000
+    with offline(FakeClient(latency=0), ['LOSTBTC'], freqstrs, bulk_save), \
+        mock.patch.dict(writer.stats):
+        candles.api_update(['LOSTBTC'], freqstrs, silent=True)
+        for freqstr in freqstrs:
+            assert coverage.ranges('LOSTBTC', freqstr) == []
+    print("Unsaved candles left as gaps.")
+
+##### Main
+if __name__ == '__main__':
+    # Usage: fake_binance.py [--network]
+    run_backfill(network='--network' in sys.argv)
+    run_failed_pages()
+    run_failed_writes()
@@ -0,0 +1,399 @@
+# tests/replay_server.py
+import os,sys,inspect
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+import base64
+import hashlib
+import json
+import socketserver
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+from app.common.histogram import Histogram
+from app.common.timeutils import strtofreq
+from fake_binance import FakeClient, FakeAPIException
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+#------------------------------------------------------------------------------
+class KlineFeed():
+    """Binance kline streams for many <symbol>@kline_<interval> streams on a
+    virtual clock running @speed times real time. Every subscribed stream
+    gets an unclosed update each @update_sec virtual seconds and a closed
+    kline when its period ends, like the exchange.
+    Klines come from recorded @data (candles.dtype record array, see
+    backtest.load_file) where it has them, else from @client's synthetic
+    klines. @client.now_ms follows the virtual clock so REST quotes match
+    the streams.
+    """
+    def __init__(self, client, speed=1.0, update_sec=2.0, data=None,
+        start_ms=None):
+        self.client = client
+        self.speed = speed
+        self.update_sec = update_sec
+        self.recorded = {}
+        if data is not None:
+            for row in data:
+                key = (row['pair'].decode('utf-8'), row['freqstr'].decode('utf-8'),
+                    int(row['open_time']))
+                self.recorded[key] = row
+            start_ms = start_ms or int(data['open_time'].min())
+        self.vt = start_ms or client.now_ms
+        client.now_ms = self.vt
+        # stream name -> [callback(msg)]
+        self.subscribers = {}
+        self.stats = {'sent':0, 'closed':0, 'ticks':0, 'late_ticks':0}
+        self.lock = threading.Lock()
+        self.e_stop = threading.Event()
+        self.thread = None
+
+    #--------------------------------------------------------------------------
+    def subscribe(self, stream, callback):
+        with self.lock:
+            self.subscribers.setdefault(stream, []).append(callback)
+
+    #--------------------------------------------------------------------------
+    def unsubscribe(self, stream, callback):
+        with self.lock:
+            callbacks = self.subscribers.get(stream, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if len(callbacks) == 0:
+                self.subscribers.pop(stream, None)
+
+    #--------------------------------------------------------------------------
+    def start(self):
+        self.thread = threading.Thread(name='KlineFeed', target=self.run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    #--------------------------------------------------------------------------
+    def stop(self):
+        self.e_stop.set()
+        if self.thread:
+            self.thread.join()
+
+    #--------------------------------------------------------------------------
+    def run(self):
+        tick_sec = self.update_sec / self.speed
+        step_ms = int(self.update_sec * 1000)
+        t0 = time.monotonic()
+        n = 0
+
+        while not self.e_stop.isSet():
+            n += 1
+            self.tick(self.vt, self.vt + step_ms)
+            self.vt += step_ms
+            self.client.now_ms = self.vt
+            self.stats['ticks'] += 1
+
+            wait = t0 + n * tick_sec - time.monotonic()
+            if wait > 0:
+                self.e_stop.wait(wait)
+            else:
+                self.stats['late_ticks'] += 1
+
+    #--------------------------------------------------------------------------
+    def tick(self, t_prev, t):
+        """Send closes for periods ended in (@t_prev, @t], then an unclosed
+        update for the open period of every stream.
+        """
+        with self.lock:
+            streams = [(k, list(v)) for k, v in self.subscribers.items()]
+
+        for stream, callbacks in streams:
+            symbol, interval = stream.split('@kline_')
+            symbol = symbol.upper()
+            ms_period = strtofreq(interval) * 1000
+            open_t = t - t % ms_period
+            msgs = []
+            if t_prev - t_prev % ms_period < open_t:
+                msgs.append(self.kline(symbol, interval, open_t - ms_period,
+                    ms_period, True, t))
+            msgs.append(self.kline(symbol, interval, open_t, ms_period, False, t))
+
+            for msg in msgs:
+                for fn in callbacks:
+                    fn(msg)
+                self.stats['sent'] += len(callbacks)
+                self.stats['closed'] += len(callbacks) if msg['k']['x'] else 0
+
+    #--------------------------------------------------------------------------
+    def kline(self, symbol, interval, t, ms_period, closed, event_ms):
+        """Kline stream message for (@symbol, @interval) period at @t.
+        """
+        row = self.recorded.get((symbol, interval, t))
+        if row is not None:
+            k = [t] + [str(row[n]) for n in ['open', 'high', 'low', 'close',
+                'volume']] + [t + ms_period - 1, '0', int(row['trades']),
+                str(row['buy_vol']), '0']
+        else:
+            k = self.client.kline(symbol, t, ms_period)
+        return {'e':'kline', 'E':event_ms, 's':symbol, 'k': {
+            't':k[0], 'T':k[6], 's':symbol, 'i':interval, 'f':0, 'L':0,
+            'o':k[1], 'c':k[4], 'h':k[2], 'l':k[3], 'v':k[5], 'n':k[8],
+            'x':closed, 'q':k[7], 'V':k[9], 'Q':k[10], 'B':'0'}}
+
+#------------------------------------------------------------------------------
+class StreamServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Local websocket server for a KlineFeed. Serves raw streams on
+    /ws/<stream> and combined streams on /stream?streams=<a>/<b>, the same
+    paths BinanceSocketManager uses, so pointing its STREAM_URL at url runs
+    the websock thread unchanged.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, feed, host='localhost', port=0):
+        super().__init__((host, port), _StreamHandler)
+        self.feed = feed
+        self.url = 'ws://{}:{}/'.format(*self.server_address)
+        self.n_conns = 0
+
+    def start(self):
+        t = threading.Thread(name='StreamServer', target=self.serve_forever)
+        t.setDaemon(True)
+        t.start()
+
+#------------------------------------------------------------------------------
+class _StreamHandler(socketserver.StreamRequestHandler):
+    """Minimal RFC 6455 server side: handshake, unmasked text frames out,
+    ping/close handling in.
+    """
+    def handle(self):
+        headers = {}
+        line = self.rfile.readline().decode('latin-1')
+        if not line.startswith('GET '):
+            return
+        path = line.split()[1]
+        while True:
+            h = self.rfile.readline().decode('latin-1').strip()
+            if not h:
+                break
+            k, v = h.split(':', 1)
+            headers[k.strip().lower()] = v.strip()
+
+        accept = base64.b64encode(hashlib.sha1(
+            (headers.get('sec-websocket-key', '') + WS_GUID).encode()).digest())
+        self.wfile.write(b'HTTP/1.1 101 Switching Protocols\r\n'\
+            b'Upgrade: websocket\r\nConnection: Upgrade\r\n'\
+            b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+
+        url = urlparse(path)
+        if url.path.startswith('/stream'):
+            streams = parse_qs(url.query).get('streams', [''])[0].split('/')
+            callbacks = [(n, self._sender(n)) for n in streams if n]
+        else:
+            callbacks = [(url.path[len('/ws/'):], self._sender(None))]
+
+        self.lock = threading.Lock()
+        self.open = True
+        feed = self.server.feed
+        self.server.n_conns += 1
+        [feed.subscribe(n, fn) for n, fn in callbacks]
+        try:
+            self._recv_loop()
+        finally:
+            self.open = False
+            [feed.unsubscribe(n, fn) for n, fn in callbacks]
+            self.server.n_conns -= 1
+
+    def _sender(self, stream):
+        def send(msg):
+            if stream:
+                msg = {'stream':stream, 'data':msg}
+            self.send(0x1, json.dumps(msg, separators=(',',':')).encode())
+        return send
+
+    def send(self, opcode, payload):
+        n = len(payload)
+        if n < 126:
+            header = struct.pack('!BB', 0x80 | opcode, n)
+        elif n < 2**16:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, n)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, n)
+        with self.lock:
+            if not self.open:
+                return
+            try:
+                self.wfile.write(header + payload)
+            except OSError:
+                self.open = False
+
+    def _recv_loop(self):
+        while self.open:
+            head = self.rfile.read(2)
+            if len(head) < 2:
+                return
+            opcode, n = head[0] & 0x0f, head[1] & 0x7f
+            if n == 126:
+                n = struct.unpack('!H', self.rfile.read(2))[0]
+            elif n == 127:
+                n = struct.unpack('!Q', self.rfile.read(8))[0]
+            mask = self.rfile.read(4) if head[1] & 0x80 else b'\0\0\0\0'
+            data = bytes(b ^ mask[i % 4] for i, b in enumerate(self.rfile.read(n)))
+            if opcode == 0x8:
+                self.send(0x8, data[:2])
+                return
+            if opcode == 0x9:
+                self.send(0xA, data)
+
+#------------------------------------------------------------------------------
+class RestServer(HTTPServer):
+    """Local REST endpoints backed by a FakeClient, at the paths
+    binance.client.Client requests. Pointing Client.API_URL at url + 'api'
+    serves candles.query_api, trade.buy/sell quotes and tickers locally.
+    Rate limit rejections come back as HTTP 429.
+    """
+    def __init__(self, client, host='localhost', port=0):
+        super().__init__((host, port), _RestHandler)
+        self.client = client
+        self.url = 'http://{}:{}/'.format(*self.server_address)
+        self.routes = {
+            '/api/v1/ping': lambda q: {},
+            '/api/v1/time': lambda q: {'serverTime':client.now_ms},
+            '/api/v1/exchangeInfo': lambda q: client.get_exchange_info(),
+            '/api/v1/klines': lambda q: client.get_klines(symbol=q['symbol'],
+                interval=q['interval'], limit=int(q.get('limit', 500)),
+                startTime=int(q['startTime']) if 'startTime' in q else None,
+                endTime=int(q['endTime']) if 'endTime' in q else None),
+            '/api/v1/ticker/24hr': lambda q: client.get_ticker(q.get('symbol')),
+            '/api/v3/ticker/bookTicker': lambda q: \
+                client.get_orderbook_ticker(q.get('symbol'))
+        }
+
+    def start(self):
+        t = threading.Thread(name='RestServer', target=self.serve_forever)
+        t.setDaemon(True)
+        t.start()
+
+#------------------------------------------------------------------------------
+class _RestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        route = self.server.routes.get(url.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if route is None:
+            return self._reply(404, {'code':-1, 'msg':'Unknown path'})
+        try:
+            self._reply(200, route(query))
+        except FakeAPIException as e:
+            self._reply(e.status_code, {'code':-1003, 'msg':str(e)})
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+#------------------------------------------------------------------------------
+def run_load(n_pairs=500, freqstrs=None, speed=10, duration=60,
+    network=True, data=None):
+    """Run the live pipeline (websock.recv_kline -> mailbox -> trade thread,
+    journal -> writer -> db.candles, ledger -> db.trades) against a local
+    replay of @n_pairs x @freqstrs kline streams at @speed x real time for
+    @duration seconds, and report throughput and latency.
+    @network: subscribe through websock.run and BinanceSocketManager over
+    the local StreamServer/RestServer. Otherwise the feed calls
+    recv_kline directly, which measures the bot without socket overhead.
+    Requires mongod (docs.conf host).
+    """
+    from threading import Event, Thread
+    from docs.conf import host
+    from docs.botconf import TRD_FREQS
+    import app, app.bot
+    import main
+    from app.bot import journal, ledger, registry, trade, websock, writer
+    from app.common.timer import Timer
+
+    freqstrs = freqstrs or TRD_FREQS
+    pairs = ['PAIR{}BTC'.format(n) for n in range(n_pairs)]
+    client = FakeClient(latency=0, weight_limit=10**9, pairs=pairs)
+    # Start far enough back that replayed candles never close in the future,
+    # which writer.submit would skip.
+    start_ms = client.now_ms - int(duration * speed * 1000) - 3600000
+    feed = KlineFeed(client, speed=speed, data=data,
+        start_ms=start_ms if data is None else None)
+    app.set_db(host)
+
+    recv = Histogram('recv_ms', bounds=[0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+        5, 10, 25, 50, 100])
+    recv_kline = websock.recv_kline
+    def timed_recv(msg):
+        t = time.perf_counter()
+        recv_kline(msg)
+        recv.observe((time.perf_counter() - t) * 1000)
+    websock.recv_kline = timed_recv
+
+    if network:
+        from binance.client import Client
+        from binance.websockets import BinanceSocketManager
+        rest, streams = RestServer(client), StreamServer(feed)
+        rest.start()
+        streams.start()
+        Client.API_URL = rest.url + 'api'
+        BinanceSocketManager.STREAM_URL = streams.url
+        app.bot.client = Client('', '')
+    else:
+        app.bot.client = client
+        [feed.subscribe('{}@kline_{}'.format(p.lower(), f), timed_recv) \
+            for p in pairs for f in freqstrs]
+
+    registry.loaded = True
+    registry.update({p:'ENABLED' for p in pairs})
+    e_pairs, e_kill = Event(), Event()
+    funcs = [trade.run, writer.run, journal.run, ledger.run]
+    funcs += [websock.run] if network else []
+    threads = [Thread(name=fn.__module__, target=fn, args=(e_pairs, e_kill)) \
+        for fn in funcs]
+    [t.setDaemon(True) for t in threads]
+    [t.start() for t in threads]
+
+    t1 = Timer()
+    feed.start()
+    time.sleep(duration)
+    feed.stop()
+    elapsed = t1.elapsed(unit='s')
+
+    # Time from stop until every received closed candle and trade write is
+    # in DB.
+    t2 = Timer()
+    e_kill.set()
+    [t.join(timeout=30) for t in threads]
+    journal.rotate()
+    journal.drain()
+    writer.flush()
+    ledger.drain(timeout=0)
+    persist_ms = t2.elapsed()
+    websock.recv_kline = recv_kline
+
+    brief = lambda h: {k:v for k,v in h.summary().items() if k != 'buckets'}
+    print("{:,} streams, {:,} msgs ({:,} closed) in {}s: {:,.0f} msg/s, "\
+        "{:.1f}x of {}x speed, {} late feed ticks.".format(
+        len(pairs) * len(freqstrs), feed.stats['sent'], feed.stats['closed'],
+        elapsed, feed.stats['sent'] / max(elapsed, 0.001),
+        feed.stats['ticks'] * feed.update_sec / max(elapsed, 0.001), speed,
+        feed.stats['late_ticks']))
+    print("recv_kline: {}".format(brief(recv)))
+    print("trade decision: {}".format(brief(trade.latency)))
+    print("mailbox: {}".format(main.q.metrics()))
+    print("journal: {}\nwriter: {}\nledger: {}".format(journal.stats,
+        writer.stats, ledger.stats))
+    print("Persist drain after stop: {:,.0f} ms.".format(persist_ms))
+    return {'feed':feed.stats, 'recv':recv.summary(),
+        'decision':trade.latency.summary(), 'mailbox':main.q.metrics(),
+        'writer':dict(writer.stats), 'persist_ms':persist_ms}
+
+##### Main
+if __name__ == '__main__':
+    run_load()
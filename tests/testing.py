@@ -28,7 +28,7 @@ from app.bot import candles, macd, scanner, trade, tickers
 app.bot.client = client = Client('','')
 
 def db_load():
-    app.bot.dfc = candles.bulk_load(app.bot.get_pairs(), TRD_FREQS)
+    candles.bulk_load(list(app.bot.get_pairs()), TRD_FREQS)
 
 def histo_hist(df, pair, freqstr, startstr, periods):
     df = df.loc[pair, strtofreq(freqstr)]
@@ -47,6 +47,6 @@ def trades():
 
 ##### Main
 db_load()
-#idx = app.bot.dfc.index.values[-1][0:2]
-#df = macd.generate(app.bot.dfc.ix[idx])
+#idx = app.bot.dfc.keys()[-1]
+#df = macd.generate(app.bot.dfc.frame(*idx))
 #results = macd.plot(app.bot.get_pairs(), '1h', startstr="72 hours ago utc")